@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 from pathlib import Path
 import dj_database_url
@@ -36,6 +37,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "kaiapp.middleware.MetricsMiddleware",  # first, so it times the whole stack
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -156,5 +158,67 @@ CORS_ALLOW_METHODS = ['GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS']
 
 CSRF_TRUSTED_ORIGINS = ["https://kai-backend-zsbd.onrender.com"]
 
+# Shared cache. It holds the catalog and content version tokens (kaiapp/catalog.py)
+# that catalog snapshots and the read endpoints' ETag/304 answers depend on, so it
+# MUST be shared by every worker process on every host: a worker with its own cache
+# keeps serving stale catalogs and 304s after another one writes. The default file
+# cache only covers processes on one machine; with several hosts point every one
+# at the same server, e.g.
+#   DJANGO_CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#   DJANGO_CACHE_LOCATION=redis://cache.internal:6379/1
+# Never use LocMemCache or DummyCache here outside a single-process setup.
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("DJANGO_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.getenv(
+            "DJANGO_CACHE_LOCATION",
+            os.getenv("DJANGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "kai-backend-cache")),
+        ),
+    }
+}
+
+# Async menu generation: in-process worker threads per web process.
+# Set to 0 to leave jobs to `manage.py run_generation_jobs`.
+GENERATION_JOB_WORKERS = int(os.getenv("GENERATION_JOB_WORKERS", "2"))
+# Jobs still running this long after they started are treated as lost (their
+# worker died) and requeued by the next worker that looks for pending jobs.
+GENERATION_JOB_TIMEOUT = int(os.getenv("GENERATION_JOB_TIMEOUT", str(15 * 60)))  # seconds
+
+# LLM provider (kaiapp/llm.py): "openai", "stub" (offline, valid menus solved from
+# the catalog), "record" (LLM_RECORD_PROVIDER, storing answers in the LLM response
+# cache) or "replay" (the cache only). The OpenAI client is built on first use and
+# keeps up to LLM_MAX_CONNECTIONS pooled connections. The older LLM_CACHE_MODE
+# variable ("record" / "replay") still selects those providers when LLM_PROVIDER
+# is not set.
+LLM_PROVIDER = os.getenv("LLM_PROVIDER") or {"record": "record", "replay": "replay"}.get(
+    os.getenv("LLM_CACHE_MODE", ""), "openai"
+)
+LLM_RECORD_PROVIDER = os.getenv("LLM_RECORD_PROVIDER", "openai")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "16"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))  # seconds
+
+# LLM response cache (kaiapp/llm_cache.py) of the record/replay providers, keyed by
+# a hash of prompt + model params.
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", str(BASE_DIR / "llm_cache.sqlite3"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+
+# Monthly plan scheduler constraints (defaults in kaiapp/scheduler.py PLAN_CONSTRAINTS)
+MONTHLY_PLAN_CONSTRAINTS = {}
+
+# /metrics (Prometheus text format). When set, scrapers must send
+# "Authorization: Bearer <METRICS_TOKEN>". Without a token the endpoint is a
+# 404 unless DEBUG is on or the client is in INTERNAL_IPS (comma-separated
+# DJANGO_INTERNAL_IPS); production must set the token.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+INTERNAL_IPS = [ip.strip() for ip in os.getenv("DJANGO_INTERNAL_IPS", "").split(",") if ip.strip()]
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {"kaiapp": {"handlers": ["console"], "level": os.getenv("KAI_LOG_LEVEL", "INFO")}},
+}
+
 
 
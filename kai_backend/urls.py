@@ -1,8 +1,10 @@
 
 from django.contrib import admin
 from django.urls import path, include
+from kaiapp.views import metrics_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('api/', include('kaiapp.urls')),
+    path("metrics", metrics_view, name="metrics"),
 ]
@@ -1,8 +1,10 @@
 from django.contrib import admin
-from decimal import Decimal
 # Register your models here.
 from django.contrib import admin
-from .models import Dietary, Ingredient, Meal, RecipeIngredient
+from .models import Dietary, GenerationJob, Ingredient, Meal, MonthlyPlan, RecipeIngredient
+from .catalog import bump_content_version
+from .planning import rebuild_plan
+from .services import cached_meal_totals, refresh_meal_totals
 
 @admin.register(Dietary)
 class DietaryAdmin(admin.ModelAdmin):
@@ -23,6 +25,12 @@ class RecipeIngredientInline(admin.TabularInline):
 
 @admin.register(Meal)
 class MealAdmin(admin.ModelAdmin):
+    """
+    Totals come from the MealTotals snapshot joined in get_queryset (one
+    query per page, sortable in SQL) through services.meal_totals, the
+    same implementation the API serializer uses. Missing snapshots are
+    written before the changelist is read, so no row walks its items.
+    """
     list_display = (
         "name", "dietary", "total_energy_kj", "total_protein",
         "total_fat", "total_carbs", "total_fiber", "total_cost"
@@ -31,36 +39,60 @@ class MealAdmin(admin.ModelAdmin):
     list_filter = ("dietary",)
     inlines = [RecipeIngredientInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related("dietary").with_totals()
+
+    def changelist_view(self, request, extra_context=None):
+        missing = list(Meal.objects.filter(totals__isnull=True).values_list("pk", flat=True))
+        if missing:
+            refresh_meal_totals(missing)
+        return super().changelist_view(request, extra_context)
+
+    @admin.display(description="Energy (kJ)", ordering="total_energy_kj")
     def total_energy_kj(self, obj):
-        return self._sum_nutrition(obj, "energy_kj")
-    total_energy_kj.short_description = "Energy (kJ)"
+        return self._totals(obj)["energy_kj"]
 
+    @admin.display(description="Protein (g)", ordering="total_protein")
     def total_protein(self, obj):
-        return self._sum_nutrition(obj, "protein")
-    total_protein.short_description = "Protein (g)"
+        return self._totals(obj)["protein"]
 
+    @admin.display(description="Fat (g)", ordering="total_fat")
     def total_fat(self, obj):
-        return self._sum_nutrition(obj, "fat")
-    total_fat.short_description = "Fat (g)"
+        return self._totals(obj)["fat"]
 
+    @admin.display(description="Carbs (g)", ordering="total_carbs")
     def total_carbs(self, obj):
-        return self._sum_nutrition(obj, "carbs")
-    total_carbs.short_description = "Carbs (g)"
+        return self._totals(obj)["carbs"]
 
+    @admin.display(description="Fiber (g)", ordering="total_fiber")
     def total_fiber(self, obj):
-        return self._sum_nutrition(obj, "fiber")
-    total_fiber.short_description = "Fiber (g)"
+        return self._totals(obj)["fiber"]
 
+    @admin.display(description="Cost ($)", ordering="total_cost")
     def total_cost(self, obj):
-        total = Decimal("0.00")
-        for item in obj.items.all():
-            total += item.ingredient.price_per_100g * (item.quantity_g / Decimal("100"))
-        return round(total, 2)
-    total_cost.short_description = "Cost ($)"
-
-    def _sum_nutrition(self, obj, field_name):
-        total = Decimal("0.00")
-        for item in obj.items.all():
-            value_per_100g = getattr(item.ingredient, field_name) or Decimal("0.00")
-            total += value_per_100g * (item.quantity_g / Decimal("100"))
-        return round(total, 2)
+        return self._totals(obj)["cost"]
+
+    def _totals(self, obj):
+        return cached_meal_totals(obj)
+
+@admin.register(GenerationJob)
+class GenerationJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "stage", "progress_done", "progress_total", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = ("meals",)
+
+@admin.register(MonthlyPlan)
+class MonthlyPlanAdmin(admin.ModelAdmin):
+    list_display = ("dietary", "year", "month", "allergen_mask", "revision", "stale", "updated_at")
+    list_filter = ("dietary", "stale")
+    readonly_fields = ("payload", "etag", "updated_at")
+    actions = ["regenerate"]
+
+    @admin.action(description="Regenerate selected plans (new shuffle)")
+    def regenerate(self, request, queryset):
+        rebuilt = 0
+        for plan in queryset:
+            plan.revision += 1
+            rebuilt += rebuild_plan(plan) is not None
+        bump_content_version()
+        self.message_user(request, f"Regenerated {rebuilt} monthly plan(s).")
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class KaiappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "kaiapp"
+
+    def ready(self):
+        # Register signal handlers (MealTotals maintenance)
+        from . import signals  # noqa: F401
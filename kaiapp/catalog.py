@@ -0,0 +1,286 @@
+# kaiapp/catalog.py
+import threading
+from collections import namedtuple
+from uuid import uuid4
+import numpy as np
+from django.core.cache import cache
+from django.db import connection, transaction
+from .models import Dietary, Ingredient, dietary_bit, dietary_mask
+
+# Compact, immutable view of one Ingredient row
+IngredientRecord = namedtuple(
+    "IngredientRecord",
+    ["id", "name", "price_per_100g", "energy_kj", "protein", "fat", "carbs", "fiber", "allergen"],
+)
+
+# Dense per-ingredient vectors in integer hundredths (exact for 2-dp DecimalFields)
+#   index        - {lowercased name: column}
+#   price_cents  - price_per_100g × 100
+#   energy_centi - energy_kj × 100
+CatalogVectors = namedtuple("CatalogVectors", ["index", "price_cents", "energy_centi"])
+
+# Dietary tags of the snapshot
+#   masks        - {ingredient id: dietary_bit()s of its Dietary tags}
+#   dietary_ids  - {lowercased dietary name: [Dietary pk]}
+DietaryIndex = namedtuple("DietaryIndex", ["masks", "dietary_ids"])
+
+# Shared cache key holding the current catalog version token
+CATALOG_VERSION_KEY = "kaiapp:ingredient-catalog-version"
+
+# Shared cache key of the content version: any Ingredient, Meal,
+# RecipeIngredient or Dietary change (read endpoints' ETags, see conditional.py)
+CONTENT_VERSION_KEY = "kaiapp:catalog-content-version"
+
+# This thread's changes not committed yet: {version key: [(private token,
+# its on_commit callback)]}. Only this thread's connection sees those rows,
+# so only its reads fold the token into the version; the shared version
+# moves on commit.
+_uncommitted = threading.local()
+
+
+def _pending_token(key: str) -> str | None:
+    """
+    The private token of this thread's latest write to `key` that can still
+    commit. A rollback (of the transaction or of the savepoint the write was
+    made in) drops the write's on_commit callback, and with it the token.
+    """
+    tokens = getattr(_uncommitted, "tokens", {})
+    writes = tokens.get(key)
+    if not writes:
+        return None
+    pending = {id(func) for _, func, _ in connection.run_on_commit}
+    writes[:] = [(token, func) for token, func in writes if id(func) in pending]
+    if not writes:
+        del tokens[key]
+        return None
+    return writes[-1][0]
+
+
+def _read_version(key: str) -> str:
+    version = cache.get_or_set(key, lambda: uuid4().hex, timeout=None)
+    token = _pending_token(key)
+    return f"{version}:{token}" if token else version
+
+
+def _changed(key: str, bump):
+    """
+    Record a write to the rows behind `key`: bump the shared version once
+    the transaction commits (right away in autocommit mode), and until then
+    give this thread a private version so it sees its own write. No
+    process caches a snapshot or hands out an ETag of rows that may still
+    roll back.
+    """
+    def committed():
+        getattr(_uncommitted, "tokens", {}).pop(key, None)
+        bump()
+
+    transaction.on_commit(committed)
+    if connection.in_atomic_block:
+        if not hasattr(_uncommitted, "tokens"):
+            _uncommitted.tokens = {}
+        _uncommitted.tokens.setdefault(key, []).append((uuid4().hex, committed))
+
+
+def catalog_version() -> str:
+    """
+    Return the current ingredient catalog version token.
+    Stored in Django's cache so every process sharing the cache sees bumps;
+    a missing key (restart, eviction) yields a fresh token, never a stale one.
+    """
+    return _read_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version() -> str:
+    """
+    Invalidate every process-local catalog snapshot.
+    """
+    version = uuid4().hex
+    cache.set(CATALOG_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def catalog_changed():
+    """
+    Invalidate the catalog snapshots once the current transaction commits.
+    """
+    _changed(CATALOG_VERSION_KEY, bump_catalog_version)
+
+
+def content_version() -> str:
+    """
+    Return the current content version token (same storage rules as
+    catalog_version()). Costs one cache read and no database query.
+    """
+    return _read_version(CONTENT_VERSION_KEY)
+
+
+def bump_content_version() -> str:
+    """
+    Invalidate every ETag handed out by the read endpoints.
+    """
+    version = uuid4().hex
+    cache.set(CONTENT_VERSION_KEY, version, timeout=None)
+    return version
+
+
+def content_changed():
+    """
+    Invalidate the read endpoints' ETags once the current transaction commits.
+    """
+    _changed(CONTENT_VERSION_KEY, bump_content_version)
+
+
+class IngredientCatalog:
+    """
+    Process-local cache of the Ingredient table, indexed by lowercased name.
+
+    The snapshot is rebuilt with one query the first time it is read after
+    the catalog version changes. Lookups behave like
+    ``Ingredient.objects.filter(name__iexact=name).first()``.
+
+    Counters:
+        hits   - reads served from the current snapshot
+        misses - reads that had to rebuild the snapshot
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._by_name = {}
+        self._vectors = None  # (by_name it was built from, CatalogVectors)
+        self._dietaries = None  # (by_name it was built from, DietaryIndex, {name: records})
+        self.hits = 0
+        self.misses = 0
+
+    def records(self) -> dict:
+        """
+        Return the {lowercased name: IngredientRecord} index for the current version.
+        """
+        version = catalog_version()
+        if version == self._version:
+            self.hits += 1
+            return self._by_name
+        with self._lock:
+            if version != self._version:
+                self.misses += 1
+                self._by_name = self._load()
+                self._version = version
+            else:
+                self.hits += 1
+            return self._by_name
+
+    def get(self, name):
+        """
+        Case-insensitive lookup; returns an IngredientRecord or None.
+        """
+        return self.records().get(str(name).lower())
+
+    def vectors(self) -> CatalogVectors:
+        """
+        Return dense NumPy vectors for the current snapshot (built once per version).
+        """
+        by_name = self.records()
+        cached = self._vectors
+        if cached is not None and cached[0] is by_name:
+            return cached[1]
+        records = list(by_name.values())
+        vectors = CatalogVectors(
+            index={key: col for col, key in enumerate(by_name)},
+            price_cents=np.array([int(r.price_per_100g.scaleb(2)) for r in records], dtype=np.int64),
+            energy_centi=np.array([int(r.energy_kj.scaleb(2)) for r in records], dtype=np.int64),
+        )
+        self._vectors = (by_name, vectors)
+        return vectors
+
+    def dietary_index(self) -> DietaryIndex:
+        """
+        Return every ingredient's dietary mask and the Dietary pks by name
+        for the current snapshot (two queries, once per version).
+        """
+        by_name = self.records()
+        cached = self._dietaries
+        if cached is not None and cached[0] is by_name:
+            return cached[1]
+        masks = {}
+        for ingredient_id, dietary_id in Ingredient.dietaries.through.objects.values_list(
+            "ingredient_id", "dietary_id"
+        ):
+            masks[ingredient_id] = masks.get(ingredient_id, 0) | dietary_bit(dietary_id)
+        dietary_ids = {}
+        for pk, name in Dietary.objects.order_by("pk").values_list("pk", "name"):
+            dietary_ids.setdefault(name.lower(), []).append(pk)
+        index = DietaryIndex(masks, dietary_ids)
+        self._dietaries = (by_name, index, {})
+        return index
+
+    def for_dietary(self, name: str) -> list:
+        """
+        IngredientRecords tagged with the named dietary (case-insensitive),
+        sorted by name; every ingredient for "Standard". Built once per
+        version and dietary; callers must not mutate the returned list.
+        """
+        index = self.dietary_index()
+        key = str(name).lower()
+        by_dietary = self._dietaries[2]
+        if key not in by_dietary:
+            records = self.records().values()
+            if key != "standard":
+                ids = self._tagged_ids(key, index)
+                records = [r for r in records if r.id in ids]
+            by_dietary[key] = sorted(records, key=lambda r: r.name)
+        return by_dietary[key]
+
+    @staticmethod
+    def _tagged_ids(key, index) -> set:
+        dietary_ids = index.dietary_ids.get(key, [])
+        # Tags can only be read back from the masks for pks that have a bit
+        if all(dietary_bit(pk) for pk in dietary_ids):
+            mask = dietary_mask(dietary_ids)
+            return {i for i, m in index.masks.items() if m & mask}
+        return set(
+            Ingredient.dietaries.through.objects.filter(dietary_id__in=dietary_ids)
+            .values_list("ingredient_id", flat=True)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "size": len(self._by_name),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    @staticmethod
+    def _load() -> dict:
+        by_name = {}
+        rows = Ingredient.objects.order_by("pk").values_list(*IngredientRecord._fields)
+        for row in rows:
+            record = IngredientRecord(*row)
+            # Lowest pk wins on case-insensitive duplicates, like .first()
+            by_name.setdefault(record.name.lower(), record)
+        return by_name
+
+
+ingredient_catalog = IngredientCatalog()
+
+
+def parse_dietaries(text: str | None) -> int:
+    """
+    dietary_mask() of a comma-separated list of dietary names
+    ("Halal,Gluten-free"), case-insensitive; "Standard" adds nothing.
+    Raises ValueError naming unknown dietaries or ones without a bit.
+    """
+    names = [name.strip() for name in (text or "").split(",") if name.strip()]
+    if not names:
+        return 0
+    dietary_ids = ingredient_catalog.dietary_index().dietary_ids
+    mask, unknown = 0, []
+    for name in names:
+        if name.lower() == "standard":
+            continue
+        bits = dietary_mask(dietary_ids.get(name.lower(), []))
+        if not bits:
+            unknown.append(name)
+        mask |= bits
+    if unknown:
+        raise ValueError(f"Unknown dietaries: {', '.join(unknown)}.")
+    return mask
@@ -0,0 +1,426 @@
+# kaiapp/catalog_loader.py
+"""
+Streaming catalog import behind `manage.py load_catalog`.
+
+Records look like Django fixture entries,
+
+    {"model": "kaiapp.ingredient", "pk": 1, "fields": {"name": "Rice", ...}}
+
+and are read one at a time from a JSON array, NDJSON or CSV file in any
+of UTF-8 / UTF-16 (BOM or not). They are buffered up to `chunk_size` and
+then upserted model by model (Dietary, Ingredient + dietary links, Meal,
+RecipeIngredient) with bulk_create / bulk_update in one transaction per
+chunk, so memory stays bounded by the chunk, not the file.
+
+Matching existing rows:
+  - by pk when the record has one (like loaddata)
+  - otherwise by natural key: Dietary / Ingredient / Meal name,
+    RecipeIngredient (recipe, ingredient)
+Foreign keys and `dietaries` accept a pk or a name.
+
+Bulk writes skip signals, so MealTotals are refreshed per chunk and the
+catalog / content versions and monthly plans are updated at the end.
+"""
+import codecs
+import csv
+import io
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+from .catalog import bump_catalog_version, content_changed
+from .models import Dietary, Ingredient, Meal, RecipeIngredient
+from .planning import invalidate_monthly_plans
+from .services import refresh_meal_totals
+
+FORMATS = ("json", "ndjson", "csv")
+
+# Upsert order: each model only references the ones before it
+MODELS = {
+    "dietary": Dietary,
+    "ingredient": Ingredient,
+    "meal": Meal,
+    "recipeingredient": RecipeIngredient,
+}
+
+# Ingredient fields that change the MealTotals snapshot of meals using the ingredient
+SNAPSHOT_FIELDS = {"price_per_100g", "energy_kj", "protein", "fat", "carbs", "fiber", "allergen"}
+
+# Separator of several dietaries in one CSV cell ("1|3" or "Vegan|Halal")
+CSV_LIST_SEPARATOR = "|"
+
+
+class CatalogLoadError(Exception):
+    """
+    A record that cannot be read or stored (the current chunk is rolled back).
+    """
+
+
+# ---------- reading ----------
+def detect_encoding(head: bytes) -> str:
+    """
+    Encoding of a file from its first bytes: BOM first, then the NUL-byte
+    pattern of BOM-less UTF-16 text, else UTF-8.
+    """
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    if len(head) >= 2 and head[0] == 0 and head[1] != 0:
+        return "utf-16-be"
+    if len(head) >= 2 and head[0] != 0 and head[1] == 0:
+        return "utf-16-le"
+    return "utf-8"
+
+
+def open_text(path, encoding: str | None = None):
+    """
+    Open `path` as text, detecting the encoding unless one is given.
+    """
+    raw = open(path, "rb")
+    try:
+        encoding = encoding or detect_encoding(raw.read(4))
+        raw.seek(0)
+        return io.TextIOWrapper(raw, encoding=encoding, newline="")
+    except Exception:
+        raw.close()
+        raise
+
+
+def detect_format(path: str, text) -> str:
+    """
+    "csv" / "ndjson" from the file extension, otherwise a JSON array when
+    the first non-blank character is "[" and NDJSON when it is "{".
+    """
+    lowered = str(path).lower()
+    if lowered.endswith(".csv"):
+        return "csv"
+    if lowered.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    while True:
+        ch = text.read(1)
+        if not ch:
+            raise CatalogLoadError("The file is empty.")
+        if not ch.isspace():
+            text.seek(0)
+            return "json" if ch == "[" else "ndjson"
+
+
+def iter_json_array(text, chunk_chars: int = 1 << 16):
+    """
+    Yield the elements of a top-level JSON array, reading `text` in chunks.
+    Only the element being decoded and one chunk are held in memory.
+    """
+    decoder = json.JSONDecoder()
+    buf, pos, eof, opened = "", 0, False, False
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or (opened and buf[pos] == ",")):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                raise CatalogLoadError("Unexpected end of file inside the JSON array.")
+            chunk = text.read(chunk_chars)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if not opened:
+            if buf[pos] != "[":
+                raise CatalogLoadError("A JSON catalog must be an array of records.")
+            opened, pos = True, pos + 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if eof:
+                raise CatalogLoadError(f"Invalid JSON: {e}") from e
+            chunk = text.read(chunk_chars)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield item
+
+
+def iter_ndjson(text):
+    for line_no, line in enumerate(text, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                raise CatalogLoadError(f"Line {line_no}: invalid JSON ({e}).") from e
+
+
+def iter_csv(text, model: str | None = None):
+    """
+    Records from CSV rows with a `model` column (or the `model` argument),
+    an optional `pk` column and one column per field. Empty cells are left
+    out, so updates keep the stored value; `dietaries` lists are "|"-separated.
+    """
+    for row in csv.DictReader(text):
+        row = {key.strip(): value for key, value in row.items() if key}
+        fields = {key: value for key, value in row.items() if key not in ("model", "pk") and value != ""}
+        if "dietaries" in fields:
+            fields["dietaries"] = [v.strip() for v in fields["dietaries"].split(CSV_LIST_SEPARATOR) if v.strip()]
+        yield {"model": row.get("model") or model, "pk": row.get("pk") or None, "fields": fields}
+
+
+def iter_records(text, fmt: str, model: str | None = None):
+    if fmt == "json":
+        return iter_json_array(text)
+    if fmt == "ndjson":
+        return iter_ndjson(text)
+    if fmt == "csv":
+        return iter_csv(text, model)
+    raise CatalogLoadError(f"Unknown format {fmt!r}; choose from {', '.join(FORMATS)}.")
+
+
+# ---------- writing ----------
+class CatalogLoader:
+    """
+    Upsert a stream of records in chunks; see the module docstring.
+
+    Args:
+        chunk_size (int): Records buffered per transaction.
+        progress (callable|None): Called with a status line after each chunk.
+
+    Attributes:
+        stats (dict): {model label: {"created": n, "updated": n}}.
+    """
+    def __init__(self, chunk_size: int = 1000, progress=None):
+        self.chunk_size = max(1, chunk_size)
+        self.progress = progress
+        self.stats = {label: {"created": 0, "updated": 0} for label in MODELS}
+        self.records = 0
+        self._buffers = {label: [] for label in MODELS}
+        self._buffered = 0
+        self._explicit_pks = set()   # labels created with pks from the file
+
+    def load(self, records) -> dict:
+        for record in records:
+            self.records += 1
+            label, pk, fields = self._parse(record)
+            self._buffers[label].append((self.records, pk, fields))
+            self._buffered += 1
+            if self._buffered >= self.chunk_size:
+                self.flush()
+        self.flush()
+        self.finish()
+        return self.stats
+
+    def _parse(self, record):
+        n = self.records
+        if not isinstance(record, dict) or not isinstance(record.get("fields"), dict):
+            raise CatalogLoadError(f"Record {n}: expected {{'model', 'pk', 'fields'}}.")
+        label = str(record.get("model") or "").lower().rpartition(".")[2]
+        if label not in MODELS:
+            raise CatalogLoadError(f"Record {n}: unknown model {record.get('model')!r}.")
+        pk = record.get("pk")
+        if pk is not None:
+            try:
+                pk = int(pk)
+            except (TypeError, ValueError):
+                raise CatalogLoadError(f"Record {n}: pk must be an integer, got {pk!r}.")
+        return label, pk, record["fields"]
+
+    def flush(self):
+        if not self._buffered:
+            return
+        try:
+            with transaction.atomic():
+                meals = set()
+                for label in MODELS:
+                    if self._buffers[label]:
+                        meals |= self._upsert(label, self._buffers[label])
+                # bulk writes skip the totals signals
+                meals = sorted(meals)
+                for start in range(0, len(meals), 500):
+                    refresh_meal_totals(meals[start:start + 500])
+        except DatabaseError as e:  # IntegrityError, DataError (over-long value, overflow), ...
+            raise CatalogLoadError(f"Records up to {self.records}: {e}") from e
+        self._buffers = {label: [] for label in MODELS}
+        self._buffered = 0
+        if self.progress:
+            counts = ", ".join(
+                f"{label} +{s['created']}/~{s['updated']}" for label, s in self.stats.items()
+            )
+            self.progress(f"{self.records} records ({counts})")
+
+    def finish(self):
+        if self._explicit_pks:
+            models = [MODELS[label] for label in MODELS if label in self._explicit_pks]
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                    cursor.execute(sql)
+        if any(s["created"] or s["updated"] for s in self.stats.values()):
+            bump_catalog_version()
+            content_changed()
+            invalidate_monthly_plans()
+
+    # ---------- per model ----------
+    def _upsert(self, label: str, rows: list) -> set:
+        """
+        Write one model's buffered records. Returns the meal ids whose
+        totals may have changed.
+        """
+        model = MODELS[label]
+        parsed = [(n, pk, *self._values(model, n, fields)) for n, pk, fields in rows]
+        self._resolve_references(model, parsed)
+
+        # Last record wins when the chunk repeats a row
+        by_key = {}
+        for n, pk, values, dietaries in parsed:
+            key = ("pk", pk) if pk is not None else ("natural", self._natural_key(label, values, n))
+            by_key[key] = (pk, values, dietaries)
+        existing = self._existing(label, by_key)
+
+        to_create, updates, links, relinked = [], {}, [], set()
+        for key, (pk, values, dietaries) in by_key.items():
+            found = existing.get(key)
+            instance = model(pk=found if found is not None else pk, **values)
+            if found is None:
+                to_create.append(instance)
+                if pk is not None:
+                    self._explicit_pks.add(label)
+            else:
+                names = tuple(sorted(model._meta.get_field(a).name for a in values))
+                updates.setdefault(names, []).append(instance)
+            if dietaries is not None:
+                links.append((instance, dietaries))
+                if found is not None:
+                    relinked.add(found)  # retagging moves the dietary masks of its meals
+
+        model.objects.bulk_create(to_create, batch_size=1000)
+        for fields, instances in updates.items():
+            if fields:
+                model.objects.bulk_update(instances, fields, batch_size=1000)
+        self.stats[label]["created"] += len(to_create)
+        self.stats[label]["updated"] += sum(len(v) for v in updates.values())
+        if links:
+            self._replace_dietaries(links)
+        return self._affected_meals(label, to_create, updates, relinked)
+
+    def _values(self, model, n: int, fields: dict):
+        """
+        ({attname: python value}, dietaries list or None) for one record;
+        foreign keys stay raw until _resolve_references().
+        """
+        values, dietaries = {}, None
+        for name, value in fields.items():
+            if model is Ingredient and name == "dietaries":
+                dietaries = value if isinstance(value, list) else [value]
+                continue
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise CatalogLoadError(f"Record {n}: unknown field {model.__name__}.{name}.")
+            if field.primary_key or field.many_to_many or field.auto_created:
+                continue
+            if field.many_to_one:
+                values[field.attname] = value
+                continue
+            try:
+                values[field.attname] = field.to_python(value)
+            except ValidationError as e:
+                raise CatalogLoadError(f"Record {n}: {name}: {'; '.join(e.messages)}")
+        return values, dietaries
+
+    def _resolve_references(self, model, parsed):
+        """
+        Replace name references in foreign keys with pks (one query per
+        referenced model and chunk).
+        """
+        for field in model._meta.concrete_fields:
+            if not field.many_to_one:
+                continue
+            names = {
+                values[field.attname] for _, _, values, _ in parsed
+                if isinstance(values.get(field.attname), str) and not values[field.attname].isdigit()
+            }
+            ids = name_map(field.related_model, names)
+            for n, _, values, _ in parsed:
+                if field.attname not in values:
+                    continue
+                ref = values[field.attname]
+                if ref is None or ref == "":
+                    values[field.attname] = None
+                elif isinstance(ref, int) or str(ref).isdigit():
+                    values[field.attname] = int(ref)
+                elif ref in ids:
+                    values[field.attname] = ids[ref]
+                else:
+                    raise CatalogLoadError(f"Record {n}: no {field.related_model.__name__} named {ref!r}.")
+
+    def _natural_key(self, label: str, values: dict, n: int):
+        if label == "recipeingredient":
+            key = (values.get("recipe_id"), values.get("ingredient_id"))
+            if None in key:
+                raise CatalogLoadError(f"Record {n}: recipe and ingredient are required without a pk.")
+            return key
+        if not values.get("name"):
+            raise CatalogLoadError(f"Record {n}: name is required without a pk.")
+        return values["name"]
+
+    def _existing(self, label: str, by_key: dict) -> dict:
+        """
+        {key: pk of the stored row} for the keys of one chunk.
+        """
+        model = MODELS[label]
+        pks = [value for kind, value in by_key if kind == "pk"]
+        natural = [value for kind, value in by_key if kind == "natural"]
+        found = {("pk", pk): pk for pk in model.objects.filter(pk__in=pks).values_list("pk", flat=True)}
+        if natural and label == "recipeingredient":
+            recipes = {recipe for recipe, _ in natural}
+            wanted = set(natural)
+            for pk, recipe, ingredient in RecipeIngredient.objects.filter(recipe_id__in=recipes).values_list(
+                "pk", "recipe_id", "ingredient_id"
+            ):
+                if (recipe, ingredient) in wanted:
+                    found[("natural", (recipe, ingredient))] = pk
+        elif natural:
+            for name, pk in name_map(model, set(natural)).items():
+                found[("natural", name)] = pk
+        return found
+
+    def _replace_dietaries(self, links):
+        Through = Ingredient.dietaries.through
+        names = {d for _, dietaries in links for d in dietaries if not str(d).isdigit()}
+        ids = name_map(Dietary, names)
+        rows = []
+        for ingredient, dietaries in links:
+            for ref in dietaries:
+                dietary_id = int(ref) if str(ref).isdigit() else ids.get(ref)
+                if dietary_id is None:
+                    raise CatalogLoadError(f"Ingredient {ingredient.name!r}: no Dietary named {ref!r}.")
+                rows.append(Through(ingredient_id=ingredient.pk, dietary_id=dietary_id))
+        Through.objects.filter(ingredient_id__in=[ingredient.pk for ingredient, _ in links]).delete()
+        Through.objects.bulk_create(rows, batch_size=5000, ignore_conflicts=True)
+
+    def _affected_meals(self, label: str, created, updates, relinked=()) -> set:
+        if label == "recipeingredient":
+            touched = [i.recipe_id for i in created]
+            touched += [i.recipe_id for fields, items in updates.items() for i in items]
+            return set(touched)
+        if label == "meal":
+            return {m.pk for m in created}
+        if label == "ingredient":
+            changed = [i.pk for fields, items in updates.items() if SNAPSHOT_FIELDS & set(fields) for i in items]
+            changed = {*changed, *relinked}
+            if changed:
+                return set(
+                    RecipeIngredient.objects.filter(ingredient_id__in=changed)
+                    .values_list("recipe_id", flat=True).distinct()
+                )
+        return set()
+
+
+def name_map(model, names) -> dict:
+    """
+    {name: pk} for the given names (the lowest pk when a name repeats).
+    """
+    if not names:
+        return {}
+    ids = {}
+    for pk, name in model.objects.filter(name__in=names).order_by("-pk").values_list("pk", "name"):
+        ids[name] = pk
+    return ids
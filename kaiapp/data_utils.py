@@ -1,5 +1,8 @@
+import logging
 from kaiapp.models import Ingredient, Dietary
 
+logger = logging.getLogger(__name__)
+
 def load_ingredients():
     """
     Load all ingredients from the database and return them as a list of dicts.
@@ -18,7 +21,7 @@ def load_ingredients():
         ]
     except Exception as e:
         # Log error if the query fails
-        print(f"Failed to load charity cache: {e}")
+        logger.exception("Failed to load charity cache: %s", e)
         return []
         
 def get_ingredients_for_dietary(dietary: str):
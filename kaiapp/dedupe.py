@@ -0,0 +1,193 @@
+# kaiapp/dedupe.py
+"""
+Duplicate and near-duplicate meal detection.
+
+Every meal has
+  - a fingerprint (MealTotals.fingerprint): SHA-1 of its sorted ingredient
+    ids and quantity profile (each ingredient's share of the weight, in
+    PROFILE_STEPS steps), so a recipe and its scaled copy match exactly;
+  - a MinHash signature of its ingredient set, cut into BANDS buckets
+    stored as MealBand rows. Meals sharing a bucket are candidates; their
+    ingredient sets are then compared exactly (Jaccard similarity).
+
+With 8 bands of 4 rows, sets with Jaccard 0.8 share a bucket with
+probability ~0.98 and sets with Jaccard 0.3 with ~0.06, so a lookup reads
+a handful of candidates instead of the whole catalog.
+
+Meals only duplicate meals of the same dietary.
+"""
+import hashlib
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+import numpy as np
+from .models import Meal, MealBand, RecipeIngredient
+
+SIGNATURE_SIZE = 32
+BANDS = 8
+ROWS_PER_BAND = SIGNATURE_SIZE // BANDS
+
+# Ingredient sets at least this similar (Jaccard) are near-duplicates
+NEAR_DUPLICATE_JACCARD = 0.8
+
+# Quantity profile resolution: shares of the meal's weight in 5% steps
+PROFILE_STEPS = 20
+
+# Universal hashing mod the Mersenne prime 2^31 - 1; coefficients are derived
+# from fixed labels so stored buckets stay valid across processes and upgrades
+_PRIME = (1 << 31) - 1
+
+
+def _coefficients(label: str) -> np.ndarray:
+    return np.array([
+        int.from_bytes(hashlib.blake2b(f"{label}{i}".encode(), digest_size=8).digest(), "big") % (_PRIME - 1) + 1
+        for i in range(SIGNATURE_SIZE)
+    ], dtype=np.uint64)
+
+
+_A = _coefficients("kai-minhash-a")
+_B = _coefficients("kai-minhash-b")
+
+# A duplicate found by DuplicateIndex.match()
+#   kind       - "duplicate" (same fingerprint) or "near-duplicate"
+#   key        - key the matching entry was added under (a meal pk for catalog meals)
+#   similarity - Jaccard similarity of the ingredient sets
+Match = namedtuple("Match", ["kind", "key", "similarity"])
+
+
+def fingerprint(pairs) -> str:
+    """
+    Canonical fingerprint of (ingredient id, quantity_g) pairs; "" if empty.
+    Repeated ingredients are merged.
+    """
+    quantities = defaultdict(Decimal)
+    for ingredient_id, quantity in pairs:
+        quantities[ingredient_id] += Decimal(str(quantity))
+    if not quantities:
+        return ""
+    total = sum(quantities.values())
+    profile = ",".join(
+        f"{ingredient_id}:{round(quantity / total * PROFILE_STEPS) if total else 0}"
+        for ingredient_id, quantity in sorted(quantities.items())
+    )
+    return hashlib.sha1(profile.encode()).hexdigest()
+
+
+def signature(ingredient_ids) -> np.ndarray:
+    """
+    MinHash signature (SIGNATURE_SIZE values) of a non-empty set of ingredient ids.
+    """
+    ids = np.array(sorted(set(ingredient_ids)), dtype=np.uint64) % _PRIME
+    return ((np.outer(ids, _A) + _B) % _PRIME).min(axis=0)
+
+
+def band_keys(ingredient_ids) -> list[int]:
+    """
+    The BANDS signed 64-bit bucket keys of an ingredient set ([] if empty).
+    """
+    if not ingredient_ids:
+        return []
+    sig = signature(ingredient_ids)
+    keys = []
+    for band in range(BANDS):
+        rows = sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(bytes([band]) + rows.tobytes(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def jaccard(a, b) -> float:
+    a, b = set(a), set(b)
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def write_bands(ingredient_sets: dict, replace: bool = True):
+    """
+    Store the MealBand rows of {meal id: ingredient ids}; with `replace`,
+    the meals' previous rows are deleted first.
+    """
+    if not ingredient_sets:
+        return
+    if replace:
+        MealBand.objects.filter(meal_id__in=list(ingredient_sets)).delete()
+    MealBand.objects.bulk_create([
+        MealBand(meal_id=meal_id, bucket=key)
+        for meal_id, ids in ingredient_sets.items()
+        for key in band_keys(ids)
+    ], batch_size=5000)
+
+
+class DuplicateIndex:
+    """
+    In-memory LSH index of ingredient sets, keyed by caller-chosen keys.
+
+    Build one over the whole catalog (merge_duplicate_meals) or over just the
+    catalog meals sharing a bucket with some new menus (from_catalog()), then
+    match() each menu and add() the ones that are kept.
+    """
+    def __init__(self, threshold: float = NEAR_DUPLICATE_JACCARD):
+        self.threshold = threshold
+        self._buckets = defaultdict(list)  # band key -> [entry key]
+        self._entries = {}  # key -> (dietary, frozenset of ingredient ids, fingerprint)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @classmethod
+    def from_catalog(cls, ingredient_sets, threshold: float = NEAR_DUPLICATE_JACCARD):
+        """
+        Index the catalog meals sharing a bucket with any of the given
+        ingredient sets (three indexed queries, whatever the catalog size).
+        """
+        index = cls(threshold)
+        keys = {key for ids in ingredient_sets for key in band_keys(ids)}
+        if not keys:
+            return index
+        meal_ids = set(
+            MealBand.objects.filter(bucket__in=keys).values_list("meal_id", flat=True)
+        )
+        if not meal_ids:
+            return index
+        members = defaultdict(set)
+        for meal_id, ingredient_id in RecipeIngredient.objects.filter(
+            recipe_id__in=meal_ids
+        ).values_list("recipe_id", "ingredient_id"):
+            members[meal_id].add(ingredient_id)
+        for meal_id, dietary, meal_fingerprint in Meal.objects.filter(
+            pk__in=meal_ids
+        ).values_list("pk", "dietary__name", "totals__fingerprint"):
+            if members[meal_id]:
+                index.add(meal_id, dietary, members[meal_id], meal_fingerprint)
+        return index
+
+    def add(self, key, dietary, ingredient_ids, meal_fingerprint: str):
+        ids = frozenset(ingredient_ids)
+        self._entries[key] = ((dietary or "").lower(), ids, meal_fingerprint)
+        for bucket in band_keys(ids):
+            self._buckets[bucket].append(key)
+
+    def match(self, dietary, ingredient_ids, meal_fingerprint: str, exact_only: bool = False):
+        """
+        Return the best Match among indexed entries of the same dietary, or
+        None: the earliest added exact fingerprint match, else the most
+        similar near-duplicate. `exact_only` skips near-duplicates.
+        """
+        ids = frozenset(ingredient_ids)
+        dietary = (dietary or "").lower()
+        best = None
+        seen = set()
+        for bucket in band_keys(ids):
+            for key in self._buckets.get(bucket, ()):
+                if key in seen:
+                    continue
+                seen.add(key)
+                entry_dietary, entry_ids, entry_fingerprint = self._entries[key]
+                if entry_dietary != dietary:
+                    continue
+                if meal_fingerprint and entry_fingerprint == meal_fingerprint:
+                    return Match("duplicate", key, jaccard(ids, entry_ids))
+                if exact_only:
+                    continue
+                similarity = jaccard(ids, entry_ids)
+                if similarity >= self.threshold and (best is None or similarity > best.similarity):
+                    best = Match("near-duplicate", key, similarity)
+        return best
@@ -0,0 +1,617 @@
+# kaiapp/generation.py
+import json
+import logging
+import math
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from typing import Iterable
+from django.db import transaction
+from . import metrics
+from .catalog import IngredientRecord, content_changed, ingredient_catalog
+from .dedupe import DuplicateIndex, fingerprint, write_bands
+from .json_stream import JSONArrayStream
+from .llm import get_provider
+from .llm_cache import LLMCacheMiss
+from .menu_engine import build_local_menus, classify, repair_quantities
+from .models import Ingredient, Meal, MealTotals, RecipeIngredient, Dietary
+from .planning import invalidate_monthly_plans
+from .services import ingredient_dietary_masks, meal_snapshot, validate_menus_batch
+from .prompts import build_menu_prompt
+
+logger = logging.getLogger(__name__)
+
+# Acceptance limits for generated menus (see services.validate_menu)
+GENERATION_LIMITS = {"min_kj": 2000, "max_cost": 3.5, "min_g": 200, "max_g": 500}
+
+# Upper bound on concurrent LLM sub-requests per generation request
+MAX_LLM_CONCURRENCY = 8
+
+# Menu sources: the LLM, or the deterministic local solver (menu_engine.py)
+ENGINES = ("llm", "local")
+
+# Chat completion parameters for menu prompts
+LLM_PARAMS = {"model": "gpt-4o-mini", "response_format": {"type": "json_object"}, "temperature": 0.4}
+
+
+class GenerationError(Exception):
+    """
+    A generation request that cannot produce menus
+    (invalid options, too few ingredients, unusable model output).
+    """
+
+
+# ---------- helpers ----------
+DIETARY_CANONICAL = {
+    "standard": "Standard",
+    "vegan": "Vegan",
+    "vegetarian": "Vegetarian",
+    "halal": "Halal",
+    "gluten-free": "Gluten-free",
+    "gluten_free": "Gluten-free",
+    "glutenfree": "Gluten-free",
+}
+
+def normalize_dietary(name: str | None) -> str:
+    """
+    Normalize dietary string input (case-insensitive, handles aliases).
+    Examples:
+        - "vegan", "Vegan" -> "Vegan"
+        - "gluten_free" -> "Gluten-free"
+        - None or unknown -> "Standard"
+    """
+    if not name:
+        return "Standard"
+    key = str(name).strip().lower()
+    return DIETARY_CANONICAL.get(key, "Standard")
+
+def get_ingredients_for_dietary(dietary: str) -> list[IngredientRecord]:
+    """
+    IngredientRecords sorted by name, from the ingredient catalog's cached
+    per-dietary sets (no query while the catalog version is unchanged):
+    - Standard: all ingredients
+    - Others: ingredients that have that Dietary tag (ManyToMany)
+    """
+    return ingredient_catalog.for_dietary(dietary)
+
+def to_prompt_block(ings: Iterable[Ingredient]) -> str:
+    """
+    Convert ingredients to the concise block the prompt expects:
+    'name, price_per_100g, energy_kj'
+    """
+    lines = []
+    for i in ings:
+        price = f"{i.price_per_100g:.2f}"
+        kj = f"{i.energy_kj:.0f}"
+        lines.append(f"{i.name}, {price}, {kj}")
+    return "\n".join(lines)
+
+def create_completion(**params):
+    """
+    A chat completion from the configured LLM provider (llm.py), recording
+    latency and resp.usage in metrics.py. Streamed calls are recorded when
+    the stream ends.
+    """
+    started = time.perf_counter()
+    try:
+        resp = get_provider().create(**params)
+    except Exception:
+        metrics.observe_llm_call(params["model"], time.perf_counter() - started, error=True)
+        raise
+    if params.get("stream"):
+        return _observed_stream(resp, params["model"], started)
+    metrics.observe_llm_call(params["model"], time.perf_counter() - started, getattr(resp, "usage", None))
+    return resp
+
+def _observed_stream(chunks, model: str, started: float):
+    usage, error = None, True
+    try:
+        for chunk in chunks:
+            usage = getattr(chunk, "usage", None) or usage
+            yield chunk
+        error = False
+    finally:
+        metrics.observe_llm_call(model, time.perf_counter() - started, usage, error=error)
+
+def request_menus(prompt: str) -> list[dict]:
+    """
+    Send one prompt to the LLM and return the parsed `menus` list.
+    Raises ValueError if the completion is not the expected JSON, and
+    LLMCacheMiss if LLM_PROVIDER is "replay" and the prompt was never recorded.
+    """
+    resp = create_completion(**LLM_PARAMS, messages=[{"role": "user", "content": prompt}])
+    try:
+        payload = json.loads(resp.choices[0].message.content)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError("Model did not return valid JSON.") from e
+    menus = payload.get("menus", []) if isinstance(payload, dict) else None
+    if not isinstance(menus, list):
+        raise ValueError("`menus` must be a list.")
+    return menus
+
+def split_batch(batch_size: int, chunk_size: int) -> list[int]:
+    """
+    Split batch_size menus into sub-batches of at most chunk_size.
+    Example: split_batch(10, 4) -> [4, 3, 3]
+    """
+    parts = max(1, math.ceil(batch_size / max(1, chunk_size)))
+    base, extra = divmod(batch_size, parts)
+    return [base + (1 if i < extra else 0) for i in range(parts)]
+
+def stream_menu_text(prompt: str):
+    """
+    Yield the completion for one prompt as text chunks, as the model streams them
+    (the record/replay providers stream it as a single chunk).
+    """
+    messages = [{"role": "user", "content": prompt}]
+    chunks = create_completion(
+        **LLM_PARAMS, messages=messages, stream=True, stream_options={"include_usage": True},
+    )
+    for chunk in chunks:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def menu_signature(m: dict) -> tuple:
+    """
+    (lowercased meal name, frozenset of (ingredient name, quantity)) used to spot repeats.
+    """
+    name = str(m.get("meal_name") or "").strip().lower()
+    items = frozenset(
+        (str(it.get("name", "")).lower(), str(it.get("quantity_g")))
+        for it in (m.get("items") or []) if isinstance(it, dict)
+    )
+    return name, items
+
+def dedupe_menus(menus: list) -> list:
+    """
+    Drop menus that repeat an earlier meal name or the exact same items
+    (case-insensitive names, same quantities). Keeps the first occurrence.
+    """
+    seen_names, seen_items, unique = set(), set(), []
+    for m in menus:
+        if not isinstance(m, dict):
+            continue
+        name, items = menu_signature(m)
+        if (name and name in seen_names) or (items and items in seen_items):
+            continue
+        seen_names.add(name)
+        seen_items.add(items)
+        unique.append(m)
+    return unique
+
+def fetch_menus(ingredients_block: str, batch_size: int, dietary: str,
+                chunk_size: int | None = None, concurrency: int = 1) -> list:
+    """
+    Ask the LLM for batch_size menus, split into sub-requests of chunk_size
+    menus that run on up to `concurrency` threads, then merge and dedupe.
+    Failed sub-requests are skipped; ValueError is raised only if all fail.
+    """
+    sizes = split_batch(batch_size, chunk_size or batch_size)
+    prompts = [build_menu_prompt(ingredients_block, batch_size=n, dietary=dietary) for n in sizes]
+    if len(prompts) == 1:
+        return dedupe_menus(request_menus(prompts[0]))
+
+    workers = max(1, min(concurrency, MAX_LLM_CONCURRENCY, len(prompts)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(request_menus, p) for p in prompts]
+    menus, errors = [], []
+    for future in futures:
+        try:
+            menus.extend(future.result())
+        except Exception as e:
+            errors.append(e)
+    if len(errors) == len(futures):
+        if isinstance(errors[0], LLMCacheMiss):
+            raise errors[0]
+        raise ValueError("Model did not return valid JSON.") from errors[0]
+    return dedupe_menus(menus)
+
+
+# ---------- validation + repair ----------
+def repair_menu(menu: dict, limits=GENERATION_LIMITS) -> dict | None:
+    """
+    Quantity repair for a menu that failed validation: keep its ingredients
+    and look for the smallest change of carb, then protein, then booster
+    quantities that satisfies the limits (menu_engine.repair_quantities).
+    Returns the repaired menu, or None if the ingredients are unknown, a
+    quantity is not numeric, or no adjustment works.
+    """
+    items = menu.get("items") or []
+    ings = [ingredient_catalog.get(str(it.get("name", ""))) for it in items]
+    if not items or not all(ings):
+        return None
+    try:
+        quantities = [Decimal(str(it["quantity_g"])) for it in items]
+    except Exception:
+        return None
+    if not all(q.is_finite() for q in quantities):
+        return None
+    roles = [classify(ing) for ing in ings]
+    repaired = repair_quantities(ings, roles, [it["quantity_g"] for it in items], limits)
+    if repaired is None:
+        return None
+    return {**menu, "items": [{**it, "quantity_g": q} for it, q in zip(items, repaired)]}
+
+def screen_menus(menus: list, limits=GENERATION_LIMITS) -> tuple[list, dict]:
+    """
+    Validate a batch, repair the menus that fail and re-validate the repairs.
+
+    Returns:
+        tuple: (accepted menus in input order,
+                {"unchanged": n, "repaired": n, "rejected": n})
+    """
+    results = validate_menus_batch([m.get("items") or [] for m in menus], limits)
+    accepted = [m if ok else None for m, (ok, _) in zip(menus, results)]
+    stats = {"unchanged": sum(ok for ok, _ in results), "repaired": 0, "rejected": 0}
+
+    failed = [i for i, (ok, _) in enumerate(results) if not ok]
+    repairs = {}
+    for i in failed:
+        try:
+            repairs[i] = repair_menu(menus[i], limits)
+        except Exception:
+            # A menu the repair cannot handle is rejected, not the whole batch
+            logger.exception("Repair failed: %s", menus[i].get("meal_name", "Unknown Meal"))
+            repairs[i] = None
+    fixed = [i for i in failed if repairs[i] is not None]
+    recheck = validate_menus_batch([repairs[i]["items"] for i in fixed], limits)
+    for i, (ok, _) in zip(fixed, recheck):
+        if ok:
+            accepted[i] = repairs[i]
+            stats["repaired"] += 1
+    for i in failed:
+        if accepted[i] is None:
+            stats["rejected"] += 1
+            logger.warning(
+                "Menu failed: %s. Reason: %s", menus[i].get("meal_name", "Unknown Meal"), results[i][1]
+            )
+    return [m for m in accepted if m is not None], stats
+
+
+# ---------- duplicates ----------
+def drop_duplicates(menus: list, dietary: str) -> tuple[list, int]:
+    """
+    Drop menus that duplicate (same ingredients and quantity profile) or
+    nearly duplicate (similar ingredient sets) an existing meal of the same
+    dietary or an earlier menu of the batch; see dedupe.py.
+    Candidates come from the MealBand index, not a catalog scan.
+
+    Returns:
+        tuple: (kept menus in input order, number dropped)
+    """
+    planned = [
+        (m, plan_items(m.get("items") or []), normalize_dietary(m.get("dietary") or dietary))
+        for m in menus
+    ]
+    index = DuplicateIndex.from_catalog(
+        [{item.ingredient.id for item in items} for _, items, _ in planned if items]
+    )
+    kept, dropped = [], 0
+    for n, (m, items, dietary_name) in enumerate(planned):
+        if items:
+            ids = {item.ingredient.id for item in items}
+            menu_fingerprint = fingerprint((item.ingredient.id, item.quantity_g) for item in items)
+            match = index.match(dietary_name, ids, menu_fingerprint)
+            if match:
+                dropped += 1
+                logger.info(
+                    "Menu dropped: %s is a %s of %s (similarity %.2f)",
+                    m.get("meal_name", "Unknown Meal"), match.kind, match.key, match.similarity,
+                )
+                continue
+            index.add(("menu", n), dietary_name, ids, menu_fingerprint)
+        kept.append(m)
+    return kept, dropped
+
+
+# ---------- persistence ----------
+# A resolved recipe line: `ingredient` is a catalog IngredientRecord
+PlannedItem = namedtuple("PlannedItem", ["ingredient", "quantity_g"])
+
+def plan_items(items) -> list[PlannedItem] | None:
+    """
+    Resolve a menu's items against the catalog cache.
+    Quantities are rounded to the stored 0.01 g and repeated ingredients
+    are merged (one RecipeIngredient per ingredient).
+    Returns None if an ingredient is unknown or a quantity is not numeric.
+    """
+    planned = {}
+    for it in items:
+        ing = ingredient_catalog.get(it.get("name", ""))
+        if not ing:
+            return None
+        try:
+            qty = Decimal(str(it["quantity_g"])).quantize(Decimal("0.01"))
+        except Exception:
+            return None
+        if ing.id in planned:
+            qty += planned[ing.id].quantity_g
+        planned[ing.id] = PlannedItem(ing, qty)
+    return list(planned.values())
+
+def resolve_dietaries(names) -> dict:
+    """
+    Return {name: Dietary} for the given names, creating missing rows.
+    """
+    names = set(names)
+    found = {d.name: d for d in Dietary.objects.filter(name__in=names)}
+    for name in names - found.keys():
+        found[name], _ = Dietary.objects.get_or_create(name=name)
+    return found
+
+def save_menus(menus, dietary: str, before_commit=None) -> list[dict]:
+    """
+    Persist validated menus with bulk inserts inside one transaction:
+    Meal rows, their RecipeIngredient rows and their MealTotals snapshots.
+
+    Totals are computed from the catalog cache while planning, so nothing
+    is read back after the writes. Menus whose items cannot be resolved are
+    skipped; any database error rolls back the whole batch.
+
+    `before_commit(saved)`, if given, is called with the return value inside
+    the transaction once the rows are written (not when nothing is saved);
+    an exception from it rolls the batch back.
+
+    Returns:
+        list[dict]: One MealSerializer-shaped dict per saved meal.
+    """
+    planned = []
+    for m in menus:
+        items = plan_items(m.get("items") or [])
+        if not items:
+            continue
+        planned.append((m, items, normalize_dietary(m.get("dietary") or dietary)))
+    if not planned:
+        return []
+
+    dietaries = resolve_dietaries(dietary_name for _, _, dietary_name in planned)
+    with transaction.atomic():
+        meals = Meal.objects.bulk_create([
+            Meal(
+                name=(m.get("meal_name") or "Generated Meal").strip()[:160],
+                description=(m.get("description") or "Generated by GPT").strip(),
+                dietary=dietaries[dietary_name],
+            )
+            for m, _, dietary_name in planned
+        ])
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe_id=meal.pk, ingredient_id=item.ingredient.id, quantity_g=item.quantity_g)
+            for meal, (_, items, _) in zip(meals, planned)
+            for item in items
+        ])
+        masks = ingredient_dietary_masks(item.ingredient.id for _, items, _ in planned for item in items)
+        totals = [meal_snapshot(items, masks) for _, items, _ in planned]
+        MealTotals.objects.bulk_create([
+            MealTotals(meal_id=meal.pk, **snapshot)
+            for meal, snapshot in zip(meals, totals)
+        ])
+        write_bands({
+            meal.pk: {item.ingredient.id for item in items}
+            for meal, (_, items, _) in zip(meals, planned)
+        }, replace=False)
+        # bulk_create skips signals: new meals change the monthly plans' meal
+        # sets and every read endpoint's content
+        invalidate_monthly_plans(dietaries)
+        content_changed()
+
+        saved = []
+        for meal, (_, items, _), snapshot in zip(meals, planned, totals):
+            allergens = []
+            for item in items:
+                if item.ingredient.allergen and item.ingredient.allergen not in allergens:
+                    allergens.append(item.ingredient.allergen)
+            saved.append({
+                "id": meal.pk,
+                "name": meal.name,
+                "description": meal.description,
+                "allergens": allergens,
+                "dietary": meal.dietary.name,
+                "ingredient_names": [item.ingredient.name for item in items],
+                "total_energy_kj": snapshot["energy_kj"],
+                "total_protein": snapshot["protein"],
+                "total_fat": snapshot["fat"],
+                "total_carbs": snapshot["carbs"],
+                "total_fiber": snapshot["fiber"],
+                "total_cost": snapshot["cost"],
+            })
+        if before_commit is not None:
+            before_commit(saved)
+    return saved
+
+
+# ---------- pipeline ----------
+def parse_generation_options(data) -> dict:
+    """
+    Read generation options from a request body (or a stored job's params).
+    Returns the keyword arguments of run_generation().
+    Raises GenerationError on non-integer numbers.
+    """
+    try:
+        batch_size = int(data.get("batch_size", 5))
+    except Exception:
+        raise GenerationError("batch_size must be an integer.")
+    try:
+        chunk_size = int(data.get("chunk_size") or 0) or None
+        concurrency = int(data.get("concurrency", 1))
+    except Exception:
+        raise GenerationError("chunk_size and concurrency must be integers.")
+    # Fan-out: split across `concurrency` calls unless chunk_size is given
+    if concurrency > 1 and chunk_size is None:
+        chunk_size = math.ceil(batch_size / min(concurrency, MAX_LLM_CONCURRENCY))
+    engine = str(data.get("engine") or "llm").strip().lower()
+    if engine not in ENGINES:
+        raise GenerationError(f"engine must be one of: {', '.join(ENGINES)}.")
+    return {
+        "batch_size": batch_size,
+        "dietary": normalize_dietary(data.get("dietary")),
+        "chunk_size": chunk_size,
+        "concurrency": concurrency,
+        "engine": engine,
+        "seed": str(data.get("seed", 0)),
+    }
+
+def usable_ingredients(dietary: str) -> list[IngredientRecord]:
+    """
+    Ingredients available for the dietary.
+    Raises GenerationError if there are too few to build valid menus.
+    """
+    # Filter available ingredients
+    qs = get_ingredients_for_dietary(dietary)
+
+    # If not enough ingredients, abort early (GPT can't build valid menus)
+    if len(qs) < 6:
+        raise GenerationError(f"Not enough ingredients for dietary '{dietary}'. Please add more.")
+    return qs
+
+# Outcome of one pipeline run
+GenerationResult = namedtuple("GenerationResult", ["saved", "validation"])
+
+def run_generation(batch_size=5, dietary="Standard", chunk_size=None, concurrency=1,
+                   engine="llm", seed="0", progress=None, before_commit=None) -> "GenerationResult":
+    """
+    Generate → validate → save pipeline behind /api/generate-menus/.
+
+    Args:
+        batch_size, dietary, chunk_size, concurrency, engine, seed:
+            see parse_generation_options().
+        progress (callable|None): progress(stage, done, total), called as the
+            pipeline moves through "prompting", "validating" and "saving".
+        before_commit (callable|None): before_commit(GenerationResult), called
+            inside the save transaction (see save_menus()).
+
+    Returns:
+        GenerationResult: `saved` — serialized saved meals (MealSerializer +
+            computed totals); `validation` — counts of menus accepted
+            unchanged, repaired and rejected (see screen_menus()), and
+            dropped as duplicates (see drop_duplicates()).
+
+    Raises:
+        GenerationError: Too few ingredients or no usable model output.
+    """
+    report = progress or (lambda stage, done, total: None)
+    qs = usable_ingredients(dietary)
+
+    report("prompting", 0, batch_size)
+    if engine == "local":
+        # ---- solve menus locally from the catalog (no LLM round-trip)
+        menus = build_local_menus(qs, batch_size, dietary, seed=seed)
+    else:
+        # ---- call GPT (one or more prompts), parse + dedupe JSON
+        ingredients_block = to_prompt_block(qs)
+        try:
+            menus = fetch_menus(
+                ingredients_block, batch_size, dietary,
+                chunk_size=chunk_size, concurrency=concurrency,
+            )
+        except LLMCacheMiss as e:
+            raise GenerationError(str(e))
+        except ValueError:
+            raise GenerationError("Model did not return valid JSON.")
+
+    # ---- validate the whole batch, repairing quantities where possible
+    report("validating", 0, len(menus))
+    accepted, validation = screen_menus(menus)
+
+    # ---- drop duplicates of the catalog and of each other before writing
+    accepted, validation["duplicate"] = drop_duplicates(accepted, dietary)
+
+    # ---- save every accepted menu in one transaction
+    report("saving", 0, len(accepted))
+    saved_meals = save_menus(
+        accepted, dietary,
+        before_commit=before_commit and (lambda saved: before_commit(GenerationResult(saved, validation))),
+    )
+    report("saving", len(accepted), len(accepted))
+    return GenerationResult(saved_meals, validation)
+
+def stream_generation(batch_size=5, dietary="Standard", engine="llm", seed="0", **options):
+    """
+    Streaming variant of run_generation(): menus are validated (with quantity
+    repair), saved and reported one by one as they complete.
+
+    The LLM is asked with a single prompt and its streamed completion is read
+    with JSONArrayStream, so the first meal is saved as soon as its closing
+    brace arrives. Fan-out options (chunk_size, concurrency) are ignored.
+
+    Raises:
+        GenerationError: Too few ingredients (checked before streaming starts).
+
+    Returns:
+        Iterator of event dicts:
+            {"event": "meal", "meal": <serialized meal>}
+            {"event": "rejected", "meal_name": "..."}
+            {"event": "duplicate", "meal_name": "..."}
+            {"event": "error", "error": "..."}  # reading the model output; ends the stream
+            {"event": "error", "meal_name": "...", "error": "..."}  # saving one meal
+            {"event": "done", "saved": n, "validation": {...}}
+    """
+    qs = usable_ingredients(dietary)
+    if engine == "local":
+        return _menu_events(iter(build_local_menus(qs, batch_size, dietary, seed=seed)), dietary)
+    prompt = build_menu_prompt(to_prompt_block(qs), batch_size=batch_size, dietary=dietary)
+    return _menu_events(_parse_menu_stream(stream_menu_text(prompt)), dietary)
+
+def _parse_menu_stream(chunks):
+    """
+    Yield menus from streamed completion text; raises ValueError at the end
+    if the text never contained a `menus` array.
+    """
+    parser = JSONArrayStream("menus")
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    if not parser.seen_array:
+        raise ValueError("Model did not return valid JSON.")
+
+def _menu_events(menus, dietary: str):
+    """
+    Events for each menu of `menus` (see stream_generation()). An error
+    reading the menus ends the stream; an error screening or saving one
+    menu is reported with that menu's name and the stream goes on.
+    """
+    validation = {"unchanged": 0, "repaired": 0, "rejected": 0, "duplicate": 0}
+    seen_names, seen_items, saved = set(), set(), 0
+    menus = iter(menus)
+    while True:
+        try:
+            menu = next(menus)
+        except StopIteration:
+            break
+        except LLMCacheMiss as e:
+            yield {"event": "error", "error": str(e)}
+            break
+        except ValueError:
+            yield {"event": "error", "error": "Model did not return valid JSON."}
+            break
+        except Exception as e:
+            yield {"event": "error", "error": f"Unexpected error: {e}"}
+            break
+
+        name, items = menu_signature(menu)
+        if (name and name in seen_names) or (items and items in seen_items):
+            continue
+        seen_names.add(name)
+        seen_items.add(items)
+        meal_name = menu.get("meal_name", "Unknown Meal")
+        try:
+            accepted, counts = screen_menus([menu])
+            for outcome, n in counts.items():
+                validation[outcome] += n
+            if not accepted:
+                yield {"event": "rejected", "meal_name": meal_name}
+                continue
+            # Meals saved earlier in the stream are already in the index
+            accepted, dropped = drop_duplicates(accepted, dietary)
+            if dropped:
+                validation["duplicate"] += dropped
+                yield {"event": "duplicate", "meal_name": meal_name}
+                continue
+            meals = save_menus(accepted, dietary)
+        except Exception as e:
+            logger.exception("Could not save menu %s", meal_name)
+            yield {"event": "error", "meal_name": meal_name, "error": f"Could not save meal: {e}"}
+            continue
+        for meal in meals:
+            saved += 1
+            yield {"event": "meal", "meal": meal}
+    yield {"event": "done", "saved": saved, "validation": validation}
@@ -0,0 +1,190 @@
+# kaiapp/jobs.py
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .generation import GenerationError, run_generation
+from .models import GenerationJob
+
+_executor = None
+_executor_lock = threading.Lock()
+_draining = 0       # drain tasks queued or running in this process
+_wanted = False     # jobs may have been queued since a drain last looked
+
+
+class JobRequeued(Exception):
+    """The job was requeued (see requeue_stale_jobs()) while this worker ran it."""
+
+
+def get_executor() -> ThreadPoolExecutor | None:
+    """
+    Return the shared in-process worker pool, or None when
+    settings.GENERATION_JOB_WORKERS is 0 (jobs left to `run_generation_jobs`).
+    """
+    global _executor
+    workers = getattr(settings, "GENERATION_JOB_WORKERS", 0)
+    if workers <= 0:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generation-job")
+        return _executor
+
+
+def submit_generation_job(options: dict) -> GenerationJob:
+    """
+    Store a pending job for run_generation(**options) and wake the
+    in-process pool once the row is committed.
+    """
+    job = GenerationJob.objects.create(params=options, progress_total=options.get("batch_size", 0))
+    if get_executor() is not None:
+        transaction.on_commit(wake_workers)
+    return job
+
+
+def wake_workers() -> bool:
+    """
+    Make the in-process pool drain the job queue (run_pending_jobs()),
+    including jobs queued before a restart or by another process.
+    At most one drain task per worker is queued; a drain that is already
+    running looks again before it exits. Returns False without a pool.
+    """
+    global _draining, _wanted
+    executor = get_executor()
+    if executor is None:
+        return False
+    with _executor_lock:
+        _wanted = True
+        if _draining >= settings.GENERATION_JOB_WORKERS:
+            return True
+        _draining += 1
+    executor.submit(drain_in_thread)
+    return True
+
+
+def drain_in_thread():
+    """
+    Worker-thread entry point: run pending jobs with its own DB connection
+    until the queue stays empty.
+    """
+    global _draining, _wanted
+    close_old_connections()
+    try:
+        while True:
+            with _executor_lock:
+                _wanted = False
+            run_pending_jobs()
+            with _executor_lock:
+                if not _wanted:
+                    _draining -= 1
+                    return
+    except BaseException:
+        with _executor_lock:
+            _draining -= 1
+        raise
+    finally:
+        close_old_connections()
+
+
+def requeue_stale_jobs(timeout: float | None = None) -> int:
+    """
+    Put RUNNING jobs started more than `timeout` seconds ago (default
+    settings.GENERATION_JOB_TIMEOUT) back to PENDING: their worker died
+    (restart, crash) before finishing them. Returns the number requeued.
+    """
+    if timeout is None:
+        timeout = settings.GENERATION_JOB_TIMEOUT
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return GenerationJob.objects.filter(
+        status=GenerationJob.RUNNING, started_at__lt=cutoff
+    ).update(status=GenerationJob.PENDING, started_at=None, stage="", progress_done=0)
+
+
+def run_pending_jobs() -> list[int]:
+    """
+    Requeue stale jobs, then run pending jobs oldest first until there are
+    none left. Returns the ids of the jobs run by this call.
+    """
+    requeue_stale_jobs()
+    ran = []
+    while True:
+        job_id = (
+            GenerationJob.objects.filter(status=GenerationJob.PENDING)
+            .order_by("created_at", "pk").values_list("pk", flat=True).first()
+        )
+        if job_id is None:
+            return ran
+        if run_job(job_id):
+            ran.append(job_id)
+
+
+def run_job(job_id: int) -> bool:
+    """
+    Claim a pending job and run the generation pipeline for it.
+    Returns False if another worker already claimed the job.
+
+    Updates are made under the claim (its started_at), so a worker whose
+    job was requeued by requeue_stale_jobs() cannot overwrite the new run.
+    The meals are attached to the job in the transaction that saves them,
+    with the claim locked: a requeued run saves nothing.
+    """
+    started = timezone.now()
+    claimed = GenerationJob.objects.filter(pk=job_id, status=GenerationJob.PENDING).update(
+        status=GenerationJob.RUNNING, started_at=started
+    )
+    if not claimed:
+        return False
+    job = GenerationJob.objects.get(pk=job_id)
+    claim = GenerationJob.objects.filter(pk=job_id, status=GenerationJob.RUNNING, started_at=started)
+
+    def progress(stage, done, total):
+        claim.update(stage=stage, progress_done=done, progress_total=total)
+
+    def claim_meals(result):
+        if not claim.select_for_update().values_list("pk", flat=True):
+            raise JobRequeued
+        progress("saving", len(result.saved), len(result.saved))
+        finish_job(claim, GenerationJob.SUCCEEDED, validation=result.validation)
+        job.meals.add(*[meal["id"] for meal in result.saved])
+
+    try:
+        result = run_generation(**job.params, progress=progress, before_commit=claim_meals)
+    except JobRequeued:
+        pass
+    except GenerationError as e:
+        finish_job(claim, GenerationJob.FAILED, str(e))
+    except Exception as e:
+        finish_job(claim, GenerationJob.FAILED, f"Unexpected error: {e}"[:255])
+    else:
+        if not result.saved:
+            finish_job(
+                claim, GenerationJob.SUCCEEDED, "No valid menus generated this round.",
+                validation=result.validation,
+            )
+    return True
+
+
+def finish_job(claim, status: str, message: str = "", **fields) -> bool:
+    """
+    Close the claimed job; False if it was requeued in the meantime.
+    """
+    return bool(claim.update(status=status, message=message, finished_at=timezone.now(), **fields))
+
+
+def job_payload(job: GenerationJob) -> dict:
+    """
+    Public representation of a job (without its meals).
+    """
+    return {
+        "id": job.pk,
+        "status": job.status,
+        "stage": job.stage,
+        "progress": {"done": job.progress_done, "total": job.progress_total},
+        "message": job.message,
+        "validation": job.validation,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
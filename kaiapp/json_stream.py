@@ -0,0 +1,79 @@
+# kaiapp/json_stream.py
+import json
+
+
+class JSONArrayStream:
+    """
+    Incremental parser for streamed JSON like the model's completion:
+
+        {"menus": [ {...}, {...}, ... ]}
+
+    Feed text chunks as they arrive; each call returns the objects of the
+    `key` array that were completed by that chunk, so the first element is
+    available as soon as its closing brace is streamed. Only string and
+    bracket state is tracked — nothing is buffered except the element
+    currently being read.
+
+    Attributes:
+        seen_array (bool): The `key` array has started.
+        malformed (int): Elements that were not valid JSON objects (skipped).
+    """
+    def __init__(self, key: str = "menus"):
+        self.key = key
+        self.seen_array = False
+        self.malformed = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string = []          # characters of the current top-level string
+        self._last_string = None   # last complete top-level string (candidate key)
+        self._array_depth = None   # depth of the open `key` array
+        self._item = None          # characters of the element being read
+
+    def feed(self, text: str) -> list[dict]:
+        done = []
+        for ch in text:
+            if self._item is not None:
+                self._item.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = "".join(self._string)
+                elif self._depth == 1:
+                    self._string.append(ch)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string = []
+            elif ch in "{[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._last_string == self.key and not self.seen_array:
+                    self._array_depth = self._depth
+                    self.seen_array = True
+                elif ch == "{" and self._item is None and self._array_depth is not None \
+                        and self._depth == self._array_depth + 1:
+                    self._item = ["{"]
+            elif ch in "}]":
+                if self._item is not None and self._depth == self._array_depth + 1:
+                    self._finish_item(done)
+                elif ch == "]" and self._depth == self._array_depth:
+                    self._array_depth = None
+                self._depth -= 1
+        return done
+
+    def _finish_item(self, done: list):
+        text, self._item = "".join(self._item), None
+        try:
+            item = json.loads(text)
+        except json.JSONDecodeError:
+            item = None
+        if isinstance(item, dict):
+            done.append(item)
+        else:
+            self.malformed += 1
@@ -0,0 +1,194 @@
+# kaiapp/llm.py
+"""
+LLM providers behind generation.create_completion().
+
+settings.LLM_PROVIDER picks one:
+  openai - the OpenAI API (OPENAI_API_KEY); the SDK is imported and the
+           client built on the first completion, then reused with a pooled
+           HTTP connection (LLM_MAX_CONNECTIONS, LLM_TIMEOUT)
+  stub   - offline: valid menus solved from the catalog (llm_stub.CatalogStubClient)
+  record - LLM_RECORD_PROVIDER through the LLM response cache, storing misses
+  replay - served from the LLM response cache only; a miss raises LLMCacheMiss
+
+This is the only place completions are cached: generation.py asks the
+provider and nothing else.
+
+Providers are created once per process and name. Workers that never
+generate (migrate, the monthly menu, the meal API) never import the SDK.
+"""
+import threading
+from contextlib import contextmanager
+from types import SimpleNamespace
+from django.conf import settings
+from .llm_cache import LLMCacheMiss, cached_completion
+
+
+class LLMProvider:
+    """
+    A source of chat completions with the OpenAI call shape:
+    create(**params) returns a completion, or an iterator of chunks with
+    stream=True. Subclasses build the client in build_client(); it is
+    created lazily on first use and shared by every thread.
+    """
+    name = None
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self.build_client()
+        return self._client
+
+    def build_client(self):
+        raise NotImplementedError
+
+    def create(self, **params):
+        return self.client().chat.completions.create(**params)
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    def build_client(self):
+        import httpx
+        from openai import OpenAI
+
+        limits = httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_CONNECTIONS,
+        )
+        return OpenAI(
+            api_key=settings.OPENAI_API_KEY,
+            timeout=settings.LLM_TIMEOUT,
+            http_client=httpx.Client(limits=limits, timeout=settings.LLM_TIMEOUT),
+        )
+
+
+class StubProvider(LLMProvider):
+    name = "stub"
+
+    def build_client(self):
+        from .llm_stub import CatalogStubClient
+
+        return CatalogStubClient()
+
+
+class ClientProvider(LLMProvider):
+    """
+    Wraps a ready-made OpenAI-shaped client (see use_client()).
+    """
+    name = "client"
+
+    def __init__(self, client):
+        super().__init__()
+        self._client = client
+
+
+class RecordReplayProvider(LLMProvider):
+    """
+    Completions through the LLM response cache (llm_cache.py): "record"
+    asks `backend` (a provider, or the name of one; default
+    LLM_RECORD_PROVIDER) on a miss and stores the answer, "replay" never
+    leaves the cache. Streamed requests are cached whole and replayed as
+    a single chunk.
+    """
+    def __init__(self, mode: str, backend: "LLMProvider | str | None" = None):
+        super().__init__()
+        self.name = mode
+        self.mode = mode
+        self.backend = backend
+
+    def create(self, **params):
+        stream = params.pop("stream", False)
+        params.pop("stream_options", None)
+        resp = cached_completion(self._backend_create, mode=self.mode, **params)
+        if not stream:
+            return resp
+        return iter([
+            SimpleNamespace(
+                choices=[SimpleNamespace(delta=SimpleNamespace(content=resp.choices[0].message.content))],
+                usage=None,
+            ),
+            SimpleNamespace(choices=[], usage=getattr(resp, "usage", None)),
+        ])
+
+    def _backend_create(self, **params):
+        backend = self.backend or settings.LLM_RECORD_PROVIDER
+        if self.mode == "replay" or backend in ("record", "replay"):
+            raise LLMCacheMiss("The record/replay provider has no backend to call.")
+        if isinstance(backend, str):
+            backend = registry.get(backend, bypass_override=True)
+        return backend.create(**params)
+
+
+class ProviderRegistry:
+    """
+    {name: factory} of the available providers, and the one instance per
+    name built from it on first use.
+    """
+    def __init__(self):
+        self._factories = {}
+        self._instances = {}
+        self._override = None
+        self._lock = threading.Lock()
+
+    def register(self, name: str, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._instances.pop(name, None)
+
+    def names(self) -> list[str]:
+        return sorted(self._factories)
+
+    def get(self, name: str | None = None, bypass_override: bool = False) -> LLMProvider:
+        """
+        The provider called `name` (default settings.LLM_PROVIDER), or the
+        override() in effect unless `bypass_override`.
+        Raises ValueError for names that were never registered.
+        """
+        if self._override is not None and not bypass_override:
+            return self._override
+        name = name or settings.LLM_PROVIDER
+        provider = self._instances.get(name)
+        if provider is not None:
+            return provider
+        with self._lock:
+            if name not in self._factories:
+                raise ValueError(f"LLM_PROVIDER must be one of {self.names()}, got {name!r}.")
+            if name not in self._instances:
+                self._instances[name] = self._factories[name]()
+            return self._instances[name]
+
+    @contextmanager
+    def override(self, provider: LLMProvider):
+        """
+        Route every completion in the process through `provider` inside the block.
+        """
+        previous, self._override = self._override, provider
+        try:
+            yield provider
+        finally:
+            self._override = previous
+
+
+registry = ProviderRegistry()
+registry.register("openai", OpenAIProvider)
+registry.register("stub", StubProvider)
+registry.register("record", lambda: RecordReplayProvider("record"))
+registry.register("replay", lambda: RecordReplayProvider("replay"))
+
+
+def get_provider(name: str | None = None) -> LLMProvider:
+    return registry.get(name)
+
+
+def use_client(client):
+    """
+    Context manager sending completions to `client`, an OpenAI-shaped
+    object such as llm_stub.StubOpenAIClient (tests and benchmarks).
+    """
+    return registry.override(ClientProvider(client))
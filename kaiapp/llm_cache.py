@@ -0,0 +1,181 @@
+# kaiapp/llm_cache.py
+"""
+Content-addressed store of LLM completions behind the "record" and "replay"
+providers (llm.RecordReplayProvider, selected with settings.LLM_PROVIDER).
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+from django.conf import settings
+
+# cached_completion() modes
+#   record - serve cached completions, call the model (and store) on a miss
+#   replay - serve only from the cache; a miss raises LLMCacheMiss
+CACHE_MODES = ("record", "replay")
+
+
+class LLMCacheMiss(Exception):
+    """
+    Replay mode was asked for a completion that is not in the cache.
+    """
+
+
+def completion_key(params: dict) -> str:
+    """
+    Content address of a completion request: SHA-256 of the canonical JSON
+    of its parameters (model, temperature, response_format, messages...).
+    """
+    canonical = json.dumps(params, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    SQLite store of raw chat completions, keyed by completion_key().
+
+    Entries older than `ttl` seconds are treated as missing and dropped.
+    After each write, least recently used entries are evicted until the
+    stored completions fit in `max_bytes`.
+
+    Counters:
+        hits   - lookups served from the store
+        misses - lookups that found nothing (or an expired entry)
+    """
+    def __init__(self, path, ttl=7 * 24 * 3600, max_bytes=50 * 1024 * 1024):
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS completion ("
+                " key TEXT PRIMARY KEY, content TEXT NOT NULL, usage TEXT NOT NULL,"
+                " size INTEGER NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS completion_used_at ON completion (used_at)")
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)  # autocommit
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get(self, key: str):
+        """
+        Return (content, usage dict) for a fresh entry, or None.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            row = db.execute(
+                "SELECT content, usage, created_at FROM completion WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[2] > self.ttl:
+                if row is not None:
+                    db.execute("DELETE FROM completion WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            db.execute("UPDATE completion SET used_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, content: str, usage: dict | None = None):
+        """
+        Store a completion, then evict least recently used entries over max_bytes.
+        """
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        with self._lock, self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO completion (key, content, usage, size, created_at, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, json.dumps(usage or {}), size, now, now),
+            )
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM completion").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in db.execute("SELECT key, size FROM completion ORDER BY used_at").fetchall():
+            db.execute("DELETE FROM completion WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def prune(self) -> int:
+        """
+        Drop expired entries; returns how many were removed.
+        """
+        with self._lock, self._connect() as db:
+            return db.execute(
+                "DELETE FROM completion WHERE created_at < ?", (time.time() - self.ttl,)
+            ).rowcount
+
+    def clear(self):
+        with self._lock, self._connect() as db:
+            db.execute("DELETE FROM completion")
+
+    def stats(self) -> dict:
+        with self._connect() as db:
+            entries, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM completion"
+            ).fetchone()
+        return {"entries": entries, "bytes": size, "hits": self.hits, "misses": self.misses}
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMResponseCache:
+    """
+    Return the cache configured in settings (LLM_CACHE_PATH, LLM_CACHE_TTL,
+    LLM_CACHE_MAX_BYTES).
+    """
+    config = (settings.LLM_CACHE_PATH, settings.LLM_CACHE_TTL, settings.LLM_CACHE_MAX_BYTES)
+    with _caches_lock:
+        if config not in _caches:
+            _caches[config] = LLMResponseCache(*config)
+        return _caches[config]
+
+
+def cached_completion(create, mode: str, **params):
+    """
+    Call `create(**params)` (e.g. client.chat.completions.create) through
+    the configured cache, in `mode` ("record" or "replay").
+
+    Returns the live response, or a response-shaped namespace
+    (choices[0].message.content, usage) when served from the cache.
+
+    Raises:
+        LLMCacheMiss: In replay mode, when the completion was never recorded.
+    """
+    if mode not in CACHE_MODES:
+        raise ValueError(f"Cache mode must be one of {CACHE_MODES}, got {mode!r}.")
+    cache, key = get_llm_cache(), completion_key(params)
+    hit = cache.get(key)
+    if hit is not None:
+        content, usage = hit
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(**usage),
+        )
+    if mode == "replay":
+        raise LLMCacheMiss(f"No cached completion for this prompt (replay mode, key {key[:12]}).")
+    resp = create(**params)
+    content = resp.choices[0].message.content
+    if content is not None:
+        usage = getattr(resp, "usage", None)
+        cache.set(key, content, {
+            field: getattr(usage, field, None)
+            for field in ("prompt_tokens", "completion_tokens", "total_tokens")
+        } if usage is not None else {})
+    return resp
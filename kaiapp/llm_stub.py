@@ -0,0 +1,131 @@
+# kaiapp/llm_stub.py
+import json
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from .catalog import ingredient_catalog
+from .menu_engine import build_local_menus
+
+
+class StubOpenAIClient:
+    """
+    Offline stand-in for `openai.OpenAI` used by tests and benchmarks.
+
+    Exposes `client.chat.completions.create(...)` and answers with a JSON
+    completion shaped like the real model's: the requested number of menus,
+    built only from the ingredients listed in the prompt.
+
+    Args:
+        latency (float): Seconds to sleep per call (simulates the LLM round-trip).
+        items_per_menu (int): Distinct ingredients per menu.
+        quantity_g (int): Grams of each ingredient.
+        seed (int|str): Base seed; each call uses seed + call number,
+            so output is deterministic for a given call order.
+        chunk_chars (int): Characters per chunk when called with stream=True.
+        chunk_latency (float): Seconds to sleep between streamed chunks.
+    """
+    def __init__(self, latency=0.0, items_per_menu=5, quantity_g=60, seed=0,
+                 chunk_chars=32, chunk_latency=0.0):
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.chunk_latency = chunk_latency
+        self.items_per_menu = items_per_menu
+        self.quantity_g = quantity_g
+        self.seed = seed
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, *, messages, stream=False, **kwargs):
+        with self._lock:
+            self.calls += 1
+            call_no = self.calls
+        time.sleep(self.latency)
+
+        prompt = messages[-1]["content"]
+        content = json.dumps({"menus": self.build_menus(prompt, call_no)})
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        usage = SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+        if stream:
+            return self.stream_chunks(content, usage)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=usage,
+        )
+
+    def stream_chunks(self, content: str, usage):
+        """
+        Yield `content` as streamed completion chunks (choices[0].delta.content),
+        ending with a usage-only chunk like stream_options={"include_usage": True}.
+        """
+        for start in range(0, len(content), self.chunk_chars):
+            if start:
+                time.sleep(self.chunk_latency)
+            delta = SimpleNamespace(content=content[start:start + self.chunk_chars])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+        yield SimpleNamespace(choices=[], usage=usage)
+
+    def build_menus(self, prompt: str, call_no: int) -> list[dict]:
+        """
+        Build the menus for one prompt produced by prompts.build_menu_prompt.
+        """
+        batch_size, dietary = parse_prompt_request(prompt)
+        names = parse_prompt_ingredients(prompt)
+        rng = random.Random(f"{self.seed}:{call_no}")
+        size = min(self.items_per_menu, len(names))
+        menus = []
+        for n in range(batch_size):
+            menus.append({
+                "meal_name": f"Stub {call_no}-{n + 1} Bowl",
+                "description": "Stubbed menu for offline testing",
+                "dietary": dietary,
+                "items": [
+                    {"name": name, "quantity_g": self.quantity_g}
+                    for name in rng.sample(names, size)
+                ],
+            })
+        return menus
+
+
+class CatalogStubClient(StubOpenAIClient):
+    """
+    Stub whose menus are solved by menu_engine.build_local_menus() from the
+    prompt's ingredients (looked up in the ingredient catalog), so they pass
+    validation. Backs the "stub" LLM provider for running generation offline.
+    """
+    def build_menus(self, prompt: str, call_no: int) -> list[dict]:
+        batch_size, dietary = parse_prompt_request(prompt)
+        records = [ingredient_catalog.get(name) for name in parse_prompt_ingredients(prompt)]
+        return build_local_menus(
+            [r for r in records if r], batch_size, dietary, seed=f"{self.seed}:{call_no}"
+        )
+
+
+def parse_prompt_request(prompt: str) -> tuple[int, str]:
+    """
+    (menus requested, dietary) of a prompt produced by prompts.build_menu_prompt.
+    """
+    batch_size = int(re.search(r"Produce exactly (\d+) menus", prompt).group(1))
+    dietary = re.search(r"Dietary type: \*\*(.+?)\*\*", prompt).group(1)
+    return batch_size, dietary
+
+
+def parse_prompt_ingredients(prompt: str) -> list[str]:
+    """
+    Return ingredient names from the "Provided Ingredients" block of a prompt
+    (lines formatted `name, price_per_100g, energy_kj_per_100g`).
+    """
+    block = prompt.split("### Provided Ingredients", 1)[1].split("### Output", 1)[0]
+    names = []
+    for line in block.splitlines():
+        parts = line.rsplit(",", 2)
+        if len(parts) == 3 and not line.startswith("Format"):
+            names.append(parts[0].strip())
+    return names
@@ -0,0 +1,49 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from kaiapp.models import Meal
+from kaiapp.renderers import FastJSONRenderer
+from kaiapp.serializers import MealSerializer, meal_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per-meal cost of listing meals through MealSerializer + "
+        "JSONRenderer against meal_rows() + FastJSONRenderer, and check that "
+        "both produce the same bytes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=1000, help="Meals per listing (default 1000).")
+        parser.add_argument("--repeat", type=int, default=5, help="Timed runs per path; best is kept.")
+
+    def handle(self, *args, **options):
+        ids = list(Meal.objects.order_by("id").values_list("id", flat=True)[:options["limit"]])
+        if not ids:
+            raise CommandError("No meals to serialize; load or seed a catalog first.")
+
+        def serializer_path():
+            meals = Meal.objects.with_items().with_totals().filter(pk__in=ids).order_by("id")
+            return JSONRenderer().render(MealSerializer(meals, many=True).data)
+
+        def fast_path():
+            return FastJSONRenderer().render(meal_rows(Meal.objects.filter(pk__in=ids).order_by("id")))
+
+        results = {}
+        for label, path in (("serializer", serializer_path), ("fast", fast_path)):
+            best, body = None, None
+            for _ in range(options["repeat"]):
+                started = time.perf_counter()
+                body = path()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+            results[label] = (best, body)
+            self.stdout.write(
+                f"{label:>10}: {best * 1000:8.2f} ms for {len(ids)} meals "
+                f"({best / len(ids) * 1e6:7.1f} µs/meal)"
+            )
+
+        if results["serializer"][1] != results["fast"][1]:
+            raise CommandError("Outputs differ: meal_rows() is not byte-compatible with MealSerializer.")
+        speedup = results["serializer"][0] / results["fast"][0]
+        self.stdout.write(self.style.SUCCESS(f"Identical output, {speedup:.1f}x faster."))
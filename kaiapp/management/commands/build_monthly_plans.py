@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from kaiapp.generation import DIETARY_CANONICAL
+from kaiapp.planning import prepare_monthly_plans, target_month
+
+
+class Command(BaseCommand):
+    help = (
+        "Build or refresh the stored monthly plans for every dietary "
+        "(default: next month) so the first /api/monthly-menu/ request is warm."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--month", help="Month to plan as YYYY-MM (default: next month).")
+
+    def handle(self, *args, **options):
+        if options["month"]:
+            try:
+                year, month = (int(part) for part in options["month"].split("-"))
+            except ValueError:
+                raise CommandError("--month must look like 2025-09.")
+        else:
+            year, month = target_month()
+        dietaries = sorted(set(DIETARY_CANONICAL.values()))
+        for dietary, plan in prepare_monthly_plans(dietaries, year, month).items():
+            if plan is None:
+                self.stdout.write(f"{dietary}: no meals")
+                continue
+            summary = plan.payload["summary"]
+            self.stdout.write(
+                f"{dietary}: {len(plan.payload['menuItems'])} days, cost {summary['totalCost']}, "
+                f"avg protein {summary['avgProtein']} g, constraints met {summary['satisfied']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Monthly plans ready for {year}-{month:02d}."))
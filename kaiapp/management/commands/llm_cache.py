@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from kaiapp.llm_cache import get_llm_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Inspect or maintain the LLM response cache (LLM_CACHE_PATH). "
+        "Prints entry count and size; --prune drops expired entries, --clear empties it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prune", action="store_true", help="Delete entries older than LLM_CACHE_TTL.")
+        parser.add_argument("--clear", action="store_true", help="Delete every cached completion.")
+
+    def handle(self, *args, **options):
+        cache = get_llm_cache()
+        if options["clear"]:
+            cache.clear()
+            self.stdout.write("Cleared the LLM response cache.")
+        elif options["prune"]:
+            self.stdout.write(f"Pruned {cache.prune()} expired completions.")
+        stats = cache.stats()
+        self.stdout.write(self.style.SUCCESS(
+            f"{stats['entries']} cached completions, {stats['bytes']} bytes ({cache.path})."
+        ))
@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from kaiapp.catalog_loader import FORMATS, MODELS, CatalogLoader, CatalogLoadError, detect_format, iter_records, open_text
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a catalog file (JSON array in fixture format, NDJSON or CSV; "
+        "UTF-8 or UTF-16, detected) into Dietary, Ingredient, Meal and "
+        "RecipeIngredient with chunked bulk upserts. Faster than loaddata and "
+        "keeps MealTotals, ETags and monthly plans up to date."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Catalog file, e.g. kaiapp.json.")
+        parser.add_argument("--format", choices=FORMATS, help="Input format (default: detected).")
+        parser.add_argument("--encoding", help="Text encoding (default: detected from BOM / NUL bytes).")
+        parser.add_argument("--model", choices=sorted(MODELS), help="Model of CSV rows without a `model` column.")
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Records per transaction (default 1000).")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        loader = CatalogLoader(options["chunk_size"], progress=lambda line: self.stdout.write(f"  {line}"))
+        try:
+            with open_text(options["path"], options["encoding"]) as text:
+                fmt = options["format"] or detect_format(options["path"], text)
+                stats = loader.load(iter_records(text, fmt, options["model"]))
+        except (OSError, UnicodeError, CatalogLoadError) as e:
+            raise CommandError(f"Catalog not loaded: {e}")
+        summary = ", ".join(f"{label} {s['created']} created / {s['updated']} updated" for label, s in stats.items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {loader.records} records in {time.perf_counter() - started:.1f}s: {summary}."
+        ))
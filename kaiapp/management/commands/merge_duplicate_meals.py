@@ -0,0 +1,75 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from kaiapp.dedupe import NEAR_DUPLICATE_JACCARD, DuplicateIndex, fingerprint
+from kaiapp.models import GenerationJob, Meal, RecipeIngredient
+
+
+class Command(BaseCommand):
+    help = (
+        "Find meals that duplicate an older meal of the same dietary (same "
+        "ingredients and quantity profile; with --near, similar ingredient "
+        "sets) and merge them into it: generation jobs are pointed at the "
+        "older meal and the duplicates are deleted. Works from the recipe "
+        "rows, so it does not need the MealBand index to be current."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--near", action="store_true", help="Also merge near-duplicates.")
+        parser.add_argument(
+            "--threshold", type=float, default=NEAR_DUPLICATE_JACCARD,
+            help=f"Ingredient-set similarity for --near (default {NEAR_DUPLICATE_JACCARD}).",
+        )
+        parser.add_argument("--dry-run", action="store_true", help="List the merges without writing.")
+
+    def handle(self, *args, **options):
+        if not 0 < options["threshold"] <= 1:
+            raise CommandError("--threshold must be in (0, 1].")
+        merges = self.find_duplicates(options["near"], options["threshold"])
+        for duplicate, (kept, kind, similarity) in sorted(merges.items()):
+            self.stdout.write(f"  meal {duplicate} -> {kept} ({kind}, similarity {similarity:.2f})")
+        if options["dry_run"] or not merges:
+            self.stdout.write(self.style.SUCCESS(f"{len(merges)} duplicate meals found."))
+            return
+        self.merge(merges)
+        self.stdout.write(self.style.SUCCESS(f"Merged {len(merges)} duplicate meals."))
+
+    def find_duplicates(self, near: bool, threshold: float) -> dict:
+        """
+        {duplicate meal id: (kept meal id, kind, similarity)}; the oldest
+        meal (lowest pk) of each group is kept.
+        """
+        items = defaultdict(list)
+        rows = RecipeIngredient.objects.order_by().values_list("recipe_id", "ingredient_id", "quantity_g")
+        for meal_id, ingredient_id, quantity in rows.iterator(chunk_size=10000):
+            items[meal_id].append((ingredient_id, quantity))
+
+        index = DuplicateIndex(threshold)
+        merges = {}
+        meals = Meal.objects.order_by("pk").values_list("pk", "dietary__name")
+        for meal_id, dietary in meals.iterator(chunk_size=10000):
+            pairs = items.pop(meal_id, None)
+            if not pairs:
+                continue
+            ids = {ingredient_id for ingredient_id, _ in pairs}
+            meal_fingerprint = fingerprint(pairs)
+            match = index.match(dietary, ids, meal_fingerprint, exact_only=not near)
+            if match:
+                merges[meal_id] = (match.key, match.kind, match.similarity)
+            else:
+                index.add(meal_id, dietary, ids, meal_fingerprint)
+        return merges
+
+    def merge(self, merges: dict, chunk_size: int = 500):
+        Through = GenerationJob.meals.through
+        duplicates = sorted(merges)
+        for start in range(0, len(duplicates), chunk_size):
+            chunk = duplicates[start:start + chunk_size]
+            with transaction.atomic():
+                links = Through.objects.filter(meal_id__in=chunk).values_list("generationjob_id", "meal_id")
+                Through.objects.bulk_create([
+                    Through(generationjob_id=job_id, meal_id=merges[meal_id][0])
+                    for job_id, meal_id in links
+                ], ignore_conflicts=True)
+                # Deleting through the ORM fires the plan, totals and ETag signals
+                Meal.objects.filter(pk__in=chunk).delete()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from kaiapp.catalog import bump_content_version
+from kaiapp.models import Meal
+from kaiapp.planning import invalidate_monthly_plans
+from kaiapp.services import refresh_meal_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild the MealTotals snapshot for every meal. "
+        "Run after loaddata or any bulk change that bypasses model signals."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=500,
+            help="Number of meals recomputed per batch (default 500).",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        meal_ids = list(Meal.objects.order_by("pk").values_list("pk", flat=True))
+        written = 0
+        for start in range(0, len(meal_ids), chunk_size):
+            written += refresh_meal_totals(meal_ids[start:start + chunk_size])
+        # Same as signals.refresh_totals_and_bump: every meal was refreshed,
+        # so every stored plan and ETag may hold the old totals
+        invalidate_monthly_plans()
+        bump_content_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt totals for {written} meals."))
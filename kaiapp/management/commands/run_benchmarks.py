@@ -0,0 +1,178 @@
+import json
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from kaiapp.generation import DIETARY_CANONICAL
+from kaiapp.llm import use_client
+from kaiapp.llm_stub import StubOpenAIClient
+from kaiapp.models import Ingredient, Meal, RecipeIngredient
+from kaiapp.services import validate_menu
+
+SCENARIOS = ("meals_list", "meal_detail", "meal_similar", "monthly_menu", "validate_menu", "generate_menus")
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time the API against the current catalog (seed one with seed_catalog) and "
+        "write latency percentiles and query counts per scenario as JSON. "
+        "/api/generate-menus/ runs against StubOpenAIClient and is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=50, help="Timed runs per scenario (default 50).")
+        parser.add_argument("--warmup", type=int, default=3, help="Untimed runs per scenario first (default 3).")
+        parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated subset to run.")
+        parser.add_argument("--page-size", type=int, default=50, help="page_size for /api/meals/ (default 50).")
+        parser.add_argument("--batch-size", type=int, default=5, help="Menus per generate request (default 5).")
+        parser.add_argument("--llm-latency", type=float, default=0.0, help="Stub LLM latency in seconds.")
+        parser.add_argument("--output", help="Write the JSON report here (default: stdout).")
+        parser.add_argument("--baseline", help="Earlier report to compare p95 latencies against.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed (default 0).")
+
+    def handle(self, *args, **options):
+        scenarios = [s.strip() for s in options["scenarios"].split(",") if s.strip()]
+        unknown = set(scenarios) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}. Choose from {', '.join(SCENARIOS)}.")
+        meal_ids = list(Meal.objects.order_by("?").values_list("id", flat=True)[:1000])
+        if not meal_ids:
+            raise CommandError("No meals to benchmark; run seed_catalog first.")
+
+        self.rng = random.Random(options["seed"])
+        self.options = options
+        self.meal_ids = meal_ids
+        self.http = Client(SERVER_NAME=settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else "localhost")
+        self.ingredient_names = list(Ingredient.objects.values_list("name", flat=True)[:5000])
+        self.dietaries = sorted(set(DIETARY_CANONICAL.values()))
+
+        results = {}
+        for name in scenarios:
+            prepare = getattr(self, f"prepare_{name}", None)
+            if prepare:
+                prepare()
+            results[name] = self.measure(getattr(self, f"run_{name}"), options["warmup"], options["iterations"])
+            stats = results[name]
+            self.stderr.write(
+                f"{name:>15}: p50 {stats['p50_ms']:8.2f} ms  p95 {stats['p95_ms']:8.2f} ms  "
+                f"queries {stats['queries_mean']:.1f} (max {stats['queries_max']})"
+            )
+
+        report = {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "database": connection.vendor,
+            "catalog": {
+                "ingredients": Ingredient.objects.count(),
+                "meals": Meal.objects.count(),
+                "recipe_lines": RecipeIngredient.objects.count(),
+            },
+            "options": {k: options[k] for k in ("iterations", "warmup", "page_size", "batch_size", "llm_latency", "seed")},
+            "scenarios": results,
+        }
+        if options["baseline"]:
+            report["baseline"] = self.compare(results, options["baseline"])
+        text = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+            self.stderr.write(self.style.SUCCESS(f"Report written to {options['output']}."))
+        else:
+            self.stdout.write(text)
+
+    def measure(self, run, warmup: int, iterations: int) -> dict:
+        for _ in range(warmup):
+            run()
+        latencies, queries = [], []
+        for _ in range(max(1, iterations)):
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                run()
+                latencies.append((time.perf_counter() - started) * 1000)
+            queries.append(len(ctx.captured_queries))
+        values = np.percentile(latencies, PERCENTILES)
+        return {
+            "iterations": len(latencies),
+            **{f"p{p}_ms": round(float(v), 3) for p, v in zip(PERCENTILES, values)},
+            "mean_ms": round(float(np.mean(latencies)), 3),
+            "max_ms": round(max(latencies), 3),
+            "queries_mean": round(float(np.mean(queries)), 2),
+            "queries_max": max(queries),
+        }
+
+    def compare(self, results: dict, path: str) -> dict:
+        """
+        {scenario: current p95 / baseline p95} for scenarios in both reports.
+        """
+        try:
+            with open(path, encoding="utf-8") as f:
+                baseline = json.load(f)["scenarios"]
+        except (OSError, ValueError, KeyError) as e:
+            raise CommandError(f"Cannot read baseline report {path}: {e}")
+        ratios = {}
+        for name, stats in results.items():
+            before = baseline.get(name, {}).get("p95_ms")
+            if before:
+                ratios[name] = round(stats["p95_ms"] / before, 3)
+                self.stderr.write(f"{name:>15}: p95 x{ratios[name]:.2f} vs baseline")
+        return ratios
+
+    def get(self, url: str):
+        response = self.http.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"GET {url} returned {response.status_code}.")
+        return response
+
+    # ---------- scenarios ----------
+    def run_meals_list(self):
+        self.get(f"/api/meals/?page_size={self.options['page_size']}")
+
+    def run_meal_detail(self):
+        self.get(f"/api/meals/{self.rng.choice(self.meal_ids)}/")
+
+    def run_meal_similar(self):
+        self.get(f"/api/meals/{self.rng.choice(self.meal_ids)}/similar/?k=10")
+
+    def prepare_monthly_menu(self):
+        # Build every dietary's plan first so timed runs measure the stored path;
+        # dietaries without meals (a 400) are left out of the timed runs
+        self.plan_dietaries = [
+            dietary for dietary in self.dietaries
+            if self.http.get(f"/api/monthly-menu/?dietary={dietary}").status_code == 200
+        ]
+        if not self.plan_dietaries:
+            raise CommandError("No dietary has a monthly menu to benchmark; run seed_catalog first.")
+
+    def run_monthly_menu(self):
+        self.get(f"/api/monthly-menu/?dietary={self.rng.choice(self.plan_dietaries)}")
+
+    def run_validate_menu(self):
+        items = [
+            {"name": name, "quantity_g": self.rng.randint(30, 120)}
+            for name in self.rng.sample(self.ingredient_names, min(5, len(self.ingredient_names)))
+        ]
+        validate_menu(items)
+
+    def run_generate_menus(self):
+        stub = StubOpenAIClient(latency=self.options["llm_latency"], seed=self.rng.randrange(1 << 30))
+        body = {"batch_size": self.options["batch_size"], "dietary": self.rng.choice(self.dietaries)}
+        with use_client(stub), transaction.atomic():
+            self.http.post("/api/generate-menus/", body, content_type="application/json")
+            transaction.set_rollback(True)  # keep the benchmarked catalog unchanged
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
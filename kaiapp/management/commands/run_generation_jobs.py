@@ -0,0 +1,40 @@
+import time
+from django.core.management.base import BaseCommand
+from kaiapp.jobs import requeue_stale_jobs, run_job
+from kaiapp.models import GenerationJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Run pending menu generation jobs (POST /api/generate-menus/ with "
+        "\"async\": true) outside the web process. Polls until interrupted; "
+        "jobs left running longer than GENERATION_JOB_TIMEOUT are requeued."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Run the jobs pending right now, then exit.",
+        )
+        parser.add_argument(
+            "--poll", type=float, default=2.0,
+            help="Seconds to wait between polls when idle (default 2).",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            requeued = requeue_stale_jobs()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} stale jobs.")
+            pending = list(
+                GenerationJob.objects.filter(status=GenerationJob.PENDING)
+                .order_by("created_at").values_list("pk", flat=True)
+            )
+            for job_id in pending:
+                if run_job(job_id):
+                    job = GenerationJob.objects.get(pk=job_id)
+                    self.stdout.write(f"Job {job_id}: {job.status} {job.message}".rstrip())
+            if options["once"]:
+                break
+            if not pending:
+                time.sleep(options["poll"])
@@ -0,0 +1,124 @@
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from kaiapp.catalog import bump_catalog_version, content_changed
+from kaiapp.dedupe import write_bands
+from kaiapp.generation import DIETARY_CANONICAL
+from kaiapp.models import KNOWN_ALLERGENS, Dietary, Ingredient, Meal, MealTotals, RecipeIngredient
+from kaiapp.planning import invalidate_monthly_plans
+from kaiapp.services import meal_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic catalog for benchmarks (see run_benchmarks), e.g. "
+        "--ingredients 5000 --meals 200000 --items-per-meal 5 for 1M recipe lines. "
+        "Rows are bulk-inserted in chunks; MealTotals, the catalog version and "
+        "the monthly plans are updated explicitly since no signals fire."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ingredients", type=int, default=500, help="Ingredients to create (default 500).")
+        parser.add_argument("--meals", type=int, default=5000, help="Meals to create (default 5000).")
+        parser.add_argument("--items-per-meal", type=int, default=5, help="Recipe lines per meal (default 5).")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Meals inserted per transaction.")
+        parser.add_argument("--prefix", default="Synthetic", help="Name prefix of the seeded rows.")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed (default 0).")
+
+    def handle(self, *args, **options):
+        prefix, rng = options["prefix"], random.Random(options["seed"])
+        n_ingredients, n_meals, per_meal = options["ingredients"], options["meals"], options["items_per_meal"]
+        if n_ingredients < per_meal or per_meal < 1:
+            raise CommandError("--ingredients must be at least --items-per-meal (and that at least 1).")
+        if Ingredient.objects.filter(name__startswith=f"{prefix} ").exists():
+            raise CommandError(f"A catalog with prefix '{prefix}' already exists; pick another --prefix.")
+
+        started = time.perf_counter()
+        dietaries = self.dietaries()
+        pools = self.seed_ingredients(prefix, n_ingredients, dietaries, rng)
+        bump_catalog_version()  # meal_snapshot() reads the new dietary tags from the catalog
+        names = sorted(pools)
+        chunk_size = max(1, options["chunk_size"])
+        for start in range(0, n_meals, chunk_size):
+            count = min(chunk_size, n_meals - start)
+            self.seed_meals(prefix, start, count, per_meal, names, dietaries, pools, rng)
+            self.stdout.write(f"  meals {start + count}/{n_meals}")
+
+        # bulk_create skipped every signal
+        bump_catalog_version()
+        content_changed()
+        invalidate_monthly_plans()
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {n_ingredients} ingredients, {n_meals} meals and {n_meals * per_meal} "
+            f"recipe lines in {time.perf_counter() - started:.1f}s."
+        ))
+
+    def dietaries(self) -> dict:
+        """
+        {canonical name: Dietary}, created when missing.
+        """
+        found = {}
+        for name in sorted(set(DIETARY_CANONICAL.values())):
+            dietary = Dietary.objects.filter(name__iexact=name).first()
+            found[name] = dietary or Dietary.objects.create(name=name)
+        return found
+
+    def seed_ingredients(self, prefix, count, dietaries, rng) -> dict:
+        """
+        Create `count` ingredients tagged with random dietaries.
+        Returns {dietary name: [Ingredient]} ("Standard" holds all of them).
+        """
+        allergens = [code for code, _ in KNOWN_ALLERGENS]
+        ingredients = [
+            Ingredient(
+                name=f"{prefix} Ingredient {i:06d}",
+                price_per_100g=Decimal(rng.randint(10, 150)).scaleb(-2),
+                energy_kj=Decimal(rng.randint(5000, 350000)).scaleb(-2),
+                protein=Decimal(rng.randint(0, 3000)).scaleb(-2),
+                fat=Decimal(rng.randint(0, 4000)).scaleb(-2),
+                carbs=Decimal(rng.randint(0, 7000)).scaleb(-2),
+                fiber=Decimal(rng.randint(0, 1500)).scaleb(-2),
+                allergen=rng.choice(allergens) if rng.random() < 0.2 else "",
+            )
+            for i in range(count)
+        ]
+        with transaction.atomic():
+            ingredients = Ingredient.objects.bulk_create(ingredients, batch_size=1000)
+            pools = {name: [] for name in dietaries}
+            links = []
+            for ingredient in ingredients:
+                pools["Standard"].append(ingredient)
+                for name, dietary in dietaries.items():
+                    if name != "Standard" and rng.random() < 0.6:
+                        pools[name].append(ingredient)
+                        links.append(Ingredient.dietaries.through(ingredient=ingredient, dietary=dietary))
+            Ingredient.dietaries.through.objects.bulk_create(links, batch_size=5000)
+        return {name: pool for name, pool in pools.items() if pool}
+
+    def seed_meals(self, prefix, start, count, per_meal, names, dietaries, pools, rng):
+        meals, recipes = [], []
+        for i in range(start, start + count):
+            dietary = rng.choice(names)
+            pool = pools[dietary]
+            items = [
+                RecipeIngredient(ingredient=ingredient, quantity_g=Decimal(rng.randint(20, 150)))
+                for ingredient in rng.sample(pool, min(per_meal, len(pool)))
+            ]
+            meals.append(Meal(name=f"{prefix} Meal {i:07d}", dietary=dietaries[dietary]))
+            recipes.append(items)
+        with transaction.atomic():
+            meals = Meal.objects.bulk_create(meals)
+            lines, totals = [], []
+            for meal, items in zip(meals, recipes):
+                for item in items:
+                    item.recipe = meal
+                    lines.append(item)
+                totals.append(MealTotals(meal=meal, **meal_snapshot(items)))
+            RecipeIngredient.objects.bulk_create(lines, batch_size=5000)
+            MealTotals.objects.bulk_create(totals, batch_size=5000)
+            write_bands({
+                meal.pk: {item.ingredient.pk for item in items}
+                for meal, items in zip(meals, recipes)
+            }, replace=False)
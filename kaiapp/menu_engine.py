@@ -0,0 +1,350 @@
+# kaiapp/menu_engine.py
+"""
+Deterministic local menu generator.
+
+Encodes the composition rules and numeric constraints of
+prompts.build_menu_prompt and searches the ingredient catalog directly:
+every candidate ingredient set (one carb, one protein, 2–3 vegetables,
+optional booster, 5–6 items) gets its whole quantity grid evaluated at once
+with NumPy, and the feasible point closest to the centre of the cost and
+weight windows is kept. No LLM call, same output shape as the model's menus.
+"""
+import itertools
+import random
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal
+import numpy as np
+from .services import hundredths, limit_hundredths, round_half_even
+
+# Default constraints: acceptance limits of the generation pipeline plus the
+# prompt's cost floor and item count.
+ENGINE_CONSTRAINTS = {
+    "min_kj": 2000,
+    "min_cost": 2.50,
+    "max_cost": 3.50,
+    "min_g": 200,
+    "max_g": 500,
+    "min_items": 5,
+    "max_items": 6,
+}
+
+# Role keywords (lowercase substrings), checked in this order
+EXCLUDED_KEYWORDS = ("flour", "powder", "salt", "sugar", "sauce", "garlic", "milk", "spice")
+BOOSTER_KEYWORDS = ("oil", "cheese", "butter")
+CARB_KEYWORDS = ("sweet potato", "potato", "rice", "pasta", "noodle", "bread", "couscous", "quinoa", "tortilla")
+PROTEIN_KEYWORDS = (
+    "chicken", "beef", "pork", "lamb", "salmon", "fish", "tuna", "shrimp", "prawn",
+    "egg", "tofu", "tempeh", "lentil", "chickpea", "bean",
+)
+VEGETABLE_KEYWORDS = (
+    "broccoli", "carrot", "onion", "spinach", "mushroom", "pepper", "cabbage", "corn",
+    "peas", "tomato", "lettuce", "cucumber", "zucchini", "kale", "pumpkin", "celery",
+)
+
+# Quantity ranges in grams (min, max) from the prompt's guidelines
+QUANTITY_RANGES = {
+    "rice": (150, 220), "pasta": (70, 100), "sweet potato": (160, 240), "potato": (180, 260),
+    "salmon": (80, 120), "shrimp": (90, 140), "tofu": (140, 220), "egg": (50, 100),
+    "oil": (5, 12), "cheese": (10, 20),
+}
+ROLE_RANGES = {"carb": (120, 220), "protein": (90, 150), "vegetable": (40, 120), "booster": (5, 20)}
+
+# Grid resolution per role
+VEGETABLE_LEVELS = (40, 60, 90, 120)
+BOOSTER_LEVELS = 3
+
+# Quantity repair: roles adjusted, in order, and the deltas (grams) tried for each
+REPAIR_ORDER = ("carb", "protein", "booster")
+REPAIR_STEPS = {"carb": range(-120, 121, 5), "protein": range(-80, 81, 5), "booster": range(-15, 16)}
+
+CUISINE_CUES = ("Teriyaki", "Karaage", "Sichuan", "Satay", "Miso", "Kiwi", "Tex-Mex", "Mediterranean",
+                "Italian", "Japanese", "Indian", "Stir-Fry", "Viet", "Islander")
+NAME_SUFFIXES = ("Bowl", "Box", "Wrap", "Stack", "Smash", "Blaze", "Boost", "Fuel", "Feast")
+
+
+def classify(ing) -> str | None:
+    """
+    Return the menu role of an ingredient: "carb", "protein", "vegetable",
+    "booster", or None for ingredients the rules don't use (spices, flour...).
+    Name keywords first, then a conservative macro-nutrient fallback.
+    """
+    name = ing.name.lower()
+    for role, keywords in (
+        (None, EXCLUDED_KEYWORDS),
+        ("booster", BOOSTER_KEYWORDS),
+        ("carb", CARB_KEYWORDS),
+        ("protein", PROTEIN_KEYWORDS),
+        ("vegetable", VEGETABLE_KEYWORDS),
+    ):
+        if any(k in name for k in keywords):
+            return role
+    if ing.fat >= 30:
+        return "booster"
+    if ing.protein >= 15 and ing.carbs < 10:
+        return "protein"
+    if ing.energy_kj < 400 and ing.fat < 2:
+        return "vegetable"
+    return None
+
+def quantity_levels(ing, role: str) -> list[int]:
+    """
+    Candidate quantities (grams) for an ingredient in its role.
+    """
+    name = ing.name.lower()
+    low, high = next(
+        (rng for key, rng in QUANTITY_RANGES.items() if key in name), ROLE_RANGES[role]
+    )
+    if role == "vegetable":
+        return [q for q in VEGETABLE_LEVELS if low <= q <= high] or [low]
+    if role == "booster":
+        return sorted({round(low + (high - low) * i / (BOOSTER_LEVELS - 1)) for i in range(BOOSTER_LEVELS)})
+    return list(range(low, high + 1, 10))
+
+def solve_quantities(ings, roles, constraints=None):
+    """
+    Find quantities for a fixed ingredient set that satisfy the constraints.
+
+    The full grid of candidate quantities is evaluated with integer NumPy
+    arithmetic (cost in exact cents, rounded half-even like the validator).
+    Among feasible points, the one closest to the centre of the cost and
+    weight windows wins; ties go to the first in grid order.
+
+    Args:
+        ings (list): Ingredient-like objects (name, price_per_100g, energy_kj, ...).
+        roles (list[str]): Role of each ingredient (see classify()).
+        constraints (dict|None): Overrides for ENGINE_CONSTRAINTS.
+
+    Returns:
+        list[int] | None: Grams per ingredient, or None if infeasible.
+    """
+    c = {**ENGINE_CONSTRAINTS, **(constraints or {})}
+    levels = [quantity_levels(ing, role) for ing, role in zip(ings, roles)]
+    if not _bounds_feasible(ings, levels, c):
+        return None
+    # Broadcast per-ingredient quantities over the grid (one axis each), in centigrams
+    n = len(levels)
+    axes = [
+        np.array(lv, dtype=np.int64).reshape([-1 if i == j else 1 for j in range(n)]) * 100
+        for i, lv in enumerate(levels)
+    ]
+    weight, cost_cents, energy_cents = grid_totals(ings, axes)
+    feasible = within_limits(weight, cost_cents, energy_cents, c)
+    if not feasible.any():
+        return None
+    min_cost = limit_hundredths(c["min_cost"], ROUND_FLOOR)
+    max_cost = limit_hundredths(c["max_cost"], ROUND_FLOOR)
+    min_g = limit_hundredths(c["min_g"], ROUND_CEILING)
+    max_g = limit_hundredths(c["max_g"], ROUND_FLOOR)
+    score = (
+        np.abs(cost_cents - (min_cost + max_cost) / 2) / max(1, max_cost - min_cost)
+        + np.abs(weight - (min_g + max_g) / 2) / max(1, max_g - min_g)
+    )
+    score[~feasible] = np.inf
+    best = np.unravel_index(int(np.argmin(score)), score.shape)
+    return [int(lv[i]) for lv, i in zip(levels, best)]
+
+def repair_quantities(ings, roles, quantities, constraints):
+    """
+    Smallest quantity change that brings a fixed ingredient set within the
+    constraints, or None if there is none.
+
+    Roles are adjusted in REPAIR_ORDER: the carb alone first, then carb and
+    protein together, then the booster too; only the largest item of each
+    role moves (the first on ties) and everything else keeps its quantity,
+    so a stage's grid has at most one axis per role (about 50k points)
+    however many items the menu has. Each stage evaluates its grid of
+    REPAIR_STEPS deltas at once and keeps the feasible point with the least
+    total grams changed.
+
+    Args:
+        ings (list): Ingredient-like objects (name, price_per_100g, energy_kj, ...).
+        roles (list[str|None]): Role of each ingredient (see classify()).
+        quantities (list): Current grams per ingredient.
+        constraints (dict): min_kj, max_cost, min_g, max_g (and optionally min_cost).
+
+    Returns:
+        list | None: New grams per ingredient (unchanged entries kept as given).
+    """
+    base = [int((Decimal(str(q)) * 100).to_integral_value()) for q in quantities]
+    largest = {}  # role -> index of its largest item
+    for i, role in enumerate(roles):
+        if role in REPAIR_ORDER and (role not in largest or base[i] > base[largest[role]]):
+            largest[role] = i
+    for stage in range(1, len(REPAIR_ORDER) + 1):
+        if REPAIR_ORDER[stage - 1] not in largest:
+            continue
+        adjustable = sorted(largest[role] for role in REPAIR_ORDER[:stage] if role in largest)
+        n = len(adjustable)
+        deltas, axes = {}, []
+        for i, q in enumerate(base):
+            if i in adjustable:
+                k = adjustable.index(i)
+                deltas[i] = np.array(REPAIR_STEPS[roles[i]], dtype=np.int64).reshape(
+                    [-1 if j == k else 1 for j in range(n)]
+                ) * 100
+                axes.append(q + deltas[i])
+            else:
+                axes.append(np.int64(q))
+        weight, cost_cents, energy_cents = grid_totals(ings, axes)
+        feasible = within_limits(weight, cost_cents, energy_cents, constraints)
+        for i in adjustable:
+            feasible = feasible & (axes[i] >= 100)
+        if not feasible.any():
+            continue
+        change = sum(np.abs(d) for d in deltas.values())
+        change = np.where(feasible, change, np.iinfo(np.int64).max)
+        best = np.unravel_index(int(np.argmin(change)), change.shape)
+        repaired = list(quantities)
+        for i in adjustable:
+            grams = base[i] + int(deltas[i].ravel()[best[adjustable.index(i)]])
+            repaired[i] = grams // 100 if grams % 100 == 0 else grams / 100
+        return repaired
+    return None
+
+def grid_totals(ings, quantities):
+    """
+    Exact totals over a broadcast grid of quantities.
+
+    Args:
+        ings (list): Ingredient-like objects (price_per_100g, energy_kj).
+        quantities (list): Centigrams per ingredient; ints or broadcastable int64 arrays.
+
+    Returns:
+        tuple: (weight in centigrams, cost in cents, energy in hundredths of kJ),
+            rounded half-even like the validator.
+    """
+    weight = sum(quantities)
+    # centigrams × hundredths per 100 g = 10000 × value in hundredths
+    raw_cost = sum(q * hundredths(ing.price_per_100g) for q, ing in zip(quantities, ings))
+    raw_energy = sum(q * hundredths(ing.energy_kj) for q, ing in zip(quantities, ings))
+    shape = np.broadcast_shapes(*(np.shape(q) for q in quantities))
+    return (
+        np.broadcast_to(weight, shape),
+        np.broadcast_to(round_half_even(raw_cost, 10000), shape),
+        np.broadcast_to(round_half_even(raw_energy, 10000), shape),
+    )
+
+def within_limits(weight, cost_cents, energy_cents, c):
+    """
+    Boolean mask of grid points inside the weight window, above the energy
+    floor and within the cost ceiling (and above min_cost, when given).
+    Limits are scaled like services.validate_menus_batch() scales them.
+    """
+    ok = (
+        (weight >= limit_hundredths(c["min_g"], ROUND_CEILING))
+        & (weight <= limit_hundredths(c["max_g"], ROUND_FLOOR))
+        & (energy_cents >= limit_hundredths(c["min_kj"], ROUND_CEILING))
+        & (cost_cents <= limit_hundredths(c["max_cost"], ROUND_FLOOR))
+    )
+    if c.get("min_cost") is not None:
+        ok = ok & (cost_cents > limit_hundredths(c["min_cost"], ROUND_FLOOR))
+    return ok
+
+def _bounds_feasible(ings, levels, c) -> bool:
+    """
+    Cheap bound check before building the grid: can the extreme quantities
+    reach the energy floor and the weight and cost windows at all?
+    """
+    low = [lv[0] for lv in levels]
+    high = [lv[-1] for lv in levels]
+    max_kj = sum(float(ing.energy_kj) * q for ing, q in zip(ings, high)) / 100
+    min_cost = sum(float(ing.price_per_100g) * q for ing, q in zip(ings, low)) / 100
+    max_cost = sum(float(ing.price_per_100g) * q for ing, q in zip(ings, high)) / 100
+    return (
+        max_kj >= float(c["min_kj"]) - 0.01
+        and sum(low) <= c["max_g"] and sum(high) >= c["min_g"]
+        and min_cost <= float(c["max_cost"]) + 0.01 and max_cost > float(c["min_cost"]) - 0.01
+    )
+
+def candidate_sets(by_role, rng, constraints):
+    """
+    Yield ingredient sets (tuples of (ingredient, role)) that follow the
+    composition rules, cycling carbs and proteins so consecutive menus differ.
+    """
+    carbs, proteins = by_role["carb"], by_role["protein"]
+    vegetables, boosters = by_role["vegetable"], by_role["booster"]
+    pairs = [(carb, protein) for protein in proteins for carb in carbs]
+    rng.shuffle(pairs)
+    shapes = [
+        (n_veg, n_boost)
+        for n_veg in (3, 2)
+        for n_boost in (0, 1)
+        if constraints["min_items"] <= 2 + n_veg + n_boost <= constraints["max_items"]
+        and n_veg <= len(vegetables) and n_boost <= len(boosters)
+    ]
+    if not pairs or not shapes:
+        return
+    veg_combos = {n: list(itertools.combinations(vegetables, n)) for n, _ in shapes}
+    for combos in veg_combos.values():
+        rng.shuffle(combos)
+    for round_no in itertools.count():
+        progressed = False
+        for index, (carb, protein) in enumerate(pairs):
+            n_veg, n_boost = shapes[(index + round_no) % len(shapes)]
+            combos = veg_combos[n_veg]
+            if round_no >= len(combos):
+                continue
+            progressed = True
+            vegs = combos[(index + round_no) % len(combos)]
+            items = [(carb, "carb"), (protein, "protein"), *((v, "vegetable") for v in vegs)]
+            if n_boost:
+                items.append((boosters[(index + round_no) % len(boosters)], "booster"))
+            yield items
+        if not progressed:
+            return
+
+def build_local_menus(ingredients, count: int, dietary: str = "Standard", constraints=None,
+                      seed=0, max_attempts: int = 2000) -> list[dict]:
+    """
+    Generate up to `count` valid, distinct menus from the given ingredients.
+
+    Args:
+        ingredients (Iterable): Ingredients allowed for the dietary.
+        count (int): Number of menus wanted.
+        dietary (str): Dietary label written into each menu.
+        constraints (dict|None): Overrides for ENGINE_CONSTRAINTS.
+        seed (int|str): Varies the search order; same seed → same menus.
+        max_attempts (int): Ingredient sets tried before giving up.
+
+    Returns:
+        list[dict]: Menus in the LLM output shape
+            {"meal_name", "description", "dietary", "items": [{"name", "quantity_g"}]}.
+    """
+    c = {**ENGINE_CONSTRAINTS, **(constraints or {})}
+    by_role = {"carb": [], "protein": [], "vegetable": [], "booster": []}
+    for ing in sorted(ingredients, key=lambda i: i.name):
+        role = classify(ing)
+        if role:
+            by_role[role].append(ing)
+
+    rng = random.Random(f"{dietary}:{seed}")
+    menus, seen = [], set()
+    for attempt, items in enumerate(candidate_sets(by_role, rng, c)):
+        if len(menus) >= count or attempt >= max_attempts:
+            break
+        key = frozenset(ing.name for ing, _ in items)
+        if key in seen:
+            continue
+        quantities = solve_quantities([i for i, _ in items], [r for _, r in items], c)
+        if quantities is None:
+            continue
+        seen.add(key)
+        menus.append(describe_menu(items, quantities, dietary, len(menus), rng))
+    return menus
+
+def describe_menu(items, quantities, dietary, index, rng) -> dict:
+    """
+    Name and describe a solved menu in the prompt's style.
+    """
+    carb, protein = items[0][0], items[1][0]
+    cue = CUISINE_CUES[(index + rng.randrange(len(CUISINE_CUES))) % len(CUISINE_CUES)]
+    suffix = NAME_SUFFIXES[index % len(NAME_SUFFIXES)]
+    vegetables = [ing.name.lower() for ing, role in items if role == "vegetable"]
+    return {
+        "meal_name": f"{cue} {protein.name} {suffix}",
+        "description": f"{protein.name.lower()}, {carb.name.lower()}, {', '.join(vegetables)} crunch",
+        "dietary": dietary,
+        "items": [
+            {"name": ing.name, "quantity_g": qty}
+            for (ing, _), qty in zip(items, quantities)
+        ],
+    }
@@ -0,0 +1,191 @@
+# kaiapp/metrics.py
+"""
+In-process counters and histograms, rendered in the Prometheus text
+exposition format at /metrics (views.metrics_view).
+
+Recorded by:
+  - MetricsMiddleware (middleware.py): wall time, ORM query count and
+    query time per request, labelled by URL name
+  - generation.py: LLM call latency and token usage (resp.usage)
+  - services.validate_menu / validate_menus_batch: pass/fail counts
+
+Values live in the worker process that recorded them; with several
+workers, scrape each one (or run a single worker behind the scraper).
+"""
+import math
+import threading
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; covers fast reads (ms) up to multi-minute LLM generations
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _labels(names, values, extra=()) -> str:
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """
+    Base for a named metric family with a fixed set of label names.
+    """
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}.")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_format(value)}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def _samples(self, key, state):
+        counts, total, count = state
+        lines, cumulative = [], 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            le = _labels(self.labelnames, key, [("le", _format(bound))])
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+REGISTRY = Registry()
+
+http_requests = REGISTRY.register(Counter(
+    "kai_http_requests_total", "HTTP requests by URL name and status.", ("method", "view", "status"),
+))
+http_duration = REGISTRY.register(Histogram(
+    "kai_http_request_duration_seconds", "Wall time until the response is returned.", ("method", "view"),
+))
+db_queries = REGISTRY.register(Histogram(
+    "kai_db_queries_per_request", "ORM queries run while handling a request.", ("view",),
+    buckets=QUERY_COUNT_BUCKETS,
+))
+db_duration = REGISTRY.register(Histogram(
+    "kai_db_query_duration_seconds", "Total ORM query time per request.", ("view",),
+))
+llm_requests = REGISTRY.register(Counter(
+    "kai_llm_requests_total", "Chat completion calls sent to the model.", ("model", "outcome"),
+))
+llm_duration = REGISTRY.register(Histogram(
+    "kai_llm_request_duration_seconds", "Chat completion latency (whole stream when streaming).", ("model",),
+))
+llm_tokens = REGISTRY.register(Counter(
+    "kai_llm_tokens_total", "Tokens reported in resp.usage.", ("model", "type"),
+))
+menu_validations = REGISTRY.register(Counter(
+    "kai_menu_validations_total", "Menus checked by validate_menu / validate_menus_batch.", ("result",),
+))
+
+
+def observe_llm_call(model: str, seconds: float, usage=None, error: bool = False):
+    """
+    Record one model call; `usage` is the response's usage object (or None).
+    """
+    llm_requests.inc(model=model, outcome="error" if error else "ok")
+    llm_duration.observe(seconds, model=model)
+    for kind in ("prompt", "completion"):
+        tokens = getattr(usage, f"{kind}_tokens", None)
+        if tokens:
+            llm_tokens.inc(tokens, model=model, type=kind)
+
+
+def observe_validations(results):
+    """
+    Count (is_valid, result) pairs from validate_menu().
+    """
+    passed = sum(1 for ok, _ in results if ok)
+    if passed:
+        menu_validations.inc(passed, result="pass")
+    if len(results) - passed:
+        menu_validations.inc(len(results) - passed, result="fail")
+
+
+def render() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,51 @@
+# kaiapp/middleware.py
+import time
+from contextlib import ExitStack
+from django.db import connections
+from . import metrics
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper() hook counting queries and their time.
+    """
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Record wall time, ORM query count and ORM time for every request,
+    labelled by URL name (resolver_match.view_name, "unmatched" for 404s).
+
+    Streaming responses are timed until the response object is returned,
+    not until the last chunk is sent.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(recorder))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        metrics.http_requests.inc(method=request.method, view=view, status=response.status_code)
+        metrics.http_duration.observe(elapsed, method=request.method, view=view)
+        metrics.db_queries.observe(recorder.count, view=view)
+        metrics.db_duration.observe(recorder.seconds, view=view)
+        return response
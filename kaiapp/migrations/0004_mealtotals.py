@@ -0,0 +1,93 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:25
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_meal_totals(apps, schema_editor):
+    """
+    Compute a totals snapshot for every existing meal.
+    """
+    Meal = apps.get_model("kaiapp", "Meal")
+    MealTotals = apps.get_model("kaiapp", "MealTotals")
+    rows = []
+    for meal in Meal.objects.prefetch_related("items__ingredient"):
+        totals = dict.fromkeys(
+            ("energy_kj", "protein", "fat", "carbs", "fiber", "cost", "weight_g"),
+            Decimal("0.00"),
+        )
+        for item in meal.items.all():
+            factor = item.quantity_g / Decimal("100")
+            for field in ("energy_kj", "protein", "fat", "carbs", "fiber"):
+                totals[field] += (
+                    getattr(item.ingredient, field) or Decimal("0.00")
+                ) * factor
+            totals["cost"] += item.ingredient.price_per_100g * factor
+            totals["weight_g"] += item.quantity_g
+        rows.append(
+            MealTotals(meal_id=meal.pk, **{k: round(v, 2) for k, v in totals.items()})
+        )
+    MealTotals.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kaiapp", "0003_alter_meal_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MealTotals",
+            fields=[
+                (
+                    "meal",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="totals",
+                        serialize=False,
+                        to="kaiapp.meal",
+                    ),
+                ),
+                (
+                    "energy_kj",
+                    models.DecimalField(
+                        db_index=True, decimal_places=2, default=0, max_digits=12
+                    ),
+                ),
+                (
+                    "protein",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "fat",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "carbs",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "fiber",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                (
+                    "cost",
+                    models.DecimalField(
+                        db_index=True, decimal_places=2, default=0, max_digits=10
+                    ),
+                ),
+                (
+                    "weight_g",
+                    models.DecimalField(decimal_places=2, default=0, max_digits=10),
+                ),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "verbose_name_plural": "meal totals",
+            },
+        ),
+        migrations.RunPython(backfill_meal_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kaiapp", "0005_generationjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="generationjob",
+            name="validation",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
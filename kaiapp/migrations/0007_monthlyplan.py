@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kaiapp", "0006_generationjob_validation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MonthlyPlan",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("dietary", models.CharField(max_length=64)),
+                ("year", models.PositiveSmallIntegerField()),
+                ("month", models.PositiveSmallIntegerField()),
+                ("revision", models.PositiveIntegerField(default=0)),
+                ("payload", models.JSONField(default=dict)),
+                ("etag", models.CharField(blank=True, max_length=66)),
+                ("stale", models.BooleanField(default=False)),
+                ("updated_at", models.DateTimeField()),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("dietary", "year", "month"), name="unique_monthly_plan"
+                    )
+                ],
+            },
+        ),
+    ]
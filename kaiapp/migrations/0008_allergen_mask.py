@@ -0,0 +1,72 @@
+# Generated by Django 5.2.5 on 2026-10-18 10:58
+
+from django.db import migrations, models
+
+# models.KNOWN_ALLERGENS order at the time of this migration
+ALLERGEN_CODES = [
+    "peanut",
+    "soy",
+    "milk",
+    "egg",
+    "wheat",
+    "gluten",
+    "tree-nut",
+    "almond",
+    "cashew",
+    "pistachio",
+    "walnut",
+    "sesame",
+    "fish",
+    "shellfish",
+]
+
+
+def backfill_allergen_masks(apps, schema_editor):
+    """
+    Set MealTotals.allergen_mask from every meal's recipe items.
+    """
+    MealTotals = apps.get_model("kaiapp", "MealTotals")
+    RecipeIngredient = apps.get_model("kaiapp", "RecipeIngredient")
+    bits = {code: 1 << i for i, code in enumerate(ALLERGEN_CODES)}
+    masks = {}
+    for meal_id, code in RecipeIngredient.objects.values_list(
+        "recipe_id", "ingredient__allergen"
+    ):
+        masks[meal_id] = masks.get(meal_id, 0) | bits.get(code, 0)
+    rows = []
+    for totals in MealTotals.objects.filter(meal_id__in=masks):
+        totals.allergen_mask = masks[totals.meal_id]
+        rows.append(totals)
+    MealTotals.objects.bulk_update(rows, ["allergen_mask"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kaiapp", "0007_monthlyplan"),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name="monthlyplan",
+            name="unique_monthly_plan",
+        ),
+        migrations.AddField(
+            model_name="mealtotals",
+            name="allergen_mask",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="monthlyplan",
+            name="allergen_mask",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddConstraint(
+            model_name="monthlyplan",
+            constraint=models.UniqueConstraint(
+                fields=("dietary", "year", "month", "allergen_mask"),
+                name="unique_monthly_plan",
+            ),
+        ),
+        migrations.RunPython(backfill_allergen_masks, migrations.RunPython.noop),
+    ]
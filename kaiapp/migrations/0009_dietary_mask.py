@@ -0,0 +1,48 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+# models.MAX_DIETARY_BITS at the time of this migration
+MAX_DIETARY_BITS = 63
+
+
+def backfill_dietary_masks(apps, schema_editor):
+    """
+    Set MealTotals.dietary_mask to the dietary bits shared by every recipe
+    item of the meal (Dietary pk n is bit n - 1).
+    """
+    Ingredient = apps.get_model("kaiapp", "Ingredient")
+    MealTotals = apps.get_model("kaiapp", "MealTotals")
+    RecipeIngredient = apps.get_model("kaiapp", "RecipeIngredient")
+    tags = {}
+    for ingredient_id, dietary_id in Ingredient.dietaries.through.objects.values_list(
+        "ingredient_id", "dietary_id"
+    ):
+        if 1 <= dietary_id <= MAX_DIETARY_BITS:
+            tags[ingredient_id] = tags.get(ingredient_id, 0) | 1 << (dietary_id - 1)
+    masks = {}
+    for meal_id, ingredient_id in RecipeIngredient.objects.values_list(
+        "recipe_id", "ingredient_id"
+    ):
+        masks[meal_id] = masks.get(meal_id, ~0) & tags.get(ingredient_id, 0)
+    rows = []
+    for totals in MealTotals.objects.filter(meal_id__in=masks):
+        totals.dietary_mask = masks[totals.meal_id]
+        rows.append(totals)
+    MealTotals.objects.bulk_update(rows, ["dietary_mask"], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kaiapp", "0008_allergen_mask"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mealtotals",
+            name="dietary_mask",
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_dietary_masks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 5.2.5 on 2026-10-18 11:06
+
+import hashlib
+from collections import defaultdict
+from decimal import Decimal
+import django.db.models.deletion
+import numpy as np
+from django.db import migrations, models
+
+# dedupe.py's fingerprint and MinHash banding at the time of this migration
+SIGNATURE_SIZE = 32
+BANDS = 8
+ROWS_PER_BAND = SIGNATURE_SIZE // BANDS
+PROFILE_STEPS = 20
+PRIME = (1 << 31) - 1
+
+
+def coefficients(label):
+    return np.array(
+        [
+            int.from_bytes(
+                hashlib.blake2b(f"{label}{i}".encode(), digest_size=8).digest(), "big"
+            )
+            % (PRIME - 1)
+            + 1
+            for i in range(SIGNATURE_SIZE)
+        ],
+        dtype=np.uint64,
+    )
+
+
+def fingerprint(quantities):
+    """
+    SHA-1 of the sorted ingredient ids and their share of the weight.
+    """
+    total = sum(quantities.values())
+    profile = ",".join(
+        f"{ingredient_id}:{round(quantity / total * PROFILE_STEPS) if total else 0}"
+        for ingredient_id, quantity in sorted(quantities.items())
+    )
+    return hashlib.sha1(profile.encode()).hexdigest()
+
+
+def band_keys(ingredient_ids, a, b):
+    ids = np.array(sorted(ingredient_ids), dtype=np.uint64) % PRIME
+    signature = ((np.outer(ids, a) + b) % PRIME).min(axis=0)
+    keys = []
+    for band in range(BANDS):
+        rows = signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND]
+        digest = hashlib.blake2b(bytes([band]) + rows.tobytes(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "big", signed=True))
+    return keys
+
+
+def backfill_fingerprints(apps, schema_editor):
+    """
+    Set MealTotals.fingerprint and write the MealBand rows of every meal
+    with recipe items, so existing meals take part in duplicate detection.
+    """
+    MealBand = apps.get_model("kaiapp", "MealBand")
+    MealTotals = apps.get_model("kaiapp", "MealTotals")
+    RecipeIngredient = apps.get_model("kaiapp", "RecipeIngredient")
+    a, b = coefficients("kai-minhash-a"), coefficients("kai-minhash-b")
+    quantities = defaultdict(lambda: defaultdict(Decimal))
+    for meal_id, ingredient_id, quantity in RecipeIngredient.objects.values_list(
+        "recipe_id", "ingredient_id", "quantity_g"
+    ).iterator(chunk_size=10000):
+        quantities[meal_id][ingredient_id] += Decimal(str(quantity))
+    rows = []
+    for totals in MealTotals.objects.filter(meal_id__in=list(quantities)):
+        totals.fingerprint = fingerprint(quantities[totals.meal_id])
+        rows.append(totals)
+    MealTotals.objects.bulk_update(rows, ["fingerprint"], batch_size=500)
+    MealBand.objects.bulk_create(
+        [
+            MealBand(meal_id=meal_id, bucket=key)
+            for meal_id, items in quantities.items()
+            for key in band_keys(items, a, b)
+        ],
+        batch_size=5000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kaiapp", "0009_dietary_mask"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="mealtotals",
+            name="fingerprint",
+            field=models.CharField(blank=True, db_index=True, max_length=40),
+        ),
+        migrations.CreateModel(
+            name="MealBand",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bucket", models.BigIntegerField(db_index=True)),
+                (
+                    "meal",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bands",
+                        to="kaiapp.meal",
+                    ),
+                ),
+            ],
+        ),
+        migrations.RunPython(backfill_fingerprints, migrations.RunPython.noop),
+    ]
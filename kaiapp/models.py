@@ -20,6 +20,60 @@ KNOWN_ALLERGENS = [
     ("shellfish", "shellfish"),
 ]
 
+# One bit per allergen code, in KNOWN_ALLERGENS order (append new codes at the end)
+ALLERGEN_BITS = {code: 1 << i for i, (code, _) in enumerate(KNOWN_ALLERGENS)}
+
+
+def allergen_mask(codes) -> int:
+    """
+    Bitmask of the given allergen codes; unknown or empty codes are ignored.
+    """
+    mask = 0
+    for code in codes:
+        mask |= ALLERGEN_BITS.get(code, 0)
+    return mask
+
+
+def parse_allergens(text: str | None) -> int:
+    """
+    Bitmask of a comma-separated list of allergen codes ("peanut,milk").
+    Raises ValueError naming any unknown codes.
+    """
+    codes = [code.strip().lower() for code in (text or "").split(",") if code.strip()]
+    unknown = [code for code in codes if code not in ALLERGEN_BITS]
+    if unknown:
+        raise ValueError(f"Unknown allergens: {', '.join(unknown)}.")
+    return allergen_mask(codes)
+
+
+def allergen_codes(mask: int) -> list[str]:
+    """
+    Allergen codes set in a bitmask, in KNOWN_ALLERGENS order.
+    """
+    return [code for code, bit in ALLERGEN_BITS.items() if mask & bit]
+
+
+# Dietary compatibility bits: Dietary pk n is bit n - 1. MealTotals.dietary_mask
+# is a signed 64-bit column, so only pks 1..63 are indexed; later rows get no bit.
+MAX_DIETARY_BITS = 63
+
+
+def dietary_bit(pk) -> int:
+    """
+    Compatibility bit of the Dietary with this pk, or 0 if it has none.
+    """
+    return 1 << (pk - 1) if pk and 1 <= pk <= MAX_DIETARY_BITS else 0
+
+
+def dietary_mask(pks) -> int:
+    """
+    Bitmask of the given Dietary pks.
+    """
+    mask = 0
+    for pk in pks:
+        mask |= dietary_bit(pk)
+    return mask
+
 class Dietary(models.Model):
     """
     Represents a dietary category or restriction.
@@ -57,6 +111,78 @@ class Ingredient(models.Model):
         return self.name
 
 
+class MealQuerySet(models.QuerySet):
+    """
+    QuerySet helpers for Meal.
+    """
+    def with_items(self):
+        """
+        Preload the dietary and every recipe item with its ingredient,
+        so totals, ingredient names and allergens are computed without
+        extra queries per meal.
+        """
+        return self.select_related("dietary").prefetch_items()
+
+    def prefetch_items(self):
+        return self.prefetch_related(
+            models.Prefetch(
+                "items",
+                queryset=RecipeIngredient.objects.select_related("ingredient").order_by("id"),
+            )
+        )
+
+    def for_fields(self, fields):
+        """
+        Load only what the given MealSerializer fields need: the dietary
+        join for "dietary", recipe items for "ingredient_names" and
+        "allergens", the totals snapshot for total_* fields.
+        """
+        fields = set(fields)
+        qs = self
+        if "dietary" in fields:
+            qs = qs.select_related("dietary")
+        if fields & {"ingredient_names", "allergens"}:
+            qs = qs.prefetch_items()
+        if any(name.startswith("total_") for name in fields):
+            qs = qs.with_totals()
+        return qs
+
+    def with_totals(self):
+        """
+        Annotate each meal with its MealTotals snapshot as
+        total_energy_kj, total_protein, ..., total_cost, total_weight_g.
+        The annotations are None for meals without a snapshot row.
+        """
+        return self.annotate(**{
+            f"total_{field}": models.F(f"totals__{field}")
+            for field in MealTotals.TOTAL_FIELDS
+        })
+
+    def exclude_allergens(self, mask: int):
+        """
+        Meals containing none of the allergens in `mask` (see allergen_mask()),
+        checked with one bitwise predicate on the totals snapshot. Meals
+        without a snapshot row are excluded, as their allergens are unknown.
+        """
+        if not mask:
+            return self
+        return self.alias(
+            allergen_hits=models.F("totals__allergen_mask").bitand(mask)
+        ).filter(allergen_hits=0)
+
+    def compatible_with(self, mask: int):
+        """
+        Meals whose every ingredient carries all the dietaries in `mask`
+        (see dietary_mask()), checked with one bitwise predicate on the
+        totals snapshot instead of a join over the recipe items.
+        """
+        if not mask:
+            return self
+        return self.alias(
+            dietary_hits=models.F("totals__dietary_mask").bitand(mask)
+        ).filter(dietary_hits=mask)
+
+
 class Meal(models.Model):
     """
     Represents a complete meal recipe.
@@ -75,6 +201,8 @@ class Meal(models.Model):
         related_name="meals",
     )
 
+    objects = MealQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
@@ -100,3 +228,112 @@ class RecipeIngredient(models.Model):
 
     def __str__(self):
         return f"{self.ingredient.name} in {self.recipe.name} ({self.quantity_g} g)"
+
+
+class MealTotals(models.Model):
+    """
+    Denormalized snapshot of a meal's nutrition, cost and weight totals,
+    plus bitmask indexes and the duplicate fingerprint of its ingredients
+    (INDEX_FIELDS).
+    Recomputed for the affected meals whenever a RecipeIngredient or an
+    Ingredient changes (see signals.py), so reads, sorts and filters do not
+    walk the recipe items. Rebuild with `manage.py rebuild_meal_totals`.
+    """
+    TOTAL_FIELDS = ("energy_kj", "protein", "fat", "carbs", "fiber", "cost", "weight_g")
+    INDEX_FIELDS = ("allergen_mask", "dietary_mask", "fingerprint")
+
+    meal = models.OneToOneField(
+        Meal, primary_key=True, on_delete=models.CASCADE, related_name="totals"
+    )
+    energy_kj = models.DecimalField(max_digits=12, decimal_places=2, default=0, db_index=True)  # kJ
+    protein = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # g
+    fat = models.DecimalField(max_digits=10, decimal_places=2, default=0)      # g
+    carbs = models.DecimalField(max_digits=10, decimal_places=2, default=0)    # g
+    fiber = models.DecimalField(max_digits=10, decimal_places=2, default=0)    # g
+    cost = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True)  # NZD
+    weight_g = models.DecimalField(max_digits=10, decimal_places=2, default=0)  # total grams
+    allergen_mask = models.PositiveIntegerField(default=0)  # ALLERGEN_BITS of any item's allergen
+    dietary_mask = models.BigIntegerField(default=0)  # dietary_bit()s shared by every item (0 if no items)
+    fingerprint = models.CharField(max_length=40, blank=True, db_index=True)  # dedupe.fingerprint() of the items
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "meal totals"
+
+    def __str__(self):
+        return f"Totals for {self.meal_id}"
+
+
+class MealBand(models.Model):
+    """
+    One locality-sensitive hashing bucket of a meal's ingredient set
+    (dedupe.band_keys()). Meals sharing a bucket are near-duplicate
+    candidates. Written alongside MealTotals by refresh_meal_totals().
+    """
+    meal = models.ForeignKey(Meal, on_delete=models.CASCADE, related_name="bands")
+    bucket = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f"Band {self.bucket} of {self.meal_id}"
+
+
+class GenerationJob(models.Model):
+    """
+    An asynchronous run of the menu generation pipeline.
+    Created by POST /api/generate-menus/ with "async": true, executed by
+    the in-process worker pool or `manage.py run_generation_jobs`, and
+    polled through GET /api/generate-menus/<id>/.
+    """
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (SUCCEEDED, "Succeeded"),
+        (FAILED, "Failed"),
+    ]
+
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING, db_index=True)
+    params = models.JSONField(default=dict)  # run_generation() keyword arguments
+    stage = models.CharField(max_length=32, blank=True)  # prompting / validating / saving
+    progress_done = models.PositiveIntegerField(default=0)
+    progress_total = models.PositiveIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)  # error text when failed
+    validation = models.JSONField(default=dict, blank=True)  # unchanged / repaired / rejected counts
+    meals = models.ManyToManyField(Meal, blank=True, related_name="generation_jobs")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Generation job {self.pk} ({self.status})"
+
+
+class MonthlyPlan(models.Model):
+    """
+    A stored monthly calendar served by GET /api/monthly-menu/.
+    Built once per (dietary, year, month, excluded allergens) with a seeded
+    RNG (see planning.py), marked stale when the dietary's meals change and
+    rebuilt on the next request, or rebuilt with a new revision from the admin.
+    """
+    dietary = models.CharField(max_length=64)  # canonical name, see normalize_dietary()
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    revision = models.PositiveIntegerField(default=0)  # part of the RNG seed; bumped to reshuffle
+    allergen_mask = models.PositiveIntegerField(default=0)  # allergens excluded from the candidates
+    payload = models.JSONField(default=dict)  # {"startDay", "daysInMonth", "menuItems"}
+    etag = models.CharField(max_length=66, blank=True)  # quoted hash of payload
+    stale = models.BooleanField(default=False)  # meal set changed since the payload was built
+    updated_at = models.DateTimeField()  # Last-Modified: when the payload last changed
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["dietary", "year", "month", "allergen_mask"], name="unique_monthly_plan"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.dietary} {self.year}-{self.month:02d}"
@@ -0,0 +1,28 @@
+# kaiapp/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+class MealCursorPagination(CursorPagination):
+    """
+    Cursor pagination for /api/meals/, opt-in so existing clients keep
+    getting a plain list: it applies only when the request has ?cursor= or
+    ?page_size=. Pages follow ?ordering= (default id); ties are broken by
+    id so the order is stable across pages.
+
+    Response: {"next": <url|null>, "previous": <url|null>, "results": [...]}
+    """
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not {self.cursor_query_param, self.page_size_query_param} & set(request.query_params):
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if not any(field.lstrip("-") in ("id", "pk") for field in ordering):
+            ordering += ("id",)
+        return ordering
@@ -0,0 +1,123 @@
+# kaiapp/planning.py
+import hashlib
+import json
+from datetime import date
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import MonthlyPlan
+from .scheduler import build_month_payloads, plan_constraints
+
+
+def target_month(today: date | None = None) -> tuple[int, int]:
+    """
+    (year, month) of the calendar month after `today` (default: local today).
+    """
+    today = today or timezone.localdate()
+    if today.month == 12:
+        return today.year + 1, 1
+    return today.year, today.month + 1
+
+
+def build_month_payload(dietary: str, year: int, month: int, revision: int = 0,
+                        allergen_mask: int = 0) -> dict | None:
+    """
+    Schedule the month's weekdays (Mon–Fri) for one dietary under the
+    configured constraints (scheduler.py), leaving out meals with any
+    allergen in `allergen_mask`. The RNG is seeded with (dietary, year,
+    month, revision, allergen_mask) and candidates are read in id order,
+    so the same meal set always gives the same plan.
+    Returns None if the dietary has no (allergen-free) meals.
+    """
+    return build_month_payloads(
+        [dietary], year, month, {dietary: revision}, allergen_mask=allergen_mask
+    )[dietary]
+
+
+def payload_etag(payload: dict) -> str:
+    digest = hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def get_monthly_plan(dietary: str, year: int, month: int, allergen_mask: int = 0) -> MonthlyPlan | None:
+    """
+    Return the stored plan, building it on first use or when it is stale.
+    Returns None (and drops any stored plan) if the dietary has no meals.
+    """
+    key = {"dietary": dietary, "year": year, "month": month, "allergen_mask": allergen_mask}
+    plan = MonthlyPlan.objects.filter(**key).first()
+    if plan is not None and not plan.stale and plan.payload.get("constraints") == plan_constraints():
+        return plan
+    if plan is None:
+        plan = MonthlyPlan(**key)
+    return rebuild_plan(plan)
+
+
+def prepare_monthly_plans(dietaries, year: int, month: int) -> dict:
+    """
+    Build (or refresh) the plans of several dietaries at once: candidates
+    for all of them are loaded together and each month is scheduled in
+    a few milliseconds.
+
+    Returns:
+        dict: {dietary: MonthlyPlan or None (no meals)}
+    """
+    dietaries = list(dietaries)
+    stored = {
+        plan.dietary: plan
+        for plan in MonthlyPlan.objects.filter(dietary__in=dietaries, year=year, month=month, allergen_mask=0)
+    }
+    plans = {d: stored.get(d) or MonthlyPlan(dietary=d, year=year, month=month) for d in dietaries}
+    payloads = build_month_payloads(dietaries, year, month, {d: p.revision for d, p in plans.items()})
+    return {d: store_plan(plans[d], payloads[d]) for d in dietaries}
+
+
+def rebuild_plan(plan: MonthlyPlan) -> MonthlyPlan | None:
+    """
+    Recompute a plan's payload for its current revision and save it.
+    """
+    return store_plan(
+        plan, build_month_payload(plan.dietary, plan.year, plan.month, plan.revision, plan.allergen_mask)
+    )
+
+
+def store_plan(plan: MonthlyPlan, payload: dict | None) -> MonthlyPlan | None:
+    """
+    Save a freshly built payload on a plan (None drops the plan).
+    Last-Modified only moves when the payload actually changes.
+    """
+    if payload is None:
+        if plan.pk:
+            plan.delete()
+        return None
+    etag = payload_etag(payload)
+    if etag != plan.etag:
+        plan.payload, plan.etag, plan.updated_at = payload, etag, timezone.now()
+    plan.stale = False
+    try:
+        with transaction.atomic():
+            plan.save()
+    except IntegrityError:
+        # Another request stored the same (dietary, year, month, allergens) first
+        return MonthlyPlan.objects.get(
+            dietary=plan.dietary, year=plan.year, month=plan.month, allergen_mask=plan.allergen_mask
+        )
+    return plan
+
+
+def invalidate_monthly_plans(dietaries=None) -> int:
+    """
+    Mark plans stale so they are rebuilt on next request, whatever
+    allergens they exclude. `dietaries` are meal dietary names (None
+    entries mean Standard); pass nothing to invalidate every plan.
+    """
+    qs = MonthlyPlan.objects.filter(stale=False)
+    if dietaries is not None:
+        names = {str(name or "Standard").lower() for name in dietaries}
+        if not names:
+            return 0
+        query = Q()
+        for name in names:
+            query |= Q(dietary__iexact=name)
+        qs = qs.filter(query)
+    return qs.update(stale=True)
@@ -0,0 +1,36 @@
+# kaiapp/renderers.py
+from decimal import Decimal
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to DRF's encoder
+    orjson = None
+
+
+def _default(obj):
+    # Same as DRF's JSONEncoder for the types meal rows contain
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with orjson when it is installed.
+
+    Output is byte-identical to JSONRenderer for plain data (dicts, lists,
+    str, int, float, bool, None, Decimal): compact separators, UTF-8, and
+    U+2028 / U+2029 escaped. Indented output and anything orjson cannot
+    encode go through JSONRenderer.
+    """
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        if self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=_default)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace("\u2028".encode(), b"\\u2028").replace("\u2029".encode(), b"\\u2029")
@@ -0,0 +1,311 @@
+# kaiapp/scheduler.py
+"""
+Constraint-aware weekday scheduler behind the monthly plans (planning.py).
+
+Days are filled in order. For each day, every candidate meal is scored at
+once with NumPy:
+
+  - hard filters: not served within the no-repeat window, a protein source
+    and cuisine not yet used this week, and a choice that keeps the month
+    feasible (budget left for the cheapest meals on the remaining days,
+    protein and energy floors still reachable with the richest ones);
+    each filter is relaxed only when nothing passes it
+  - score: seeded noise for variety, minus penalties for spending above
+    the per-day budget allowance or falling below the per-day protein and
+    energy still needed
+
+so a month costs O(days × candidates) array operations, with no retries.
+"""
+import calendar
+import random
+from collections import namedtuple
+from datetime import date
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Q
+from .catalog import ingredient_catalog
+from .menu_engine import CUISINE_CUES, classify
+from .models import Meal, RecipeIngredient, allergen_codes
+from .services import refresh_meal_totals
+
+# Default constraints (override with settings.MONTHLY_PLAN_CONSTRAINTS)
+#   no_repeat_days    - weekdays before a meal may be served again
+#   monthly_budget    - total cost of the month's meals (None = no budget)
+#   min_avg_protein   - grams per meal, averaged over the month (None = none)
+#   min_avg_energy_kj - kJ per meal, averaged over the month (None = none)
+#   weekly_variety    - no protein source or cuisine twice in the same week
+PLAN_CONSTRAINTS = {
+    "no_repeat_days": 10,
+    "monthly_budget": None,
+    "min_avg_protein": None,
+    "min_avg_energy_kj": None,
+    "weekly_variety": True,
+}
+
+# Candidate meals of one dietary as parallel arrays.
+#   protein_source / cuisine are small int codes, -1 when unknown
+#   (unknown values are never counted as repeats)
+Candidates = namedtuple(
+    "Candidates", ["ids", "names", "cost", "protein", "energy", "protein_source", "cuisine"]
+)
+
+
+def plan_constraints(overrides=None) -> dict:
+    return {
+        **PLAN_CONSTRAINTS,
+        **getattr(settings, "MONTHLY_PLAN_CONSTRAINTS", {}),
+        **(overrides or {}),
+    }
+
+
+def weekdays(year: int, month: int) -> list[date]:
+    days_in_month = calendar.monthrange(year, month)[1]
+    return [
+        d for d in (date(year, month, day) for day in range(1, days_in_month + 1))
+        if d.weekday() <= 4  # 只排週一~週五
+    ]
+
+
+def meal_filter(dietary: str) -> Q:
+    """
+    Meals offered for a canonical dietary name.
+    Standard includes meals explicitly tagged Standard OR with no dietary tag.
+    """
+    if dietary == "Standard":
+        return Q(dietary__name__iexact="Standard") | Q(dietary__isnull=True)
+    return Q(dietary__name__iexact=dietary)
+
+
+def load_candidates(dietaries, allergen_mask: int = 0) -> dict:
+    """
+    Candidates for several dietaries with three queries in total (meals
+    missing a MealTotals snapshot, meals with their totals, then recipe
+    lines for protein sources), leaving out meals with any allergen in
+    `allergen_mask`. Missing snapshots are written first, so such meals are
+    not scheduled as costing nothing.
+
+    Returns:
+        dict: {dietary: Candidates}; dietaries without meals are absent.
+    """
+    dietaries = list(dict.fromkeys(dietaries))
+    query = Q()
+    for dietary in dietaries:
+        query |= meal_filter(dietary)
+    missing = list(Meal.objects.filter(query, totals__isnull=True).values_list("pk", flat=True))
+    if missing:
+        refresh_meal_totals(missing)
+    rows = list(
+        Meal.objects.filter(query).exclude_allergens(allergen_mask).order_by("id").values_list(
+            "id", "name", "dietary__name", F("totals__cost"), F("totals__protein"), F("totals__energy_kj"),
+        )
+    )
+    sources = main_protein_sources([row[0] for row in rows])
+
+    source_codes, cuisine_codes = {}, {}
+    grouped = {}
+    for meal_id, name, dietary_name, cost, protein, energy in rows:
+        for dietary in dietaries:
+            if _matches(dietary, dietary_name):
+                grouped.setdefault(dietary, []).append((
+                    meal_id, name, float(cost or 0), float(protein or 0), float(energy or 0),
+                    _code(source_codes, sources.get(meal_id)),
+                    _code(cuisine_codes, meal_cuisine(name)),
+                ))
+    return {
+        dietary: Candidates(
+            ids=[m[0] for m in meals],
+            names=[m[1] for m in meals],
+            cost=np.array([m[2] for m in meals]),
+            protein=np.array([m[3] for m in meals]),
+            energy=np.array([m[4] for m in meals]),
+            protein_source=np.array([m[5] for m in meals], dtype=np.int64),
+            cuisine=np.array([m[6] for m in meals], dtype=np.int64),
+        )
+        for dietary, meals in grouped.items()
+    }
+
+
+def _matches(dietary: str, dietary_name: str | None) -> bool:
+    if dietary == "Standard":
+        return dietary_name is None or dietary_name.lower() == "standard"
+    return dietary_name is not None and dietary_name.lower() == dietary.lower()
+
+
+def _code(codes: dict, value) -> int:
+    if value is None:
+        return -1
+    return codes.setdefault(value, len(codes))
+
+
+def main_protein_sources(meal_ids) -> dict:
+    """
+    {meal id: lowercased name of its heaviest protein-role ingredient}.
+    """
+    heaviest = {}
+    items = RecipeIngredient.objects.filter(recipe_id__in=meal_ids).values_list(
+        "recipe_id", "ingredient__name", "quantity_g"
+    )
+    for meal_id, name, quantity in items:
+        record = ingredient_catalog.get(name)
+        if record is None or classify(record) != "protein":
+            continue
+        if meal_id not in heaviest or quantity > heaviest[meal_id][1]:
+            heaviest[meal_id] = (name.lower(), quantity)
+    return {meal_id: name for meal_id, (name, _) in heaviest.items()}
+
+
+def meal_cuisine(name: str) -> str | None:
+    """
+    Cuisine cue in a meal name ("Teriyaki Tofu Bowl" → "teriyaki"), if any.
+    """
+    lowered = name.lower()
+    return next((cue.lower() for cue in CUISINE_CUES if cue.lower() in lowered), None)
+
+
+def schedule(candidates: Candidates, days: list[date], constraints: dict, rng: random.Random):
+    """
+    Assign a candidate to each day.
+
+    Returns:
+        tuple: (candidate index per day, summary dict with the month's
+                totals and which constraints were met)
+    """
+    n_days, n = len(days), len(candidates.ids)
+    cost, protein, energy = candidates.cost, candidates.protein, candidates.energy
+    noise = np.random.default_rng(rng.getrandbits(64)).random((n_days, n))
+    window = max(0, int(constraints["no_repeat_days"] or 0))
+    budget = constraints["monthly_budget"]
+    floors = [
+        (protein, constraints["min_avg_protein"]),
+        (energy, constraints["min_avg_energy_kj"]),
+    ]
+
+    last_used = np.full(n, -np.inf)
+    picks, spent, totals = [], 0.0, [0.0, 0.0]
+    week, week_sources, week_cuisines = None, set(), set()
+    for t, day in enumerate(days):
+        if day.isocalendar()[:2] != week:
+            week, week_sources, week_cuisines = day.isocalendar()[:2], set(), set()
+        remaining = n_days - t
+
+        # Hard filters, most important first; each is skipped if it would leave nothing
+        filters = []
+        if budget is not None:
+            filters.append(cost + (remaining - 1) * cost.min() <= budget - spent + 1e-9)
+        for (values, floor), total in zip(floors, totals):
+            if floor is not None:
+                filters.append(total + values + (remaining - 1) * values.max() >= floor * n_days - 1e-9)
+        if window:
+            since = t - last_used
+            fresh = since >= window
+            filters.append(fresh if fresh.any() else since == since.max())
+        if constraints["weekly_variety"]:
+            filters.append(~np.isin(candidates.protein_source, list(week_sources)))
+            filters.append(~np.isin(candidates.cuisine, list(week_cuisines)))
+        allowed = np.ones(n, dtype=bool)
+        for f in filters:
+            if (allowed & f).any():
+                allowed &= f
+
+        # Soft guidance towards the per-day allowance and the floors still needed
+        penalty = np.zeros(n)
+        if budget is not None:
+            allowance = max((budget - spent) / remaining, 1e-9)
+            penalty += np.maximum(0, cost - allowance) / allowance
+        for (values, floor), total in zip(floors, totals):
+            if floor is not None:
+                needed = (floor * n_days - total) / remaining
+                if needed > 0:
+                    penalty += np.maximum(0, needed - values) / needed
+        score = np.where(allowed, noise[t] - 3 * penalty, -np.inf)
+
+        i = int(np.argmax(score))
+        picks.append(i)
+        last_used[i] = t
+        spent += cost[i]
+        totals[0] += protein[i]
+        totals[1] += energy[i]
+        if candidates.protein_source[i] >= 0:
+            week_sources.add(int(candidates.protein_source[i]))
+        if candidates.cuisine[i] >= 0:
+            week_cuisines.add(int(candidates.cuisine[i]))
+
+    return picks, summarize(candidates, picks, constraints)
+
+
+def summarize(candidates: Candidates, picks: list, constraints: dict) -> dict:
+    """
+    Month totals of a schedule and whether each constraint holds.
+    """
+    n_days = max(1, len(picks))
+    total_cost = round(float(candidates.cost[picks].sum()), 2) if picks else 0.0
+    avg_protein = round(float(candidates.protein[picks].sum()) / n_days, 2) if picks else 0.0
+    avg_energy = round(float(candidates.energy[picks].sum()) / n_days, 2) if picks else 0.0
+    window = int(constraints["no_repeat_days"] or 0)
+    last_seen, repeats = {}, 0
+    for t, i in enumerate(picks):
+        if i in last_seen and t - last_seen[i] < window:
+            repeats += 1
+        last_seen[i] = t
+    budget, min_protein, min_energy = (
+        constraints["monthly_budget"], constraints["min_avg_protein"], constraints["min_avg_energy_kj"]
+    )
+    return {
+        "totalCost": total_cost,
+        "avgProtein": avg_protein,
+        "avgEnergyKj": avg_energy,
+        "satisfied": {
+            "noRepeat": repeats == 0,
+            "budget": budget is None or total_cost <= budget + 1e-9,
+            "protein": min_protein is None or avg_protein >= min_protein - 1e-9,
+            "energy": min_energy is None or avg_energy >= min_energy - 1e-9,
+        },
+    }
+
+
+def build_month_payloads(dietaries, year: int, month: int, revisions=None, constraints=None,
+                         allergen_mask: int = 0) -> dict:
+    """
+    Schedule the month for several dietaries in one call.
+
+    Args:
+        dietaries (Iterable[str]): Canonical dietary names.
+        year, month (int): Month to plan.
+        revisions (dict|None): {dietary: revision} mixed into each RNG seed.
+        constraints (dict|None): Overrides for PLAN_CONSTRAINTS.
+        allergen_mask (int): Allergens no scheduled meal may contain
+            (models.allergen_mask()).
+
+    Returns:
+        dict: {dietary: payload or None (no meals)}, payloads shaped like
+            {"startDay", "daysInMonth", "menuItems", "constraints", "summary"}
+            plus "excludedAllergens" when allergen_mask is set.
+    """
+    c = plan_constraints(constraints)
+    dietaries = list(dietaries)
+    pools = load_candidates(dietaries, allergen_mask)
+    days = weekdays(year, month)
+    payloads = {}
+    for dietary in dietaries:
+        candidates = pools.get(dietary)
+        if candidates is None:
+            payloads[dietary] = None
+            continue
+        revision = (revisions or {}).get(dietary, 0)
+        seed = f"{dietary}:{year}-{month:02d}:{revision}"
+        rng = random.Random(f"{seed}:{allergen_mask}" if allergen_mask else seed)
+        picks, summary = schedule(candidates, days, c, rng)
+        payloads[dietary] = {
+            # Python weekday(): Mon=0..Sun=6, but frontend expects Sun=0..Sat=6
+            "startDay": (date(year, month, 1).weekday() + 1) % 7,
+            "daysInMonth": calendar.monthrange(year, month)[1],
+            "menuItems": [
+                {"date": d.isoformat(), "mealId": str(candidates.ids[i]), "menuName": candidates.names[i]}
+                for d, i in zip(days, picks)
+            ],
+            "constraints": c,
+            "summary": summary,
+        }
+        if allergen_mask:
+            payloads[dietary]["excludedAllergens"] = allergen_codes(allergen_mask)
+    return payloads
@@ -1,6 +1,7 @@
+from django.db.models import QuerySet
 from rest_framework import serializers
-from .models import Dietary, Ingredient, Meal, RecipeIngredient
-from decimal import Decimal
+from .models import Dietary, Ingredient, Meal, MealTotals, RecipeIngredient
+from .services import cached_meal_totals, meal_totals
 
 class DietarySerializer(serializers.ModelSerializer):
     """
@@ -61,15 +62,23 @@ class MealSerializer(serializers.ModelSerializer):
             "total_energy_kj", "total_protein", "total_fat",
             "total_carbs", "total_fiber", "total_cost"
         ]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        """
+        Args:
+            fields (Iterable[str]|None): Sparse fieldset; other fields are
+                dropped, so their methods never run.
+        """
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
         
     def get_ingredient_names(self, obj):
         """
         Return a list of ingredient names for the meal.
         """
-        return list(
-            obj.items.select_related("ingredient")
-            .values_list("ingredient__name", flat=True)
-        )
+        return [item.ingredient.name for item in obj.items.all()]
 
     def get_allergens(self, obj):
         """
@@ -77,71 +86,123 @@ class MealSerializer(serializers.ModelSerializer):
         - Excludes null/empty allergen values.
         - Returns unique values only.
         """
-        # Step 1: 拿到代碼列表
-        return list(
-            obj.items
-              .exclude(ingredient__allergen__isnull=True)
-              .exclude(ingredient__allergen__exact="")
-              .values_list("ingredient__allergen", flat=True)
-              .distinct()
-        )
-        # Step 2: 建立 choices_map {code: label}
-        choices_map = dict(Ingredient._meta.get_field("allergen").choices)
-        # Step 3: 轉成標籤（找不到的就回傳原始代碼）
-        labels = [choices_map.get(c, c) for c in codes]
-        return labels or None
+        codes = []
+        for item in obj.items.all():
+            code = item.ingredient.allergen
+            if code and code not in codes:
+                codes.append(code)
+        return codes
         
     def get_total_energy_kj(self, obj):
         """
         Compute total energy (kJ) for the meal by summing all ingredients.
         """
-        return self._sum_nutrition(obj, "energy_kj")
+        return self._totals(obj)["energy_kj"]
 
     def get_total_protein(self, obj):
         """
         Compute total protein (g) for the meal by summing all ingredients.
         """
-        return self._sum_nutrition(obj, "protein")
+        return self._totals(obj)["protein"]
 
     def get_total_fat(self, obj):
         """
         Compute total fat (g) for the meal by summing all ingredients.
         """
-        return self._sum_nutrition(obj, "fat")
+        return self._totals(obj)["fat"]
 
     def get_total_carbs(self, obj):
         """
         Compute total carbohydrates (g) for the meal by summing all ingredients.
         """
-        return self._sum_nutrition(obj, "carbs")
+        return self._totals(obj)["carbs"]
 
     def get_total_fiber(self, obj):
         """
         Compute total fiber (g) for the meal by summing all ingredients.
         """
-        return self._sum_nutrition(obj, "fiber")
+        return self._totals(obj)["fiber"]
 
     def get_total_cost(self, obj):
         """
         Compute total cost (NZD) for the meal.
         Formula: Σ(price_per_100g × (quantity_g / 100)).
         """
-        total = Decimal("0.00")
-        for item in obj.items.all():
-            total += item.ingredient.price_per_100g * (item.quantity_g / Decimal("100"))
-        return round(total, 2)
+        return self._totals(obj)["cost"]
 
-    def _sum_nutrition(self, obj, field_name):
+    def _totals(self, obj):
         """
-        Helper function to compute total nutrition (any field) for a meal.
-        Args:
-            obj (Meal): The meal instance.
-            field_name (str): The field to sum ("energy_kj", "protein", etc.)
-        Returns:
-            Decimal: Rounded sum of that nutrition value across all ingredients.
+        Every total of the meal, computed once (services.cached_meal_totals()).
         """
-        total = Decimal("0.00")
-        for item in obj.items.all():
-            value_per_100g = getattr(item.ingredient, field_name) or Decimal("0.00")
-            total += value_per_100g * (item.quantity_g / Decimal("100"))
-        return round(total, 2)
+        return cached_meal_totals(obj)
+
+
+def meal_rows(meals, fields=None) -> list[dict]:
+    """
+    Read-only fast path for meal listings: the same dicts MealSerializer
+    produces (same keys, order and values), built from values() rows
+    instead of model instances and per-field method calls.
+
+    Costs one query for the meals (with dietary name and totals snapshot)
+    plus one for recipe items when ingredient names or allergens are
+    requested. Meals without a snapshot fall back to meal_totals().
+
+    Args:
+        meals (QuerySet|list[Meal]): Filtered and ordered meals, or one page of them.
+        fields (Iterable[str]|None): Sparse fieldset, as MealSerializer(fields=...).
+
+    Returns:
+        list[dict]: Rows in the order of `meals`.
+    """
+    wanted = [f for f in MealSerializer.Meta.fields if fields is None or f in fields]
+    totals = [f for f in MealTotals.TOTAL_FIELDS if f"total_{f}" in wanted]
+    columns = ["id", *(f for f in ("name", "description") if f in wanted)]
+    if "dietary" in wanted:
+        columns.append("dietary__name")
+    columns += [f"totals__{f}" for f in totals]
+
+    if isinstance(meals, QuerySet):
+        # Drop prefetches and annotations from the list queryset; keep filters and order
+        records = list(meals.prefetch_related(None).values(*columns))
+        meal_ids = meals.values("pk")
+    else:
+        order = {meal.pk: n for n, meal in enumerate(meals)}
+        records = sorted(
+            Meal.objects.filter(pk__in=order).values(*columns), key=lambda r: order[r["id"]]
+        )
+        meal_ids = list(order)
+
+    names, allergens = {}, {}
+    if "ingredient_names" in wanted or "allergens" in wanted:
+        items = RecipeIngredient.objects.filter(recipe_id__in=meal_ids).order_by("id").values_list(
+            "recipe_id", "ingredient__name", "ingredient__allergen"
+        )
+        for meal_id, name, code in items:
+            names.setdefault(meal_id, []).append(name)
+            codes = allergens.setdefault(meal_id, [])
+            if code and code not in codes:
+                codes.append(code)
+
+    missing = {r["id"] for r in records if totals and r[f"totals__{totals[0]}"] is None}
+    fallback = {m.pk: meal_totals(m) for m in Meal.objects.with_items().filter(pk__in=missing)} if missing else {}
+
+    rows = []
+    for r in records:
+        meal_id = r["id"]
+        row = {}
+        for field in wanted:
+            if field == "dietary":
+                # DRF skips a dotted source whose parent is None
+                if r["dietary__name"] is not None:
+                    row[field] = r["dietary__name"]
+            elif field == "ingredient_names":
+                row[field] = names.get(meal_id, [])
+            elif field == "allergens":
+                row[field] = allergens.get(meal_id, [])
+            elif field.startswith("total_"):
+                key = field[len("total_"):]
+                row[field] = fallback[meal_id][key] if meal_id in fallback else r[f"totals__{key}"]
+            else:
+                row[field] = r[field]
+        rows.append(row)
+    return rows
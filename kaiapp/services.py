@@ -1,6 +1,17 @@
 # kaiapp/services.py
-from decimal import Decimal
-from .models import Ingredient
+from collections import defaultdict
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal, InvalidOperation
+import numpy as np
+from . import metrics
+from .catalog import ingredient_catalog
+from .dedupe import fingerprint, write_bands
+from .models import Ingredient, Meal, MealTotals, RecipeIngredient, allergen_mask, dietary_bit
+
+# Per-100g nutrition fields summed into meal totals
+NUTRITION_FIELDS = ("energy_kj", "protein", "fat", "carbs", "fiber")
+
+# Default limits of validate_menu(), shared with validate_menus_batch()
+MENU_LIMITS = {"min_kj": 2500, "max_cost": 3, "min_g": 200, "max_g": 350}
 
 def compute_totals(items):
     """
@@ -15,11 +26,15 @@ def compute_totals(items):
     
     Raises:
         ValueError: If an ingredient cannot be found in the database.
+
+    Ingredients are resolved through the process-local catalog cache,
+    so no query is issued while the catalog version is unchanged.
     """
     total_energy = Decimal("0")
     total_cost = Decimal("0")
+    catalog = ingredient_catalog.records()
     for it in items:
-        ing = Ingredient.objects.filter(name__iexact=it["name"]).first()
+        ing = catalog.get(str(it["name"]).lower())
         if not ing:
             raise ValueError(f"Ingredient not found: {it['name']}")
         qty = Decimal(str(it["quantity_g"]))
@@ -50,6 +65,16 @@ def validate_menu(items, min_kj=2500, max_cost=3, min_g=200, max_g=350):
         tuple: (is_valid, result)
             - If valid: (True, {"total_kj": x, "total_cost": y})
             - If invalid: (False, error_message)
+
+    Outcomes are counted in metrics.py.
+    """
+    result = _validate_menu(items, min_kj=min_kj, max_cost=max_cost, min_g=min_g, max_g=max_g)
+    metrics.observe_validations([result])
+    return result
+
+def _validate_menu(items, min_kj=2500, max_cost=3, min_g=200, max_g=350):
+    """
+    validate_menu() without the metrics, for callers that count in bulk.
     """
     total_g = sum(Decimal(str(i["quantity_g"])) for i in items)
     if not (Decimal(str(min_g)) <= total_g <= Decimal(str(max_g))):
@@ -63,3 +88,261 @@ def validate_menu(items, min_kj=2500, max_cost=3, min_g=200, max_g=350):
     if total_cost > Decimal(str(max_cost)):
         return False, f"cost={total_cost} > {max_cost}"
     return True, {"total_kj": total_kj, "total_cost": total_cost}
+
+def hundredths(value):
+    """
+    Return value × 100 as an int when it is exact at 2 decimals, else None.
+    Raises InvalidOperation/ValueError/TypeError for non-numeric input.
+    """
+    if type(value) is int:
+        return value * 100
+    scaled = Decimal(str(value)).scaleb(2)
+    if scaled != scaled.to_integral_value():
+        return None
+    return int(scaled)
+
+def limit_hundredths(value, rounding):
+    """
+    Scale a limit to integer hundredths, rounding toward the side that keeps
+    integer comparisons equivalent to the exact Decimal comparison.
+    """
+    return int(Decimal(str(value)).scaleb(2).to_integral_value(rounding=rounding))
+
+def round_half_even(numer, denom):
+    """
+    Vectorized round(numer / denom) with ties to even, like Decimal's round().
+    """
+    quotient, remainder = np.divmod(numer, denom)
+    twice = 2 * remainder
+    return quotient + ((twice > denom) | ((twice == denom) & (quotient % 2 == 1)))
+
+def validate_menus_batch(menus, constraints=None):
+    """
+    Validate a whole batch of menus at once, with the same rules and the same
+    results as calling validate_menu() on each one.
+
+    Quantities are scaled to integer hundredths of a gram and laid out as a
+    menus × ingredients matrix (only the ingredients the batch uses); weight,
+    energy and cost then come from integer NumPy products against the dense
+    catalog vectors, so totals are exact and rounded half-even to the cent.
+    Menus with quantities finer than 0.01 g fall back to validate_menu().
+
+    Args:
+        menus (list[list[dict]]): One item list per menu, each item in the form
+            {"name": "Rice", "quantity_g": 180}.
+        constraints (dict|None): Any of min_kj, max_cost, min_g, max_g;
+            missing keys use validate_menu()'s defaults.
+
+    Returns:
+        list[tuple]: One (is_valid, result) per menu, as returned by validate_menu().
+            A menu with a non-numeric quantity fails with a reason instead of raising.
+    """
+    limits = {**MENU_LIMITS, **(constraints or {})}
+    vectors = ingredient_catalog.vectors()
+    results = [None] * len(menus)
+
+    # 1) Sparse entries (menu row, compact column, quantity) + first unknown name per menu
+    rows, cols, qtys = [], [], []
+    columns = {}        # lowercased name -> compact column
+    catalog_cols = []   # compact column -> catalog column, -1 for unknown names
+    missing = {}
+    for row, items in enumerate(menus):
+        start = len(rows)
+        for it in items:
+            try:
+                qty = hundredths(it["quantity_g"])
+            except (KeyError, TypeError, ValueError, InvalidOperation):
+                results[row] = (False, f"invalid quantity_g: {it.get('quantity_g')!r}")
+                break
+            if qty is None:
+                results[row] = _validate_menu(items, **limits)
+                break
+            name = it.get("name", "")
+            key = str(name).lower()
+            col = columns.get(key)
+            if col is None:
+                catalog_col = vectors.index.get(key, -1)
+                col = columns[key] = len(catalog_cols)
+                catalog_cols.append(catalog_col)
+            if catalog_cols[col] < 0 and row not in missing:
+                missing[row] = name
+            rows.append(row)
+            cols.append(col)
+            qtys.append(qty)
+        if results[row] is not None:
+            del rows[start:], cols[start:], qtys[start:]
+
+    # 2) Dense menus × used-ingredients matrix and exact integer totals
+    matrix = np.zeros((len(menus), len(catalog_cols)), dtype=np.int64)
+    np.add.at(
+        matrix,
+        (np.array(rows, dtype=np.intp), np.array(cols, dtype=np.intp)),
+        np.array(qtys, dtype=np.int64),
+    )
+    used = np.array(catalog_cols, dtype=np.intp)
+    known = used >= 0
+    price = np.zeros(len(used), dtype=np.int64)
+    energy = np.zeros(len(used), dtype=np.int64)
+    price[known] = vectors.price_cents[used[known]]
+    energy[known] = vectors.energy_centi[used[known]]
+    weight = matrix.sum(axis=1).tolist()
+    # q(1/100 g) × v(1/100 per 100 g) = 10^6 × value; round to 1/100 → divide by 10^4
+    energy_cents = round_half_even(matrix @ energy, 10_000).tolist()
+    cost_cents = round_half_even(matrix @ price, 10_000).tolist()
+
+    # 3) Same check order and messages as validate_menu()
+    min_g = limit_hundredths(limits["min_g"], ROUND_CEILING)
+    max_g = limit_hundredths(limits["max_g"], ROUND_FLOOR)
+    min_kj = limit_hundredths(limits["min_kj"], ROUND_CEILING)
+    max_cost = limit_hundredths(limits["max_cost"], ROUND_FLOOR)
+    for row, items in enumerate(menus):
+        if results[row] is not None:
+            continue
+        if not (min_g <= weight[row] <= max_g):
+            total_g = sum(Decimal(str(i["quantity_g"])) for i in items)
+            results[row] = (False, f"total_g={total_g} not in [{limits['min_g']},{limits['max_g']}]")
+        elif row in missing:
+            results[row] = (False, f"Ingredient not found: {missing[row]}")
+        else:
+            total_kj = Decimal(energy_cents[row]).scaleb(-2)
+            total_cost = Decimal(cost_cents[row]).scaleb(-2)
+            if energy_cents[row] < min_kj:
+                results[row] = (False, f"energy_kj={total_kj} < {limits['min_kj']}")
+            elif cost_cents[row] > max_cost:
+                results[row] = (False, f"cost={total_cost} > {limits['max_cost']}")
+            else:
+                results[row] = (True, {"total_kj": total_kj, "total_cost": total_cost})
+    metrics.observe_validations(results)
+    return results
+
+def sum_item_totals(items):
+    """
+    Sum nutrition, cost and weight over recipe items.
+
+    Args:
+        items (Iterable[RecipeIngredient]): Items with their ingredient loaded.
+
+    Returns:
+        dict: {"energy_kj", "protein", "fat", "carbs", "fiber", "cost", "weight_g"},
+            each a Decimal rounded to 2 decimals.
+    """
+    totals = {field: Decimal("0.00") for field in MealTotals.TOTAL_FIELDS}
+    for item in items:
+        ing = item.ingredient
+        factor = item.quantity_g / Decimal("100")
+        for field in NUTRITION_FIELDS:
+            totals[field] += (getattr(ing, field) or Decimal("0.00")) * factor
+        totals["cost"] += ing.price_per_100g * factor
+        totals["weight_g"] += item.quantity_g
+    return {key: round(value, 2) for key, value in totals.items()}
+
+def meal_snapshot(items, dietary_masks=None):
+    """
+    Field values of a meal's MealTotals row: sum_item_totals() plus the
+    allergen bitmask of its items, the dietary bits shared by all of them
+    and their duplicate fingerprint (dedupe.fingerprint()).
+
+    Args:
+        items (Iterable[RecipeIngredient]): Items with their ingredient loaded.
+        dietary_masks (dict|None): {ingredient id: dietary mask}; defaults to
+            the ingredient catalog's (see IngredientCatalog.dietary_index()).
+    """
+    items = list(items)
+    if dietary_masks is None:
+        dietary_masks = ingredient_catalog.dietary_index().masks
+    compatible = 0
+    if items:
+        compatible = ~0
+        for item in items:
+            compatible &= dietary_masks.get(item.ingredient.id, 0)
+    return {
+        **sum_item_totals(items),
+        "allergen_mask": allergen_mask(item.ingredient.allergen for item in items),
+        "dietary_mask": compatible,
+        "fingerprint": fingerprint((item.ingredient.id, item.quantity_g) for item in items),
+    }
+
+def ingredient_dietary_masks(ingredient_ids) -> dict:
+    """
+    {ingredient id: dietary mask} read from the database, for writers that
+    cannot rely on the catalog snapshot being current.
+    """
+    masks = {}
+    rows = Ingredient.dietaries.through.objects.filter(ingredient_id__in=set(ingredient_ids))
+    for ingredient_id, dietary_id in rows.values_list("ingredient_id", "dietary_id"):
+        masks[ingredient_id] = masks.get(ingredient_id, 0) | dietary_bit(dietary_id)
+    return masks
+
+def meal_totals(meal):
+    """
+    Return nutrition, cost and weight totals for a saved meal.
+
+    Meals loaded through ``Meal.objects.with_totals()`` are answered from the
+    MealTotals snapshot; otherwise ``meal.items.all()`` is walked once, which
+    hits the prefetch cache for meals loaded through ``with_items()``.
+
+    Args:
+        meal (Meal): The meal instance.
+
+    Returns:
+        dict: Same shape as sum_item_totals().
+    """
+    if getattr(meal, "total_cost", None) is not None:
+        return {field: getattr(meal, f"total_{field}") for field in MealTotals.TOTAL_FIELDS}
+    return sum_item_totals(meal.items.all())
+
+def cached_meal_totals(meal):
+    """
+    meal_totals(), computed once per instance and memoized on it, so the
+    total columns of one row share a single pass over the items.
+
+    Args:
+        meal (Meal): The meal instance.
+
+    Returns:
+        dict: Output of meal_totals().
+    """
+    if not hasattr(meal, "_totals_cache"):
+        meal._totals_cache = meal_totals(meal)
+    return meal._totals_cache
+
+def refresh_meal_totals(meal_ids):
+    """
+    Recompute the MealTotals snapshot for the given meals, and their
+    MealBand rows when the fingerprint changed.
+
+    Meals that no longer exist are skipped, so this is safe to call
+    after deletes.
+
+    Args:
+        meal_ids (Iterable[int]): Primary keys of the meals to refresh.
+
+    Returns:
+        int: Number of snapshot rows written.
+    """
+    meal_ids = set(Meal.objects.filter(pk__in=set(meal_ids)).values_list("pk", flat=True))
+    if not meal_ids:
+        return 0
+    items_by_meal = defaultdict(list)
+    for item in RecipeIngredient.objects.filter(recipe_id__in=meal_ids).select_related("ingredient"):
+        items_by_meal[item.recipe_id].append(item)
+    masks = ingredient_dietary_masks(
+        item.ingredient_id for items in items_by_meal.values() for item in items
+    )
+    rows = [
+        MealTotals(meal_id=meal_id, **meal_snapshot(items_by_meal[meal_id], masks))
+        for meal_id in meal_ids
+    ]
+    previous = dict(MealTotals.objects.filter(meal_id__in=meal_ids).values_list("meal_id", "fingerprint"))
+    write_bands({
+        row.meal_id: {item.ingredient_id for item in items_by_meal[row.meal_id]}
+        for row in rows
+        if row.fingerprint != previous.get(row.meal_id)
+    })
+    MealTotals.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["meal"],
+        update_fields=[*MealTotals.TOTAL_FIELDS, *MealTotals.INDEX_FIELDS, "updated_at"],
+    )
+    return len(rows)
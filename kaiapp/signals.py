@@ -0,0 +1,123 @@
+# kaiapp/signals.py
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .catalog import bump_content_version, catalog_changed, content_changed
+from .models import Dietary, Ingredient, Meal, MealTotals, RecipeIngredient, dietary_bit
+from .planning import invalidate_monthly_plans
+from .services import refresh_meal_totals
+
+
+def schedule_totals_refresh(meal_ids):
+    """
+    Refresh the MealTotals snapshot of the given meals once the current
+    transaction commits (immediately in autocommit mode).
+    Deferring keeps cascading deletes and admin inline saves consistent.
+    """
+    meal_ids = set(meal_ids)
+    if meal_ids:
+        transaction.on_commit(lambda: refresh_totals_and_bump(meal_ids))
+
+
+def refresh_totals_and_bump(meal_ids):
+    # Bump after the snapshot is written so no ETag outlives stale totals
+    refresh_meal_totals(meal_ids)
+    # Plans schedule on the snapshots' cost, protein, energy and allergens
+    invalidate_monthly_plans(
+        Meal.objects.filter(pk__in=meal_ids).values_list("dietary__name", flat=True).distinct()
+    )
+    bump_content_version()
+
+
+@receiver(post_save, sender=Meal)
+def meal_saved(sender, instance, created, raw=False, **kwargs):
+    # New meals get an (empty) snapshot row right away
+    if created and not raw:
+        schedule_totals_refresh([instance.pk])
+
+
+@receiver(post_save, sender=Meal)
+def meal_set_changed(sender, instance, created, **kwargs):
+    # An edit may rename the meal or move it to another dietary
+    invalidate_monthly_plans([meal_dietary_name(instance)] if created else None)
+
+
+@receiver(post_delete, sender=Meal)
+def meal_deleted(sender, instance, **kwargs):
+    invalidate_monthly_plans([meal_dietary_name(instance)])
+
+
+def meal_dietary_name(meal) -> str | None:
+    return meal.dietary.name if meal.dietary_id else None
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def recipe_item_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        schedule_totals_refresh([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, created, raw=False, **kwargs):
+    # A new ingredient is not used by any meal yet
+    if created or raw:
+        return
+    schedule_totals_refresh(
+        RecipeIngredient.objects.filter(ingredient_id=instance.pk)
+        .values_list("recipe_id", flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=Ingredient.dietaries.through)
+def ingredient_dietaries_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Retagging moves the dietary mask of every meal using the ingredients
+    if action not in ("post_add", "post_remove", "post_clear"):
+        return
+    if not reverse:
+        ingredient_ids = [instance.pk]
+    elif pk_set is not None:
+        ingredient_ids = pk_set
+    else:
+        # dietary.ingredients.clear(): only meals carrying its bit can change
+        dietary_removed(sender=Dietary, instance=instance)
+        return
+    schedule_totals_refresh(
+        RecipeIngredient.objects.filter(ingredient_id__in=ingredient_ids)
+        .values_list("recipe_id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Dietary)
+def dietary_removed(sender, instance, **kwargs):
+    # Deleting a Dietary drops its tags without m2m_changed
+    bit = dietary_bit(instance.pk)
+    if bit:
+        schedule_totals_refresh(
+            MealTotals.objects.alias(hits=F("dietary_mask").bitand(bit))
+            .filter(hits=bit).values_list("meal_id", flat=True)
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Dietary)
+@receiver(post_delete, sender=Dietary)
+@receiver(m2m_changed, sender=Ingredient.dietaries.through)
+def ingredient_catalog_changed(sender, **kwargs):
+    # Fixture loads (raw) bump too
+    catalog_changed()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Meal)
+@receiver(post_delete, sender=Meal)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=Dietary)
+@receiver(post_delete, sender=Dietary)
+@receiver(m2m_changed, sender=Ingredient.dietaries.through)
+def catalog_content_changed(sender, **kwargs):
+    content_changed()
@@ -0,0 +1,226 @@
+# kaiapp/similarity.py
+import threading
+from collections import namedtuple
+from datetime import timedelta
+import numpy as np
+from django.utils import timezone
+from .catalog import content_version
+from .models import MealTotals, RecipeIngredient
+
+# MealTotals columns of the nutrition/cost profile, z-scored over all meals
+PROFILE_FIELDS = ("energy_kj", "protein", "fat", "carbs", "fiber", "cost")
+
+# Share of the score given to ingredient overlap (Jaccard of the ingredient
+# sets); the rest goes to profile closeness 1 / (1 + euclidean distance)
+OVERLAP_WEIGHT = 0.5
+
+# Incremental refresh: snapshots written since the last read minus this
+# margin are re-read (covers transactions that commit late and clock skew
+# between hosts); past REFRESH_LIMIT changed meals the matrix is rebuilt.
+REFRESH_OVERLAP = timedelta(minutes=5)
+REFRESH_LIMIT = 2000
+
+# One result of MealMatrix.similar()
+Neighbour = namedtuple("Neighbour", ["meal_id", "similarity", "distance", "overlap"])
+
+
+class MealMatrix:
+    """
+    Process-local NumPy view of every meal with a MealTotals snapshot:
+    its normalized profile, dietary, allergen mask and ingredient sets
+    (CSR-style per meal, plus an inverted index per ingredient).
+
+    Built with two queries on first use. After the content version changes
+    (see catalog.content_version()), the next read refreshes only the meals
+    whose snapshot was written since (MealTotals.updated_at), that moved to
+    another dietary or that were deleted, so a lookup is a few vectorized
+    operations over the matrix, not a pass over the recipe lines.
+
+    Counters:
+        hits      - reads served from the current matrix
+        misses    - reads that had to build it from scratch
+        refreshes - reads that refreshed the changed meals only
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def data(self) -> dict:
+        version = content_version()
+        if version == self._version:
+            self.hits += 1
+            return self._data
+        with self._lock:
+            if version != self._version:
+                data = self._refresh(self._data) if self._data is not None else None
+                if data is None:
+                    self.misses += 1
+                    data = self._load()
+                else:
+                    self.refreshes += 1
+                self._data = data
+                self._version = version
+            else:
+                self.hits += 1
+            return self._data
+
+    def similar(self, meal_id: int, k: int = 10, allergen_mask: int = 0) -> list[Neighbour] | None:
+        """
+        The k meals of the same dietary closest to `meal_id`, best first
+        (ties by pk), leaving out meals with any allergen in `allergen_mask`.
+        Returns None if the meal has no snapshot.
+        """
+        d = self.data()
+        ids = d["ids"]
+        row = int(np.searchsorted(ids, meal_id))
+        if row >= len(ids) or ids[row] != meal_id:
+            return None
+
+        candidates = d["dietary"] == d["dietary"][row]
+        candidates[row] = False
+        if allergen_mask:
+            candidates &= (d["allergens"] & allergen_mask) == 0
+        pool = np.flatnonzero(candidates)
+        if not len(pool) or k < 1:
+            return []
+
+        # Ingredient overlap: count shared ingredients through the inverted index
+        ingredients = d["meal_ingredients"][d["meal_ptr"][row]:d["meal_ptr"][row + 1]]
+        slots = np.searchsorted(d["ingredient_keys"], ingredients)
+        shared = np.bincount(
+            np.concatenate([d["ingredient_rows"][d["ingredient_ptr"][s]:d["ingredient_ptr"][s + 1]] for s in slots])
+            if len(slots) else np.empty(0, dtype=np.int64),
+            minlength=len(ids),
+        )[pool]
+        union = d["sizes"][row] + d["sizes"][pool] - shared
+        overlap = np.divide(shared, union, out=np.zeros(len(pool)), where=union > 0)
+
+        distance = np.sqrt(((d["profile"][pool] - d["profile"][row]) ** 2).sum(axis=1))
+        score = (1 - OVERLAP_WEIGHT) / (1 + distance) + OVERLAP_WEIGHT * overlap
+
+        if k < len(pool):
+            top = np.argpartition(-score, k - 1)[:k]
+        else:
+            top = np.arange(len(pool))
+        top = top[np.lexsort((ids[pool[top]], -score[top]))]
+        return [
+            Neighbour(int(ids[pool[i]]), float(score[i]), float(distance[i]), float(overlap[i]))
+            for i in top
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "version": self._version,
+            "size": len(self._data["ids"]) if self._data else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+        }
+
+    @classmethod
+    def _load(cls) -> dict:
+        since = timezone.now()
+        meals = _meal_arrays(MealTotals.objects.all())
+        pairs = _pair_array(RecipeIngredient.objects.all())
+        return cls._index(meals, pairs, since)
+
+    @classmethod
+    def _refresh(cls, data: dict) -> dict | None:
+        """
+        `data` updated for the meals changed since it was read, or None when
+        so many changed that rebuilding is cheaper.
+        """
+        since = timezone.now()
+        old = data["meals"]
+        written = MealTotals.objects.filter(updated_at__gte=data["since"] - REFRESH_OVERLAP)
+        changed = set(written.values_list("meal_id", flat=True))
+        # New meals and meals that moved to another dietary
+        before = dict(zip(old["ids"].tolist(), old["dietary"].tolist()))
+        current = []
+        for meal_id, dietary_id in MealTotals.objects.values_list("meal_id", "meal__dietary_id"):
+            current.append(meal_id)
+            if before.get(meal_id) != (-1 if dietary_id is None else dietary_id):
+                changed.add(meal_id)
+        if len(changed) > REFRESH_LIMIT:
+            return None
+
+        # Keep the rows of unchanged meals that still exist, re-read the others
+        changed = sorted(changed)
+        stale = np.array(changed, dtype=np.int64)
+        keep = np.isin(old["ids"], current) & ~np.isin(old["ids"], stale)
+        fresh = _meal_arrays(MealTotals.objects.filter(meal_id__in=changed))
+        meals = {key: np.concatenate([old[key][keep], fresh[key]]) for key in old}
+        order = np.argsort(meals["ids"], kind="stable")
+        meals = {key: value[order] for key, value in meals.items()}
+
+        pairs = data["pairs"]
+        pairs = np.concatenate([
+            pairs[np.isin(pairs[:, 0], meals["ids"]) & ~np.isin(pairs[:, 0], stale)],
+            _pair_array(RecipeIngredient.objects.filter(recipe_id__in=changed)),
+        ])
+        return cls._index(meals, pairs, since)
+
+    @staticmethod
+    def _index(meals: dict, pairs: np.ndarray, since) -> dict:
+        """
+        Normalized profiles and ingredient indexes of the given meal rows and
+        (meal id, ingredient id) pairs.
+        """
+        ids = meals["ids"]
+        profile = meals["profile"]
+        std = profile.std(axis=0) if len(ids) else np.ones(len(PROFILE_FIELDS))
+        profile = (profile - profile.mean(axis=0)) / np.where(std > 0, std, 1)
+
+        pos = np.searchsorted(ids, pairs[:, 0])
+        known = pos < len(ids)
+        known[known] = ids[pos[known]] == pairs[known, 0]
+        item_rows, item_ingredients = pos[known], pairs[known, 1]
+
+        by_meal = np.argsort(item_rows, kind="stable")
+        sizes = np.bincount(item_rows, minlength=len(ids))
+        by_ingredient = np.lexsort((item_rows, item_ingredients))
+        keys, starts = np.unique(item_ingredients[by_ingredient], return_index=True)
+        return {
+            "since": since,
+            "meals": meals,
+            "pairs": pairs,
+            "ids": ids,
+            "dietary": meals["dietary"],
+            "allergens": meals["allergens"],
+            "profile": profile,
+            "sizes": sizes,
+            "meal_ptr": np.concatenate([[0], np.cumsum(sizes)]),
+            "meal_ingredients": item_ingredients[by_meal],
+            "ingredient_keys": keys,
+            "ingredient_ptr": np.append(starts, len(by_ingredient)),
+            "ingredient_rows": item_rows[by_ingredient],
+        }
+
+
+def _meal_arrays(totals) -> dict:
+    """
+    {"ids", "dietary", "allergens", "profile" (raw)} arrays of MealTotals rows, by meal id.
+    """
+    rows = list(
+        totals.order_by("meal_id").values_list("meal_id", "meal__dietary_id", "allergen_mask", *PROFILE_FIELDS)
+    )
+    return {
+        "ids": np.array([r[0] for r in rows], dtype=np.int64),
+        "dietary": np.array([-1 if r[1] is None else r[1] for r in rows], dtype=np.int64),
+        "allergens": np.array([r[2] for r in rows], dtype=np.int64),
+        "profile": np.array([r[3:] for r in rows], dtype=np.float64).reshape(len(rows), len(PROFILE_FIELDS)),
+    }
+
+
+def _pair_array(items) -> np.ndarray:
+    """
+    (meal id, ingredient id) rows of RecipeIngredients.
+    """
+    return np.array(list(items.values_list("recipe_id", "ingredient_id")), dtype=np.int64).reshape(-1, 2)
+
+
+meal_matrix = MealMatrix()
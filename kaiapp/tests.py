@@ -1,3 +1,1371 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DataError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics
+from .catalog import (
+    CATALOG_VERSION_KEY, CONTENT_VERSION_KEY, catalog_version, content_version, ingredient_catalog, parse_dietaries,
+)
+from .catalog_loader import CatalogLoader
+from .dedupe import BANDS, fingerprint
+from .json_stream import JSONArrayStream
+from .llm import ClientProvider, RecordReplayProvider, get_provider, registry, use_client
+from .prompts import build_menu_prompt
+from .llm_cache import LLMCacheMiss, LLMResponseCache, completion_key
+from .llm_stub import StubOpenAIClient
+from .models import (
+    Dietary, GenerationJob, Ingredient, Meal, MealBand, MealTotals, MonthlyPlan, RecipeIngredient, allergen_codes,
+    allergen_mask, dietary_bit,
+)
+from .planning import prepare_monthly_plans, rebuild_plan
+from .scheduler import Candidates, load_candidates, schedule, weekdays
+from .similarity import MealMatrix, meal_matrix
+from .services import compute_totals, sum_item_totals, validate_menu, validate_menus_batch
+from .generation import (
+    GENERATION_LIMITS, dedupe_menus, drop_duplicates, get_ingredients_for_dietary, save_menus, screen_menus,
+    run_generation, split_batch, stream_generation, to_prompt_block,
+)
+from .menu_engine import build_local_menus
+from .serializers import MealSerializer
+from .jobs import finish_job, run_job, run_pending_jobs
+
+# Version tokens live in the default cache; keep them out of the shared
+# file cache a dev server on this machine uses.
+TEST_CACHES = override_settings(CACHES={
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "kaiapp-tests"},
+})
+
+
+def setUpModule():
+    TEST_CACHES.enable()
+
+
+def tearDownModule():
+    TEST_CACHES.disable()
+
+
+def make_catalog():
+    """
+    Create a small ingredient catalog shared by the tests.
+    Returns a dict {name: Ingredient}.
+    """
+    vegan, _ = Dietary.objects.get_or_create(name="Vegan")
+    rows = [
+        # name, price, kJ, protein, fat, carbs, fiber, allergen
+        ("Rice", "0.35", "544.00", "2.70", "0.30", "28.00", "0.40", ""),
+        ("Tofu", "0.90", "600.00", "12.00", "7.00", "2.00", "1.00", "soy"),
+        ("Broccoli", "0.60", "140.00", "2.80", "0.40", "7.00", "2.60", ""),
+        ("Carrot", "0.30", "170.00", "0.90", "0.20", "10.00", "2.80", ""),
+        ("Peanut Sauce", "1.10", "2400.00", "20.00", "45.00", "20.00", "5.00", "peanut"),
+        ("Olive Oil", "1.50", "3700.00", "0.00", "100.00", "0.00", "0.00", ""),
+    ]
+    catalog = {}
+    for name, price, kj, protein, fat, carbs, fiber, allergen in rows:
+        ing = Ingredient.objects.create(
+            name=name, price_per_100g=Decimal(price), energy_kj=Decimal(kj),
+            protein=Decimal(protein), fat=Decimal(fat), carbs=Decimal(carbs),
+            fiber=Decimal(fiber), allergen=allergen,
+        )
+        ing.dietaries.add(vegan)
+        catalog[name] = ing
+    return catalog
+
+
+def make_meal(catalog, name, items, dietary="Vegan"):
+    """
+    Create a meal from a list of (ingredient name, grams) pairs.
+    """
+    dietary_obj, _ = Dietary.objects.get_or_create(name=dietary)
+    meal = Meal.objects.create(name=name, dietary=dietary_obj)
+    for ing_name, grams in items:
+        RecipeIngredient.objects.create(
+            recipe=meal, ingredient=catalog[ing_name], quantity_g=Decimal(str(grams))
+        )
+    return meal
+
+
+MEAL_ITEMS = [("Rice", 180), ("Tofu", 150), ("Broccoli", 60), ("Peanut Sauce", 20), ("Carrot", 40)]
+
+
+class MealListQueryTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+
+    def _list_queries(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get("/api/meals/")
+        self.assertEqual(response.status_code, 200)
+        return response.json(), len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_meals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_meal(self.catalog, "Miso Tofu Bowl", MEAL_ITEMS)
+        _, one_meal = self._list_queries()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(9):
+                make_meal(self.catalog, f"Satay Stack {n}", MEAL_ITEMS)
+        data, ten_meals = self._list_queries()
+
+        self.assertEqual(len(data), 10)
+        self.assertEqual(one_meal, ten_meals)
+
+    def test_list_totals_names_and_allergens(self):
+        meal = make_meal(self.catalog, "Miso Tofu Bowl", MEAL_ITEMS)
+        data, _ = self._list_queries()
+        row = data[0]
+        self.assertEqual(row["id"], meal.id)
+        self.assertEqual(row["dietary"], "Vegan")
+        self.assertEqual(row["ingredient_names"], [name for name, _ in MEAL_ITEMS])
+        self.assertEqual(row["allergens"], ["soy", "peanut"])
+        # 979.2 + 900 + 84 + 480 + 68
+        self.assertEqual(row["total_energy_kj"], 2511.2)
+        # 0.63 + 1.35 + 0.36 + 0.22 + 0.12
+        self.assertEqual(row["total_cost"], 2.68)
+
+
+class MealPaginationAndFieldsTests(TestCase):
+    def setUp(self):
+        catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.meals = [
+                make_meal(catalog, f"Satay Stack {n}", [("Rice", 100 + 10 * (n % 3)), ("Tofu", 100)])
+                for n in range(7)
+            ]
+
+    def _pages(self, url):
+        rows = []
+        while url:
+            data = self.client.get(url).json()
+            rows.extend(data["results"])
+            url = data["next"]
+        return rows
+
+    def test_cursor_pages_cover_every_meal_once_in_stable_order(self):
+        rows = self._pages("/api/meals/?page_size=3")
+        self.assertEqual([r["id"] for r in rows], [m.id for m in self.meals])
+
+        # Ties on total_cost are broken by id
+        rows = self._pages("/api/meals/?page_size=2&ordering=total_cost&fields=id,total_cost")
+        self.assertEqual(len({r["id"] for r in rows}), len(self.meals))
+        self.assertEqual(
+            [(r["total_cost"], r["id"]) for r in rows], sorted((r["total_cost"], r["id"]) for r in rows)
+        )
+
+    def test_sparse_fields_skip_unrequested_work(self):
+        with CaptureQueriesContext(connection) as ctx, \
+                mock.patch("kaiapp.serializers.meal_totals") as totals:
+            response = self.client.get("/api/meals/?fields=id,name,dietary")
+        self.assertEqual(set(response.json()[0]), {"id", "name", "dietary"})
+        totals.assert_not_called()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn("mealtotals", ctx.captured_queries[0]["sql"].lower())
+
+        detail = self.client.get(f"/api/meals/{self.meals[0].id}/?fields=name,allergens").json()
+        self.assertEqual(detail, {"name": "Satay Stack 0", "allergens": ["soy"]})
+        self.assertEqual(self.client.get("/api/meals/?fields=id,calories").status_code, 400)
+
+
+class FastMealListTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            make_meal(self.catalog, "Miso Tofu Bowl", MEAL_ITEMS)
+            make_meal(self.catalog, "Kūmara \u2028 Stack", [("Carrot", 120), ("Peanut Sauce", 30)])
+            Meal.objects.create(name="Empty Plate")  # no dietary, no items
+        make_meal(self.catalog, "Snapshot Pending", MEAL_ITEMS)  # totals row not written yet
+
+    def _serializer_bytes(self, fields=None):
+        meals = Meal.objects.with_items().with_totals().order_by("id")
+        return JSONRenderer().render(MealSerializer(meals, many=True, fields=fields).data)
+
+    def test_list_is_byte_compatible_with_meal_serializer(self):
+        self.assertEqual(self.client.get("/api/meals/?ordering=id").content, self._serializer_bytes())
+        self.assertEqual(
+            self.client.get("/api/meals/?ordering=id&fields=total_cost,allergens,name").content,
+            self._serializer_bytes(fields=["total_cost", "allergens", "name"]),
+        )
+
+    def test_benchmark_command_checks_parity(self):
+        out = StringIO()
+        call_command("bench_meal_serialization", "--repeat", "1", stdout=out)
+        self.assertIn("Identical output", out.getvalue())
+
+
+class MealTotalsSnapshotTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.meal = make_meal(self.catalog, "Miso Tofu Bowl", MEAL_ITEMS)
+
+    def test_snapshot_created_with_items(self):
+        totals = MealTotals.objects.get(meal=self.meal)
+        self.assertEqual(totals.energy_kj, Decimal("2511.20"))
+        self.assertEqual(totals.cost, Decimal("2.68"))
+        self.assertEqual(totals.weight_g, Decimal("450.00"))
+
+    def test_item_and_ingredient_changes_refresh_affected_meals(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = make_meal(self.catalog, "Carrot Box", [("Carrot", 100)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.meal.items.get(ingredient__name="Peanut Sauce").delete()
+        self.assertEqual(MealTotals.objects.get(meal=self.meal).cost, Decimal("2.46"))
+
+        tofu = self.catalog["Tofu"]
+        tofu.price_per_100g = Decimal("1.00")
+        with self.captureOnCommitCallbacks(execute=True):
+            tofu.save()
+        self.assertEqual(MealTotals.objects.get(meal=self.meal).cost, Decimal("2.61"))
+        self.assertEqual(MealTotals.objects.get(meal=other).cost, Decimal("0.30"))
+
+    def test_ordering_by_snapshot_cost(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            make_meal(self.catalog, "Carrot Box", [("Carrot", 100)])
+        data = self.client.get("/api/meals/?dietary=vegan&ordering=total_cost").json()
+        self.assertEqual([row["name"] for row in data], ["Carrot Box", "Miso Tofu Bowl"])
+
+    def test_rebuild_command(self):
+        MealTotals.objects.all().delete()
+        call_command("rebuild_meal_totals", stdout=StringIO())
+        self.assertEqual(MealTotals.objects.get(meal=self.meal).cost, Decimal("2.68"))
+
+
+class AllergenFilterTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.peanut = make_meal(self.catalog, "Satay Bowl", MEAL_ITEMS)
+            self.soy = make_meal(self.catalog, "Tofu Rice", [("Rice", 200), ("Tofu", 100)])
+            self.plain = make_meal(self.catalog, "Carrot Rice", [("Rice", 200), ("Carrot", 100)])
+
+    def _names(self, query=""):
+        response = self.client.get(f"/api/meals/?fields=name{query}")
+        self.assertEqual(response.status_code, 200)
+        return {row["name"] for row in response.json()}
+
+    def test_mask_follows_items_and_ingredients(self):
+        self.assertEqual(self.peanut.totals.allergen_mask, allergen_mask(["peanut", "soy"]))
+        self.assertEqual(allergen_codes(self.peanut.totals.allergen_mask), ["peanut", "soy"])
+        carrot = self.catalog["Carrot"]
+        carrot.allergen = "sesame"
+        with self.captureOnCommitCallbacks(execute=True):
+            carrot.save()
+            self.peanut.items.get(ingredient__name="Peanut Sauce").delete()
+        self.assertEqual(MealTotals.objects.get(meal=self.peanut).allergen_mask, allergen_mask(["soy", "sesame"]))
+
+    def test_meal_list_excludes_allergens_in_one_query(self):
+        self.assertEqual(self._names("&exclude_allergens=peanut"), {"Tofu Rice", "Carrot Rice"})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._names("&exclude_allergens=Peanut, soy"), {"Carrot Rice"})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        response = self.client.get("/api/meals/?exclude_allergens=peanut,kryptonite")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("kryptonite", response.json()["exclude_allergens"])
+
+    def test_monthly_menu_candidates(self):
+        response = self.client.get("/api/monthly-menu/?dietary=vegan&exclude_allergens=soy")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["excludedAllergens"], ["soy"])
+        self.assertEqual({item["mealId"] for item in response.json()["menuItems"]}, {str(self.plain.pk)})
+        self.client.get("/api/monthly-menu/?dietary=vegan")
+        self.assertEqual(
+            sorted(MonthlyPlan.objects.values_list("allergen_mask", flat=True)), [0, allergen_mask(["soy"])]
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plain.items.create(ingredient=self.catalog["Tofu"], quantity_g=Decimal("50"))
+        response = self.client.get("/api/monthly-menu/?dietary=vegan&exclude_allergens=soy")
+        self.assertEqual(response.status_code, 400)  # no soy-free vegan meal left
+
+
+class DietaryMaskTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        self.halal = Dietary.objects.create(name="Halal")
+        self.gluten_free = Dietary.objects.create(name="Gluten-free")
+        for name in ("Rice", "Tofu", "Carrot"):
+            self.catalog[name].dietaries.add(self.halal)
+        for name in ("Rice", "Carrot"):
+            self.catalog[name].dietaries.add(self.gluten_free)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.satay = make_meal(self.catalog, "Satay Bowl", MEAL_ITEMS)
+            self.tofu = make_meal(self.catalog, "Tofu Rice", [("Rice", 200), ("Tofu", 100)])
+            self.plain = make_meal(self.catalog, "Carrot Rice", [("Rice", 200), ("Carrot", 100)])
+
+    def _mask(self, meal):
+        return MealTotals.objects.get(meal=meal).dietary_mask
+
+    def _names(self, query=""):
+        response = self.client.get(f"/api/meals/?fields=name{query}")
+        self.assertEqual(response.status_code, 200)
+        return {row["name"] for row in response.json()}
+
+    def test_mask_is_intersection_of_ingredient_tags(self):
+        vegan, halal, gluten_free = (dietary_bit(d.pk) for d in (
+            Dietary.objects.get(name="Vegan"), self.halal, self.gluten_free,
+        ))
+        self.assertEqual(self._mask(self.satay), vegan)
+        self.assertEqual(self._mask(self.tofu), vegan | halal)
+        self.assertEqual(self._mask(self.plain), vegan | halal | gluten_free)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.catalog["Broccoli"].dietaries.add(self.halal)
+            self.catalog["Peanut Sauce"].dietaries.add(self.halal)  # forward
+            self.halal.ingredients.remove(self.catalog["Tofu"])     # reverse
+        self.assertEqual(self._mask(self.satay), vegan)  # Tofu is no longer Halal
+        self.assertEqual(self._mask(self.tofu), vegan)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gluten_free.ingredients.clear()
+        self.assertEqual(self._mask(self.plain), vegan | halal)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.halal.delete()
+        self.assertEqual(self._mask(self.plain), vegan)
+
+    def test_meal_list_filters_compatible_in_one_query(self):
+        self.assertEqual(self._names("&compatible=halal"), {"Tofu Rice", "Carrot Rice"})
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._names("&compatible=Halal, Gluten-free,Standard"), {"Carrot Rice"})
+        self.assertEqual(len(ctx.captured_queries), 1)
+        response = self.client.get("/api/meals/?compatible=Halal,Paleo")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Paleo", response.json()["compatible"])
+        self.assertEqual(parse_dietaries(""), 0)
+
+    def test_dietary_ingredients_are_cached_per_version(self):
+        self.assertEqual([r.name for r in get_ingredients_for_dietary("Halal")], ["Carrot", "Rice", "Tofu"])
+        with CaptureQueriesContext(connection) as ctx:
+            records = get_ingredients_for_dietary("gluten-free")
+            self.assertEqual(len(get_ingredients_for_dietary("Standard")), 6)
+        self.assertEqual([r.name for r in records], ["Carrot", "Rice"])
+        self.assertEqual(len(ctx.captured_queries), 0)
+
+        self.catalog["Olive Oil"].dietaries.add(self.gluten_free)
+        self.assertEqual([r.name for r in get_ingredients_for_dietary("Gluten-free")], ["Carrot", "Olive Oil", "Rice"])
+        self.assertEqual(get_ingredients_for_dietary("Paleo"), [])
+
+
+class MealAdminTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            for n in range(1, 6):
+                make_meal(self.catalog, f"Bowl {n}", [("Rice", 50 * n), ("Tofu", 100)])
+        user = User.objects.create_superuser("admin", "admin@example.com", "pw")
+        self.client.force_login(user)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        url = "/admin/kaiapp/meal/"
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url, {"q": "Bowl 1"})
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(many.captured_queries), len(few.captured_queries))
+
+    def test_missing_snapshots_are_written_before_listing(self):
+        MealTotals.objects.all().delete()
+        response = self.client.get("/admin/kaiapp/meal/", {"o": "-8"})
+        self.assertEqual(MealTotals.objects.count(), 5)
+        self.assertEqual(response.context["cl"].result_list[0].total_cost, Decimal("1.78"))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get("/admin/kaiapp/meal/")
+        self.assertFalse([q for q in ctx.captured_queries if "recipeingredient" in q["sql"].lower()])
+
+    def test_totals_columns_sort_in_sql(self):
+        # list_display index 8 is total_cost (0 is the action checkbox)
+        response = self.client.get("/admin/kaiapp/meal/", {"o": "-8"})
+        names = [meal.name for meal in response.context["cl"].result_list]
+        self.assertEqual(names, [f"Bowl {n}" for n in range(5, 0, -1)])
+        self.assertEqual(response.context["cl"].result_list[0].total_cost, Decimal("1.78"))
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_seed_then_report(self):
+        call_command("seed_catalog", ingredients=40, meals=30, items_per_meal=5, chunk_size=8, stdout=StringIO())
+        self.assertEqual(Meal.objects.count(), 30)
+        self.assertEqual(RecipeIngredient.objects.count(), 150)
+        self.assertEqual(MealTotals.objects.count(), 30)
+        for meal in Meal.objects.select_related("dietary")[:10]:
+            if meal.dietary.name != "Standard":
+                self.assertFalse(meal.ingredients.exclude(dietaries=meal.dietary).exists())
+
+        with tempfile.NamedTemporaryFile(suffix=".json") as out:
+            call_command(
+                "run_benchmarks", iterations=2, warmup=0, output=out.name, stdout=StringIO(), stderr=StringIO()
+            )
+            report = json.load(open(out.name))
+        self.assertEqual(set(report["scenarios"]), {
+            "meals_list", "meal_detail", "meal_similar", "monthly_menu", "validate_menu", "generate_menus",
+        })
+        self.assertEqual(report["catalog"]["meals"], 30)  # generation was rolled back
+        self.assertEqual(report["scenarios"]["meal_detail"]["queries_max"], 2)
+        self.assertEqual(report["scenarios"]["validate_menu"]["queries_max"], 0)
+
+
+class DuplicateMealTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.original = make_meal(self.catalog, "Satay Bowl", MEAL_ITEMS)
+
+    def _menu(self, name, items, dietary="Vegan"):
+        return {"meal_name": name, "dietary": dietary, "items": [{"name": n, "quantity_g": g} for n, g in items]}
+
+    def test_fingerprint_and_bands_follow_the_recipe(self):
+        pairs = [(self.catalog[name].pk, grams) for name, grams in MEAL_ITEMS]
+        self.assertEqual(self.original.totals.fingerprint, fingerprint(pairs))
+        self.assertEqual(fingerprint(pairs), fingerprint([(i, g * 2) for i, g in reversed(pairs)]))
+        self.assertNotEqual(fingerprint(pairs), fingerprint(pairs[:-1]))
+        self.assertEqual(MealBand.objects.filter(meal=self.original).count(), BANDS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.original.items.filter(ingredient__name="Carrot").delete()
+        self.assertEqual(MealTotals.objects.get(meal=self.original).fingerprint, fingerprint(pairs[:-1]))
+
+    def test_migration_backfill_matches_dedupe(self):
+        migration = importlib.import_module("kaiapp.migrations.0010_meal_fingerprint")
+        expected = (
+            MealTotals.objects.get(meal=self.original).fingerprint,
+            sorted(MealBand.objects.filter(meal=self.original).values_list("bucket", flat=True)),
+        )
+        MealTotals.objects.update(fingerprint="")
+        MealBand.objects.all().delete()
+        migration.backfill_fingerprints(django_apps, None)
+        self.assertEqual((
+            MealTotals.objects.get(meal=self.original).fingerprint,
+            sorted(MealBand.objects.filter(meal=self.original).values_list("bucket", flat=True)),
+        ), expected)
+
+    def test_drops_catalog_and_batch_duplicates_in_few_queries(self):
+        scaled = [(name, grams * 2) for name, grams in MEAL_ITEMS]
+        reshaped = [(name, 100) for name, _ in MEAL_ITEMS]
+        menus = [
+            self._menu("Double Satay", scaled),                           # duplicate
+            self._menu("Even Satay", reshaped),                           # near-duplicate
+            self._menu("Halal Satay", MEAL_ITEMS, dietary="Halal"),       # other dietary
+            self._menu("Oil Rice", [("Rice", 200), ("Olive Oil", 10)]),
+            self._menu("Oil Rice Again", [("Rice", 250), ("Olive Oil", 10)]),  # batch near-duplicate
+        ]
+        ingredient_catalog.records()
+        with CaptureQueriesContext(connection) as ctx:
+            kept, dropped = drop_duplicates(menus, "Vegan")
+        self.assertEqual([m["meal_name"] for m in kept], ["Halal Satay", "Oil Rice"])
+        self.assertEqual(dropped, 3)
+        self.assertLessEqual(len(ctx.captured_queries), 3)
+
+    def test_generation_does_not_save_duplicates(self):
+        self.original.delete()
+        responses = []
+        for _ in range(2):
+            # A fresh stub answers the same menu both times
+            with use_client(StubOpenAIClient(items_per_menu=6, quantity_g=60)):
+                responses.append(self.client.post(
+                    "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 1},
+                    content_type="application/json",
+                ))
+        first, again = responses
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.json()["validation"]["duplicate"], 1)
+        self.assertEqual(Meal.objects.count(), 1)
+
+    def test_merge_command(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = make_meal(self.catalog, "Satay Bowl (2)", [(n, g * 2) for n, g in MEAL_ITEMS])
+            near = make_meal(self.catalog, "Even Satay", [(n, 100) for n, _ in MEAL_ITEMS])
+            halal = make_meal(self.catalog, "Halal Satay", MEAL_ITEMS, dietary="Halal")
+        job = GenerationJob.objects.create(status=GenerationJob.SUCCEEDED)
+        job.meals.add(copy)
+
+        out = StringIO()
+        call_command("merge_duplicate_meals", "--dry-run", stdout=out)
+        self.assertIn(f"meal {copy.pk} -> {self.original.pk} (duplicate", out.getvalue())
+        self.assertEqual(Meal.objects.count(), 4)
+
+        call_command("merge_duplicate_meals", stdout=StringIO())
+        self.assertFalse(Meal.objects.filter(pk=copy.pk).exists())
+        self.assertEqual(list(job.meals.all()), [self.original])
+        call_command("merge_duplicate_meals", "--near", stdout=StringIO())
+        self.assertEqual(set(Meal.objects.all()), {self.original, halal})
+        self.assertFalse(MealBand.objects.filter(meal=near.pk).exists())
+
+
+class SimilarMealsTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.base = make_meal(self.catalog, "Satay Bowl", MEAL_ITEMS)
+            self.close = make_meal(self.catalog, "Satay Bowl Lite", [(n, g - 5) for n, g in MEAL_ITEMS])
+            self.plain = make_meal(self.catalog, "Veg Rice", [("Rice", 200), ("Broccoli", 80), ("Carrot", 80)])
+            self.oily = make_meal(self.catalog, "Oil Rice", [("Rice", 100), ("Olive Oil", 60)])
+            make_meal(self.catalog, "Halal Satay", MEAL_ITEMS, dietary="Halal")
+
+    def _similar(self, query=""):
+        return self.client.get(f"/api/meals/{self.base.pk}/similar/{query}")
+
+    def test_nearest_meals_of_the_same_dietary(self):
+        response = self._similar("?k=2")
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()
+        self.assertEqual([row["name"] for row in rows], ["Satay Bowl Lite", "Veg Rice"])
+        self.assertEqual(rows[0]["ingredient_overlap"], 1.0)
+        self.assertGreater(rows[0]["similarity"], rows[1]["similarity"])
+        self.assertEqual(rows[0]["total_cost"], float(self.close.totals.cost))
+
+        names = [row["name"] for row in self._similar("?exclude_allergens=soy&fields=name").json()]
+        self.assertEqual(names, ["Veg Rice", "Oil Rice"])
+
+    def test_served_from_the_cached_matrix(self):
+        self._similar()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self._similar("?k=3&fields=id,name")
+        self.assertEqual(len(response.json()), 3)
+        self.assertEqual(set(response.json()[0]), {"id", "name", "similarity", "ingredient_overlap"})
+        self.assertEqual(len(ctx.captured_queries), 1)  # the result rows only
+
+        with self.captureOnCommitCallbacks(execute=True):
+            twin = make_meal(self.catalog, "Satay Twin", MEAL_ITEMS)
+        self.assertEqual(self._similar("?k=1").json()[0]["id"], twin.pk)
+
+    @mock.patch("kaiapp.similarity.REFRESH_OVERLAP", timedelta(0))
+    def test_refreshes_only_the_changed_meals(self):
+        meal_matrix.data()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plain.items.filter(ingredient__name="Carrot").delete()
+            make_meal(self.catalog, "Satay Twin", MEAL_ITEMS)
+            self.oily.delete()
+            self.close.dietary = Dietary.objects.get(name="Halal")
+            self.close.save()
+        counts = (meal_matrix.refreshes, meal_matrix.misses)
+        with CaptureQueriesContext(connection) as ctx:
+            refreshed = meal_matrix.data()
+        self.assertEqual((meal_matrix.refreshes, meal_matrix.misses), (counts[0] + 1, counts[1]))
+        recipe_reads = [q["sql"] for q in ctx.captured_queries if 'FROM "kaiapp_recipeingredient"' in q["sql"]]
+        self.assertTrue(recipe_reads and all("WHERE" in sql for sql in recipe_reads))
+
+        rebuilt = MealMatrix._load()
+        for key in ("ids", "dietary", "allergens", "sizes", "meal_ptr", "meal_ingredients",
+                    "ingredient_keys", "ingredient_ptr", "ingredient_rows"):
+            np.testing.assert_array_equal(refreshed[key], rebuilt[key], key)
+        np.testing.assert_allclose(refreshed["profile"], rebuilt["profile"])
+
+    def test_bad_requests(self):
+        self.assertEqual(self._similar("?k=0").status_code, 400)
+        self.assertEqual(self._similar("?k=many").status_code, 400)
+        self.assertEqual(self.client.get("/api/meals/999/similar/").status_code, 404)
+
+
+class LoadCatalogTests(TestCase):
+    FIXTURE = settings.BASE_DIR / "kaiapp.json"  # UTF-16 with BOM
+
+    def _load(self, path, **options):
+        call_command("load_catalog", str(path), stdout=StringIO(), **options)
+
+    def test_utf16_fixture_is_loaded_then_upserted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._load(self.FIXTURE, chunk_size=37)
+        self.assertEqual(
+            [Dietary.objects.count(), Ingredient.objects.count(), Meal.objects.count(), RecipeIngredient.objects.count()],
+            [5, 30, 31, 138],
+        )
+        self.assertEqual(MealTotals.objects.count(), 31)
+        meal = Meal.objects.get(pk=1)
+        self.assertEqual(MealTotals.objects.get(meal=meal).cost, sum_item_totals(meal.items.all())["cost"])
+        self.assertEqual(Ingredient.objects.get(name="Rice").dietaries.count(), 5)
+
+        self._load(self.FIXTURE)  # same pks again: updates only
+        self.assertEqual(Meal.objects.count(), 31)
+        self.assertEqual(RecipeIngredient.objects.count(), 138)
+
+    def test_ndjson_and_csv_with_names(self):
+        Dietary.objects.create(name="Vegan")
+        with tempfile.TemporaryDirectory() as tmp:
+            ndjson = f"{tmp}/catalog.ndjson"
+            with open(ndjson, "w", encoding="utf-16") as f:
+                for record in [
+                    {"model": "ingredient", "fields": {"name": "Oats", "price_per_100g": "0.40", "energy_kj": "1500",
+                                                       "dietaries": ["Vegan"]}},
+                    {"model": "meal", "fields": {"name": "Porridge", "dietary": "Vegan"}},
+                    {"model": "recipeingredient", "fields": {"recipe": "Porridge", "ingredient": "Oats", "quantity_g": "200"}},
+                ]:
+                    f.write(json.dumps(record) + "\n")
+            self._load(ndjson)
+            csv_path = f"{tmp}/prices.csv"
+            with open(csv_path, "w", encoding="utf-8") as f:
+                f.write("name,price_per_100g\nOats,0.50\n")
+            self._load(csv_path, model="ingredient")
+
+        oats = Ingredient.objects.get(name="Oats")
+        self.assertEqual((oats.price_per_100g, oats.energy_kj), (Decimal("0.50"), Decimal("1500.00")))
+        self.assertEqual(list(oats.dietaries.values_list("name", flat=True)), ["Vegan"])
+        porridge = Meal.objects.get(name="Porridge")
+        self.assertEqual(porridge.totals.cost, Decimal("1.00"))  # refreshed after the price update
+
+        with self.assertRaisesMessage(CommandError, "no Meal named 'Gruel'"):
+            with tempfile.NamedTemporaryFile("w", suffix=".csv") as f:
+                f.write("model,recipe,ingredient,quantity_g\nrecipeingredient,Gruel,Oats,100\n")
+                f.flush()
+                self._load(f.name)
+
+    def test_data_errors_are_reported_like_integrity_errors(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as f, \
+                mock.patch.object(CatalogLoader, "_upsert", side_effect=DataError("value too long")):
+            f.write("name,price_per_100g\nOats,0.40\n")
+            f.flush()
+            with self.assertRaisesMessage(CommandError, "value too long"):
+                self._load(f.name, model="ingredient")
+        self.assertFalse(Ingredient.objects.exists())
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        make_meal(self.catalog, "Vegan Bowl", MEAL_ITEMS)
+
+    def test_requests_queries_and_validations_are_exported(self):
+        requests = metrics.http_requests.value(method="GET", view="meal-list", status="200")
+        queries = metrics.db_queries.count(view="meal-list")
+        failed = metrics.menu_validations.value(result="fail")
+        self.client.get("/api/meals/")
+        validate_menu([{"name": "Dragonfruit", "quantity_g": 250}])
+
+        self.assertEqual(metrics.http_requests.value(method="GET", view="meal-list", status="200"), requests + 1)
+        self.assertEqual(metrics.db_queries.count(view="meal-list"), queries + 1)
+        self.assertEqual(metrics.menu_validations.value(result="fail"), failed + 1)
+
+        with override_settings(INTERNAL_IPS=["127.0.0.1"]):
+            response = self.client.get("/metrics")
+        self.assertEqual(response["Content-Type"], metrics.CONTENT_TYPE)
+        text = response.content.decode()
+        self.assertIn("# TYPE kai_http_request_duration_seconds histogram", text)
+        self.assertIn('kai_http_request_duration_seconds_bucket{method="GET",view="meal-list",le="+Inf"}', text)
+        self.assertIn('kai_menu_validations_total{result="fail"}', text)
+
+    def test_metrics_fail_closed(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 404)
+        with override_settings(METRICS_TOKEN="s3cret", INTERNAL_IPS=["127.0.0.1"]):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get("/metrics", headers={"authorization": "Bearer s3cret"})
+            self.assertEqual(response.status_code, 200)
+
+    def test_llm_latency_and_tokens(self):
+        tokens = metrics.llm_tokens.value(model="gpt-4o-mini", type="completion")
+        calls = metrics.llm_duration.count(model="gpt-4o-mini")
+        with use_client(StubOpenAIClient(items_per_menu=6)):
+            self.client.post("/api/generate-menus/", {"dietary": "Vegan"}, content_type="application/json")
+            list(stream_generation(2, "Vegan", "llm", None))
+        self.assertEqual(metrics.llm_duration.count(model="gpt-4o-mini"), calls + 2)
+        self.assertGreater(metrics.llm_tokens.value(model="gpt-4o-mini", type="completion"), tokens)
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram("t_seconds", "Test.", ("view",), buckets=(1, 5))
+        for value in (0.5, 2, 7):
+            histogram.observe(value, view="x")
+        self.assertEqual(histogram.render()[2:], [
+            't_seconds_bucket{view="x",le="1"} 1',
+            't_seconds_bucket{view="x",le="5"} 2',
+            't_seconds_bucket{view="x",le="+Inf"} 3',
+            't_seconds_sum{view="x"} 9.5',
+            't_seconds_count{view="x"} 3',
+        ])
+
+    @override_settings(METRICS_TOKEN="s3cret")
+    def test_token(self):
+        self.assertEqual(self.client.get("/metrics").status_code, 401)
+        response = self.client.get("/metrics", headers={"authorization": "Bearer s3cret"})
+        self.assertEqual(response.status_code, 200)
+
+
+class IngredientCatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.catalog = make_catalog()
+        self.items = [{"name": name.upper(), "quantity_g": grams} for name, grams in MEAL_ITEMS]
+
+    def test_lookups_hit_cache_without_queries(self):
+        compute_totals(self.items)  # warm
+        hits, misses = ingredient_catalog.hits, ingredient_catalog.misses
+        with CaptureQueriesContext(connection) as ctx:
+            ok, data = validate_menu(self.items, min_kj=2000, max_cost=3.5, min_g=200, max_g=500)
+        self.assertTrue(ok)
+        self.assertEqual(data, {"total_kj": Decimal("2511.20"), "total_cost": Decimal("2.68")})
+        self.assertEqual(len(ctx.captured_queries), 0)
+        self.assertEqual(ingredient_catalog.hits, hits + 1)
+        self.assertEqual(ingredient_catalog.misses, misses)
+
+    def test_ingredient_save_and_delete_invalidate(self):
+        compute_totals(self.items)
+        misses = ingredient_catalog.misses
+        tofu = self.catalog["Tofu"]
+        tofu.price_per_100g = Decimal("1.00")
+        tofu.save()
+        self.assertEqual(compute_totals(self.items)[1], Decimal("2.83"))
+        self.assertEqual(ingredient_catalog.misses, misses + 1)
+
+        self.catalog["Olive Oil"].delete()
+        self.assertIsNone(ingredient_catalog.get("olive oil"))
+        ok, reason = validate_menu([{"name": "Olive Oil", "quantity_g": 250}])
+        self.assertFalse(ok)
+        self.assertEqual(reason, "Ingredient not found: Olive Oil")
+
+
+class BatchValidatorTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+
+    def test_matches_scalar_validator(self):
+        rng = random.Random(7)
+        names = [*self.catalog, "Dragon Fruit"]
+        quantities = [5, 12.5, 40, "60", 90.25, 120, 150.0, 180, 0.125, 220]
+        menus = [
+            [
+                {"name": rng.choice(names).lower(), "quantity_g": rng.choice(quantities)}
+                for _ in range(rng.randint(1, 6))
+            ]
+            for _ in range(300)
+        ]
+        menus.append([])
+        for limits in ({}, {"min_kj": 2000, "max_cost": 3.5, "min_g": 200, "max_g": 500},
+                       {"min_kj": 1500.005, "max_cost": "2.999", "min_g": 150.5, "max_g": 400}):
+            expected = [validate_menu(items, **limits) for items in menus]
+            self.assertEqual(validate_menus_batch(menus, limits), expected)
+        self.assertTrue(any(ok for ok, _ in expected))
+
+    def test_invalid_quantity_is_rejected(self):
+        results = validate_menus_batch([[{"name": "Rice", "quantity_g": "lots"}]])
+        self.assertEqual(results, [(False, "invalid quantity_g: 'lots'")])
+
+
+class GenerateMenusFanOutTests(TestCase):
+    def setUp(self):
+        make_catalog()
+
+    def _generate(self, stub, **body):
+        with use_client(stub):
+            started = time.perf_counter()
+            response = self.client.post(
+                "/api/generate-menus/", {"dietary": "Vegan", **body}, content_type="application/json"
+            )
+            return response, time.perf_counter() - started
+
+    def test_sub_requests_run_concurrently(self):
+        stub = StubOpenAIClient(latency=0.2, quantity_g=80)
+        response, elapsed = self._generate(stub, batch_size=8, concurrency=4)
+        self.assertEqual(stub.calls, 4)
+        self.assertLess(elapsed, 0.6)
+        self.assertIn(response.status_code, (200, 201))
+
+    def test_single_call_by_default(self):
+        stub = StubOpenAIClient(quantity_g=80)
+        self._generate(stub, batch_size=6)
+        self.assertEqual(stub.calls, 1)
+
+    def test_split_and_dedupe(self):
+        self.assertEqual(split_batch(10, 4), [4, 3, 3])
+        self.assertEqual(split_batch(5, 5), [5])
+        menus = [
+            {"meal_name": "Teriyaki Bowl", "items": [{"name": "Rice", "quantity_g": 180}]},
+            {"meal_name": "teriyaki bowl", "items": [{"name": "Tofu", "quantity_g": 150}]},
+            {"meal_name": "Miso Box", "items": [{"name": "RICE", "quantity_g": 180}]},
+            {"meal_name": "Miso Stack", "items": [{"name": "Rice", "quantity_g": 200}]},
+        ]
+        self.assertEqual(
+            [m["meal_name"] for m in dedupe_menus(menus)], ["Teriyaki Bowl", "Miso Stack"]
+        )
+
+
+@override_settings(GENERATION_JOB_WORKERS=0)
+class GenerationJobTests(TestCase):
+    def setUp(self):
+        make_catalog()
+
+    def test_async_post_returns_job_then_poll_reports_meals(self):
+        response = self.client.post(
+            "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 4, "async": True},
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()["id"]
+        self.assertEqual(response.json()["status"], GenerationJob.PENDING)
+
+        with use_client(StubOpenAIClient(items_per_menu=6, quantity_g=60)):
+            self.assertTrue(run_job(job_id))
+        self.assertFalse(run_job(job_id))  # already claimed
+
+        data = self.client.get(f"/api/generate-menus/{job_id}/").json()
+        self.assertEqual(data["status"], GenerationJob.SUCCEEDED)
+        self.assertEqual(data["stage"], "saving")
+        # identical stub menus are deduped, so total may be below batch_size
+        self.assertEqual(data["progress"]["done"], data["progress"]["total"])
+        self.assertEqual(len(data["saved"]), GenerationJob.objects.get(pk=job_id).meals.count())
+
+    def test_failed_job_reports_message(self):
+        job_id = self.client.post(
+            "/api/generate-menus/", {"dietary": "Halal", "async": True}, content_type="application/json"
+        ).json()["id"]
+        run_job(job_id)
+        data = self.client.get(f"/api/generate-menus/{job_id}/").json()
+        self.assertEqual(data["status"], GenerationJob.FAILED)
+        self.assertEqual(data["message"], "Not enough ingredients for dietary 'Halal'. Please add more.")
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get("/api/generate-menus/999/").status_code, 404)
+
+    def test_lost_jobs_are_picked_up(self):
+        post = lambda: self.client.post(
+            "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 2, "async": True},
+            content_type="application/json",
+        ).json()["id"]
+        pending_id, stale_id, live_id = post(), post(), post()
+        long_ago = timezone.now() - timedelta(seconds=settings.GENERATION_JOB_TIMEOUT + 60)
+        GenerationJob.objects.filter(pk=stale_id).update(status=GenerationJob.RUNNING, started_at=long_ago)
+        GenerationJob.objects.filter(pk=live_id).update(status=GenerationJob.RUNNING, started_at=timezone.now())
+        dead_claim = GenerationJob.objects.filter(pk=stale_id, started_at=long_ago)
+
+        with use_client(StubOpenAIClient(items_per_menu=6, quantity_g=60)):
+            self.assertEqual(run_pending_jobs(), [pending_id, stale_id])
+        statuses = dict(GenerationJob.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[pending_id], GenerationJob.SUCCEEDED)
+        self.assertEqual(statuses[stale_id], GenerationJob.SUCCEEDED)
+        self.assertEqual(statuses[live_id], GenerationJob.RUNNING)
+        # The dead worker's late update no longer matches the new claim
+        self.assertFalse(finish_job(dead_claim, GenerationJob.FAILED, "late"))
+        self.assertEqual(GenerationJob.objects.get(pk=stale_id).status, GenerationJob.SUCCEEDED)
+
+    def test_requeued_run_saves_no_meals(self):
+        job_id = self.client.post(
+            "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 2, "async": True},
+            content_type="application/json",
+        ).json()["id"]
+
+        def slow_generation(**options):
+            # Requeued and claimed by another worker during the LLM call
+            GenerationJob.objects.filter(pk=job_id).update(started_at=timezone.now())
+            return run_generation(**options)
+
+        with use_client(StubOpenAIClient(items_per_menu=6, quantity_g=60)), \
+                mock.patch("kaiapp.jobs.run_generation", slow_generation):
+            self.assertTrue(run_job(job_id))
+        self.assertFalse(Meal.objects.exists())
+        self.assertEqual(GenerationJob.objects.get(pk=job_id).status, GenerationJob.RUNNING)
+
+
+class QuantityRepairTests(TestCase):
+    def setUp(self):
+        make_catalog()
+
+    def _menu(self, name, items):
+        return {"meal_name": name, "items": [{"name": n, "quantity_g": g} for n, g in items]}
+
+    def test_repairs_carb_first_and_counts_outcomes(self):
+        valid = self._menu("Valid", MEAL_ITEMS)
+        low_energy = self._menu(
+            "Low Energy", [("Rice", 100), ("Tofu", 100), ("Broccoli", 60), ("Carrot", 40), ("Olive Oil", 5)]
+        )
+        unknown = self._menu("Unknown", [("Dragonfruit", 300)])
+        too_dear = self._menu("Too Dear", [("Peanut Sauce", 320)])  # nothing adjustable
+
+        accepted, stats = screen_menus([valid, low_energy, unknown, too_dear], GENERATION_LIMITS)
+        self.assertEqual(stats, {"unchanged": 1, "repaired": 1, "rejected": 2})
+        self.assertEqual(accepted[0], valid)
+        # smallest carb step that reaches 2000 kJ; everything else untouched
+        self.assertEqual(
+            [it["quantity_g"] for it in accepted[1]["items"]], [200, 100, 60, 40, 5]
+        )
+        self.assertTrue(validate_menu(accepted[1]["items"], **GENERATION_LIMITS)[0])
+
+    def test_repair_grid_stays_bounded_with_repeated_roles(self):
+        for name, price, kj, fat in [
+            ("Salmon", "1.00", "850.00", "13.00"), ("Beef Mince", "0.80", "1000.00", "15.00"),
+            ("Spinach", "0.80", "97.00", "0.40"), ("Cheddar", "1.60", "1670.00", "33.00"),
+        ]:
+            Ingredient.objects.create(
+                name=name, price_per_100g=Decimal(price), energy_kj=Decimal(kj), protein=Decimal("20.00"),
+                fat=Decimal(fat), carbs=Decimal("0.00"), fiber=Decimal("0.00"),
+            )
+        # Two proteins and two boosters: 610 g and 4.51, over weight and budget
+        menu = self._menu("Surf and Turf", [
+            ("Rice", 200), ("Salmon", 150), ("Beef Mince", 150), ("Spinach", 80), ("Olive Oil", 10), ("Cheddar", 20),
+        ])
+        accepted, stats = screen_menus([menu], GENERATION_LIMITS)
+        self.assertEqual(stats, {"unchanged": 0, "repaired": 1, "rejected": 0})
+        quantities = [it["quantity_g"] for it in accepted[0]["items"]]
+        # Only the largest carb, protein (first on ties) and booster move
+        self.assertEqual(quantities[2:5], [150, 80, 10])
+        self.assertTrue(validate_menu(accepted[0]["items"], **GENERATION_LIMITS)[0])
+
+        # A repair that blows up rejects that menu, not the batch
+        with mock.patch("kaiapp.generation.repair_quantities", side_effect=MemoryError):
+            accepted, stats = screen_menus([menu, self._menu("Valid", MEAL_ITEMS)], GENERATION_LIMITS)
+        self.assertEqual(stats, {"unchanged": 1, "repaired": 0, "rejected": 1})
+        self.assertEqual([m["meal_name"] for m in accepted], ["Valid"])
+
+    def test_response_reports_validation_counts(self):
+        stub = StubOpenAIClient(items_per_menu=6, quantity_g=30)  # 180 g: under the weight floor
+        with use_client(stub):
+            response = self.client.post(
+                "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 1},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["validation"], {"unchanged": 0, "repaired": 1, "rejected": 0, "duplicate": 0})
+        meal = Meal.objects.get(pk=response.json()["saved"][0]["id"])
+        self.assertEqual(meal.totals.weight_g, Decimal("200.00"))
+
+
+class LLMProviderTests(TestCase):
+    def setUp(self):
+        make_catalog()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_openai_sdk_is_not_imported_to_serve_requests(self):
+        env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+        code = (
+            "import sys, django; django.setup(); "
+            "from django.urls import resolve; resolve('/api/meals/'); "
+            "print('openai' in sys.modules)"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR,
+            env={**env, "DJANGO_SETTINGS_MODULE": "kai_backend.settings"},
+        ).stdout
+        self.assertEqual(out.strip().splitlines()[-1], "False")
+
+        with override_settings(OPENAI_API_KEY="sk-test"):
+            provider = get_provider("openai")
+            self.assertIs(provider.client(), provider.client())  # built once, pooled
+
+    @override_settings(LLM_PROVIDER="stub")
+    def test_stub_provider_returns_valid_menus(self):
+        response = self.client.post(
+            "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 2}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 201)
+        validation = response.json()["validation"]
+        # The six-ingredient catalog admits a single valid menu
+        self.assertEqual(validation, {"unchanged": 1, "repaired": 0, "rejected": 0, "duplicate": 0})
+
+    def test_record_then_replay(self):
+        prompt = build_menu_prompt(to_prompt_block(get_ingredients_for_dietary("Vegan")), batch_size=2)
+        params = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": prompt}]}
+        with override_settings(LLM_CACHE_PATH=f"{self.tmp.name}/llm.sqlite3", LLM_RECORD_PROVIDER="stub"):
+            recorded = get_provider("record").create(**params).choices[0].message.content
+            replayed = get_provider("replay").create(**params).choices[0].message.content
+            chunks = list(get_provider("replay").create(**params, stream=True, stream_options={"include_usage": True}))
+            with self.assertRaises(LLMCacheMiss):
+                get_provider("replay").create(**{**params, "model": "other"})
+        self.assertEqual(replayed, recorded)
+        self.assertEqual("".join(c.choices[0].delta.content for c in chunks if c.choices), recorded)
+        menus = json.loads(recorded)["menus"]
+        self.assertTrue(menus)
+        self.assertTrue(all(ok for ok, _ in validate_menus_batch([m["items"] for m in menus], GENERATION_LIMITS)))
+
+    @override_settings(LLM_PROVIDER="nope")
+    def test_unknown_provider(self):
+        with self.assertRaisesMessage(ValueError, "LLM_PROVIDER must be one of"):
+            get_provider()
+
+
+class LLMResponseCacheTests(TestCase):
+    def setUp(self):
+        make_catalog()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = f"{self.tmp.name}/llm.sqlite3"
+
+    def _generate(self, stub, mode):
+        provider = RecordReplayProvider(mode, backend=ClientProvider(stub))
+        with override_settings(LLM_CACHE_PATH=self.path), registry.override(provider):
+            return self.client.post(
+                "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 2},
+                content_type="application/json",
+            )
+
+    def test_record_then_replay_without_the_model(self):
+        recorder = StubOpenAIClient(items_per_menu=6, quantity_g=60)
+        first = self._generate(recorder, "record")
+        self._generate(recorder, "record")
+        self.assertEqual(recorder.calls, 1)  # identical prompt served from the cache
+
+        Meal.objects.all().delete()  # replayed menus would be dropped as duplicates
+        offline = mock.Mock(side_effect=AssertionError("network call in replay mode"))
+        with mock.patch.object(StubOpenAIClient, "create", offline):
+            replayed = self._generate(StubOpenAIClient(), "replay")
+        self.assertEqual(replayed.status_code, first.status_code)
+        self.assertEqual(
+            [m["name"] for m in replayed.json()["saved"]], [m["name"] for m in first.json()["saved"]]
+        )
+
+    def test_replay_miss_is_a_client_error(self):
+        response = self._generate(StubOpenAIClient(), "replay")
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("No cached completion", response.json()["error"])
+
+    def test_ttl_and_size_eviction(self):
+        self.assertNotEqual(completion_key({"model": "a"}), completion_key({"model": "b"}))
+        cache = LLMResponseCache(self.path, ttl=3600, max_bytes=10)
+        cache.set("old", "12345")
+        cache.set("new", "1234567")  # 12 bytes > 10: least recently used goes
+        self.assertIsNone(cache.get("old"))
+        self.assertEqual(cache.get("new"), ("1234567", {}))
+
+        expired = LLMResponseCache(self.path, ttl=-1)
+        self.assertIsNone(expired.get("new"))
+        self.assertEqual(expired.stats()["entries"], 0)
+
+
+class StreamingGenerationTests(TestCase):
+    def setUp(self):
+        make_catalog()
+
+    def test_parser_emits_each_menu_when_it_closes(self):
+        text = json.dumps({"note": "menus [x]", "menus": [
+            {"meal_name": "A \"quoted\" {bowl}", "items": [{"name": "Rice", "quantity_g": 180}]},
+            {"meal_name": "B", "items": []},
+        ]})
+        parser = JSONArrayStream("menus")
+        emitted = []
+        for i, ch in enumerate(text):
+            for menu in parser.feed(ch):
+                emitted.append((menu["meal_name"], i))
+        self.assertEqual([name for name, _ in emitted], ['A "quoted" {bowl}', "B"])
+        self.assertLess(emitted[0][1], text.index('"B"'))
+        self.assertTrue(parser.seen_array)
+
+    def test_streams_ndjson_meals_before_the_completion_ends(self):
+        stub = StubOpenAIClient(items_per_menu=6, quantity_g=60, chunk_chars=16, chunk_latency=0.01)
+        with use_client(stub):
+            started = time.perf_counter()
+            response = self.client.post(
+                "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 3, "stream": True},
+                content_type="application/json",
+            )
+            self.assertEqual(response["Content-Type"], "application/x-ndjson")
+            lines = iter(response.streaming_content)
+            first = json.loads(next(lines))
+            first_at = time.perf_counter() - started
+            rest = [json.loads(line) for line in lines]
+            total = time.perf_counter() - started
+
+        self.assertEqual(first["event"], "meal")
+        self.assertLess(first_at, total * 0.75)
+        done = rest[-1]
+        self.assertEqual(done["event"], "done")
+        meals = [first] + [e for e in rest if e["event"] == "meal"]
+        self.assertEqual(done["saved"], len(meals))
+        self.assertEqual(Meal.objects.count(), len(meals))
+
+    def test_sse_format_and_upfront_errors(self):
+        with use_client(StubOpenAIClient(items_per_menu=6)):
+            response = self.client.post(
+                "/api/generate-menus/", {"dietary": "Vegan", "batch_size": 1, "stream": "sse"},
+                content_type="application/json",
+            )
+            self.assertEqual(response["Content-Type"], "text/event-stream")
+            body = b"".join(response.streaming_content).decode()
+        self.assertTrue(body.startswith("event: meal\ndata: "))
+        self.assertIn("event: done\n", body)
+
+        response = self.client.post(
+            "/api/generate-menus/", {"dietary": "Halal", "stream": True}, content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_save_errors_are_not_reported_as_bad_json(self):
+        stub = StubOpenAIClient(items_per_menu=6, quantity_g=60)
+        with use_client(stub), mock.patch("kaiapp.generation.save_menus", side_effect=ValueError("boom")):
+            events = list(stream_generation(1, "Vegan", "llm", None))
+        self.assertEqual(events[0]["event"], "error")
+        self.assertEqual(events[0]["error"], "Could not save meal: boom")
+        self.assertIn("meal_name", events[0])
+        self.assertEqual(events[-1]["event"], "done")
+
+        with mock.patch("kaiapp.generation.stream_menu_text", return_value=iter(["Sorry, no menus."])):
+            events = list(stream_generation(1, "Vegan", "llm", None))
+        self.assertEqual(events[0], {"event": "error", "error": "Model did not return valid JSON."})
+
+
+class MonthlyPlanTests(TestCase):
+    def setUp(self):
+        self.catalog = make_catalog()
+        for n in range(3):
+            make_meal(self.catalog, f"Vegan Bowl {n}", MEAL_ITEMS)
+
+    def _get(self, **headers):
+        return self.client.get("/api/monthly-menu/?dietary=vegan", headers=headers)
+
+    def test_plan_is_stored_and_revalidated(self):
+        first = self._get()
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(first["ETag"] and first["Last-Modified"])
+        with CaptureQueriesContext(connection) as ctx:
+            again = self._get()
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(again.json(), first.json())
+
+        self.assertEqual(self._get(if_none_match=first["ETag"]).status_code, 304)
+        self.assertEqual(self._get(if_modified_since=first["Last-Modified"]).status_code, 304)
+
+    def test_rebuilt_only_when_the_dietary_meal_set_changes(self):
+        first = self._get()
+        make_meal(self.catalog, "Halal Plate", MEAL_ITEMS, dietary="Halal")
+        self.assertFalse(MonthlyPlan.objects.get().stale)
+        unchanged = self._get(if_none_match=first["ETag"])  # catalog version moved on
+        self.assertEqual(unchanged.status_code, 200)
+        self.assertEqual(unchanged.json(), first.json())
+        self.assertEqual(unchanged["Last-Modified"], first["Last-Modified"])
+
+        newcomer = make_meal(self.catalog, "Vegan Newcomer", MEAL_ITEMS)
+        self.assertTrue(MonthlyPlan.objects.get().stale)
+        second = self._get(if_none_match=first["ETag"])
+        self.assertEqual(second.status_code, 200)
+        self.assertIn(str(newcomer.pk), {item["mealId"] for item in second.json()["menuItems"]})
+
+    def test_rebuilding_totals_invalidates_plans_and_etags(self):
+        first = self._get()
+        call_command("rebuild_meal_totals", stdout=StringIO())
+        self.assertTrue(MonthlyPlan.objects.get().stale)
+        self.assertEqual(self._get(if_none_match=first["ETag"]).status_code, 200)
+
+    def test_totals_changes_invalidate_unfiltered_plans(self):
+        self._get()
+        self.assertFalse(MonthlyPlan.objects.get().stale)
+        rice = self.catalog["Rice"]
+        rice.price_per_100g = Decimal("0.50")
+        with self.captureOnCommitCallbacks(execute=True):
+            rice.save()
+        self.assertTrue(MonthlyPlan.objects.get().stale)  # costs in the plan moved
+
+        # A meal whose snapshot is not written yet is not scheduled at 0 cost
+        pending = make_meal(self.catalog, "Vegan Pending", MEAL_ITEMS)
+        MealTotals.objects.filter(meal=pending).delete()
+        candidates = load_candidates(["Vegan"])["Vegan"]
+        cost = dict(zip(candidates.ids, candidates.cost))[pending.pk]
+        self.assertEqual(cost, float(sum_item_totals(pending.items.select_related("ingredient"))["cost"]))
+        self.assertGreater(cost, 0)
+
+    def test_admin_regenerate_reshuffles(self):
+        first = self._get().json()
+        plan = MonthlyPlan.objects.get()
+        plan.revision += 1
+        rebuild_plan(plan)
+        second = self._get().json()
+        self.assertEqual([i["date"] for i in second["menuItems"]], [i["date"] for i in first["menuItems"]])
+        self.assertNotEqual(second["menuItems"], first["menuItems"])
+
+    def test_no_meals(self):
+        self.assertEqual(self.client.get("/api/monthly-menu/?dietary=halal").status_code, 400)
+        self.assertFalse(MonthlyPlan.objects.exists())
+
+
+class ContentETagTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.catalog = make_catalog()
+        self.meal = make_meal(self.catalog, "Vegan Bowl", MEAL_ITEMS)
+
+    def test_repeat_reads_get_304_without_queries(self):
+        for url in ("/api/meals/", f"/api/meals/{self.meal.pk}/", "/api/monthly-menu/?dietary=vegan"):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200, url)
+            with CaptureQueriesContext(connection) as ctx:
+                again = self.client.get(url, headers={"if-none-match": first["ETag"]})
+            self.assertEqual(again.status_code, 304, url)
+            self.assertEqual(again["ETag"], first["ETag"])
+            self.assertEqual(len(ctx.captured_queries), 0, url)
+
+    def test_etag_depends_on_query_params(self):
+        plain = self.client.get("/api/meals/")["ETag"]
+        self.assertNotEqual(self.client.get("/api/meals/?fields=id,name")["ETag"], plain)
+        self.assertEqual(self.client.get("/api/meals/")["ETag"], plain)
+
+    def test_shared_versions_move_only_on_commit(self):
+        keys = (CATALOG_VERSION_KEY, CONTENT_VERSION_KEY)
+        before = [content_version(), catalog_version()]
+        shared = cache.get_many(keys)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.filter(name="Rice").get().save()
+            # This thread sees its own write; the shared tokens hold still
+            self.assertNotEqual([content_version(), catalog_version()], before)
+            self.assertEqual(cache.get_many(keys), shared)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(cache.get(CONTENT_VERSION_KEY), shared[CONTENT_VERSION_KEY])
+        self.assertNotEqual(cache.get(CATALOG_VERSION_KEY), shared[CATALOG_VERSION_KEY])
+        self.assertEqual(content_version(), cache.get(CONTENT_VERSION_KEY))
+
+    def test_rolled_back_writes_leave_the_version_alone(self):
+        before = [content_version(), catalog_version()]
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Ingredient.objects.filter(name="Rice").get().save()
+            self.assertNotEqual([content_version(), catalog_version()], before)
+            raise RuntimeError
+        with transaction.atomic():
+            self.assertEqual([content_version(), catalog_version()], before)
+
+    def test_catalog_changes_move_the_etag(self):
+        changes = [
+            lambda: Meal.objects.filter(pk=self.meal.pk).get().save(),
+            lambda: Dietary.objects.create(name="Keto"),
+            lambda: self.catalog["Rice"].dietaries.add(Dietary.objects.get(name="Keto")),
+            lambda: RecipeIngredient.objects.filter(recipe=self.meal).first().delete(),
+        ]
+        etag = self.client.get("/api/meals/")["ETag"]
+        for change in changes:
+            change()
+            response = self.client.get("/api/meals/", headers={"if-none-match": etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response["ETag"], etag)
+            etag = response["ETag"]
+
+
+class MonthlySchedulerTests(TestCase):
+    CONSTRAINTS = {
+        "no_repeat_days": 10, "monthly_budget": 60.0, "min_avg_protein": 25.0,
+        "min_avg_energy_kj": 2400.0, "weekly_variety": True,
+    }
+
+    def _candidates(self, n, seed):
+        rng = random.Random(seed)
+        return Candidates(
+            ids=list(range(1, n + 1)),
+            names=[f"Meal {i}" for i in range(n)],
+            cost=np.array([rng.uniform(2.0, 3.6) for _ in range(n)]),
+            protein=np.array([rng.uniform(10, 45) for _ in range(n)]),
+            energy=np.array([rng.uniform(1800, 3200) for _ in range(n)]),
+            protein_source=np.array([rng.randrange(8) for _ in range(n)]),
+            cuisine=np.array([rng.randrange(12) for _ in range(n)]),
+        )
+
+    def test_meets_constraints_for_hundreds_of_candidates_quickly(self):
+        days = weekdays(2025, 9)
+        pools = [self._candidates(400, seed) for seed in range(5)]  # e.g. every dietary
+        started = time.perf_counter()
+        results = [schedule(pool, days, self.CONSTRAINTS, random.Random(i)) for i, pool in enumerate(pools)]
+        self.assertLess(time.perf_counter() - started, 0.1)
+
+        for pool, (picks, summary) in zip(pools, results):
+            self.assertEqual(len(picks), len(days))
+            self.assertTrue(all(summary["satisfied"].values()), summary)
+            for week in {d.isocalendar()[1] for d in days}:
+                in_week = [i for d, i in zip(days, picks) if d.isocalendar()[1] == week]
+                self.assertEqual(len({pool.protein_source[i] for i in in_week}), len(in_week))
+                self.assertEqual(len({pool.cuisine[i] for i in in_week}), len(in_week))
+
+    def test_relaxes_instead_of_failing_with_few_meals(self):
+        pool = self._candidates(2, 1)
+        picks, summary = schedule(pool, weekdays(2025, 9), self.CONSTRAINTS, random.Random(0))
+        self.assertEqual(len(picks), 22)
+        self.assertFalse(summary["satisfied"]["noRepeat"])
+
+    def test_plans_every_dietary_in_one_call(self):
+        catalog = make_catalog()
+        with self.captureOnCommitCallbacks(execute=True):  # write the snapshots
+            for n in range(4):
+                make_meal(catalog, f"Miso Bowl {n}", MEAL_ITEMS)
+            make_meal(catalog, "Satay Plate", MEAL_ITEMS, dietary="Halal")
+        ingredient_catalog.records()  # warm the catalog cache
+        with CaptureQueriesContext(connection) as ctx:
+            plans = prepare_monthly_plans(["Vegan", "Halal", "Standard"], 2025, 9)
+        self.assertIsNone(plans["Standard"])
+        self.assertEqual(plans["Halal"].payload["menuItems"][0]["menuName"], "Satay Plate")
+        self.assertEqual(len(plans["Vegan"].payload["menuItems"]), 22)
+        self.assertLessEqual(len(ctx.captured_queries), 4 + 2 * 3)  # lookups + one save per plan
+
+
+class SaveMenusTests(TestCase):
+    def setUp(self):
+        make_catalog()
+
+    def _menus(self, count):
+        return [
+            {
+                "meal_name": f"Satay Tofu Bowl {n}",
+                "description": "crispy tofu, satay drizzle",
+                "dietary": "vegan",
+                "items": [{"name": name.lower(), "quantity_g": grams + n} for name, grams in MEAL_ITEMS],
+            }
+            for n in range(count)
+        ]
+
+    def test_writes_do_not_grow_with_batch(self):
+        ingredient_catalog.dietary_index()  # warm the catalog cache
+        with CaptureQueriesContext(connection) as one:
+            save_menus(self._menus(1), "Vegan")
+        with CaptureQueriesContext(connection) as ten:
+            saved = save_menus(self._menus(10), "Vegan")
+        self.assertEqual(len(saved), 10)
+        self.assertEqual(len(one.captured_queries), len(ten.captured_queries))
+
+    def test_returned_totals_match_serializer(self):
+        saved = save_menus(self._menus(2), "Vegan")
+        meals = Meal.objects.with_items().filter(pk__in=[m["id"] for m in saved]).order_by("pk")
+        expected = MealSerializer(meals, many=True).data
+        for row, fresh in zip(saved, expected):
+            self.assertEqual(row, dict(fresh))
+            self.assertTrue(all(isinstance(row[key], Decimal) for key in row if key.startswith("total_")))
+        self.assertEqual(MealTotals.objects.filter(meal_id__in=[m["id"] for m in saved]).count(), 2)
+
+    def test_unknown_ingredient_is_skipped(self):
+        menus = self._menus(2)
+        menus[0]["items"][0]["name"] = "Dragon Fruit"
+        self.assertEqual([m["name"] for m in save_menus(menus, "Vegan")], ["Satay Tofu Bowl 1"])
+
+
+class LocalMenuEngineTests(TestCase):
+    def setUp(self):
+        call_command("loaddata", settings.BASE_DIR / "kaiapp_utf8.json", verbosity=0)
+
+    def test_menus_are_valid_distinct_and_follow_rules(self):
+        for dietary in ("Standard", "Vegan", "Vegetarian", "Halal", "Gluten-free"):
+            ingredients = list(get_ingredients_for_dietary(dietary))
+            allowed = {i.name for i in ingredients}
+            menus = build_local_menus(ingredients, 10, dietary)
+            self.assertEqual(len(menus), 10)
+            results = validate_menus_batch([m["items"] for m in menus], GENERATION_LIMITS)
+            self.assertTrue(all(ok for ok, _ in results), dietary)
+            item_sets = {frozenset(it["name"] for it in m["items"]) for m in menus}
+            self.assertEqual(len(item_sets), 10)
+            for m in menus:
+                self.assertTrue(5 <= len(m["items"]) <= 6)
+                self.assertTrue({it["name"] for it in m["items"]} <= allowed)
+            self.assertEqual(menus, build_local_menus(ingredients, 10, dietary))  # deterministic
+
+    def test_generate_view_local_engine(self):
+        llm = mock.Mock()
+        with use_client(llm):
+            response = self.client.post(
+                "/api/generate-menus/", {"engine": "local", "dietary": "Halal", "batch_size": 4},
+                content_type="application/json",
+            )
+        llm.chat.completions.create.assert_not_called()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()["saved"]), 4)
+
+    def test_unknown_engine(self):
+        response = self.client.post("/api/generate-menus/", {"engine": "magic"}, content_type="application/json")
+        self.assertEqual(response.status_code, 400)
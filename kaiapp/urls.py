@@ -1,7 +1,7 @@
 from rest_framework.routers import DefaultRouter
 from kaiapp.viewsets import MealViewSet
 from django.urls import path
-from .views import GenerateMenusView, MonthlyMenuView
+from .views import GenerateMenusView, GenerationJobView, MonthlyMenuView
 
 router = DefaultRouter()
 router.register(r'meals',MealViewSet)
@@ -9,5 +9,6 @@ router.register(r'meals',MealViewSet)
 urlpatterns= urlpatterns = [
     *router.urls,
     path('generate-menus/', GenerateMenusView.as_view(), name='generate-menus'),
+    path('generate-menus/<int:pk>/', GenerationJobView.as_view(), name='generation-job'),
     path("monthly-menu/", MonthlyMenuView.as_view(), name="monthly-menu"),
 ]
\ No newline at end of file
@@ -1,74 +1,24 @@
 # kaiapp/views_generate.py
+import hmac
 import json
-from decimal import Decimal
-from typing import Iterable
-import calendar
-import random
-from datetime import date
-from django.db.models import Q
-from django.utils import timezone
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import QuerySet
-from openai import OpenAI
-from .models import Ingredient, Meal, RecipeIngredient, Dietary
+from . import metrics
+from .generation import (
+    GenerationError, normalize_dietary, parse_generation_options, run_generation, stream_generation,
+)
+from .jobs import job_payload, submit_generation_job, wake_workers
+from .models import GenerationJob, parse_allergens
+from .conditional import conditional_on_content
+from .planning import get_monthly_plan, target_month
+from .scheduler import plan_constraints
 from .serializers import MealSerializer
-from .services import validate_menu, compute_totals
-from .prompts import build_menu_prompt   
-
-client = OpenAI()
-
-
-# ---------- helpers ----------
-DIETARY_CANONICAL = {
-    "standard": "Standard",
-    "vegan": "Vegan",
-    "vegetarian": "Vegetarian",
-    "halal": "Halal",
-    "gluten-free": "Gluten-free",
-    "gluten_free": "Gluten-free",
-    "glutenfree": "Gluten-free",
-}
-
-def normalize_dietary(name: str | None) -> str:
-    """
-    Normalize dietary string input (case-insensitive, handles aliases).
-    Examples:
-        - "vegan", "Vegan" -> "Vegan"
-        - "gluten_free" -> "Gluten-free"
-        - None or unknown -> "Standard"
-    """
-    if not name:
-        return "Standard"
-    key = name.strip().lower()
-    return DIETARY_CANONICAL.get(key, "Standard")
-
-def get_ingredients_for_dietary(dietary: str) -> QuerySet[Ingredient]:
-    """
-    - Standard: all ingredients
-    - Others: Ingredient that has that Dietary tag (ManyToMany)
-    """
-    if dietary == "Standard":
-        return Ingredient.objects.all().order_by("name")
-    return (
-        Ingredient.objects
-        .filter(dietaries__name__iexact=dietary)
-        .distinct()
-        .order_by("name")
-    )
-
-def to_prompt_block(ings: Iterable[Ingredient]) -> str:
-    """
-    Convert ingredients to the concise block the prompt expects:
-    'name, price_per_100g, energy_kj'
-    """
-    lines = []
-    for i in ings:
-        price = f"{i.price_per_100g:.2f}"
-        kj = f"{i.energy_kj:.0f}"
-        lines.append(f"{i.name}, {price}, {kj}")
-    return "\n".join(lines)
 
 
 # ---------- views ----------
@@ -78,143 +28,135 @@ class GenerateMenusView(APIView):
     Body (JSON):
       {
         "batch_size": 5,          # optional, default 5
-        "dietary": "Vegan"        # optional, default "Standard"
+        "dietary": "Vegan",       # optional, default "Standard"
+        "concurrency": 4,         # optional, LLM calls in flight (max 8), default 1
+        "chunk_size": 3,          # optional, menus per LLM call,
+                                  #   default batch_size / concurrency
+        "engine": "local",        # optional, "llm" (default) or "local" solver
+        "seed": 1,                # optional, varies the local solver's menus
+        "async": true,            # optional, queue a job instead of waiting
+        "stream": true            # optional, stream each meal as it is saved
+                                  #   (NDJSON; "sse" for server-sent events)
       }
     Response 201:
-      { "saved": [ <MealSerializer with totals...> ] }
+      {
+        "saved": [ <MealSerializer with totals...> ],
+        "validation": { "unchanged": 3, "repaired": 1, "rejected": 1, "duplicate": 0 }
+      }
+    Menus that duplicate or nearly duplicate a meal of the same dietary
+    (or each other) are dropped before anything is written (dedupe.py).
+    Response 202 (async):
+      { "id": 7, "status": "pending", ... }   # poll GET /api/generate-menus/7/
+    Response 200 (stream): NDJSON, one event per line, or server-sent
+    events with "stream": "sse":
+      {"event": "meal", "meal": <MealSerializer with totals...>}
+      {"event": "rejected", "meal_name": "..."}
+      {"event": "duplicate", "meal_name": "..."}
+      {"event": "error", "error": "..."}    # the model output; ends the stream
+      {"event": "error", "meal_name": "...", "error": "..."}   # saving that meal
+      {"event": "done", "saved": 4, "validation": {...}}
     """
     def post(self, request):
-        # Parse batch_size from request (default 5)
         try:
-            batch_size = int(request.data.get("batch_size", 5))
-        except Exception:
-            return Response({"error": "batch_size must be an integer."}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Normalize dietary string
-        dietary = normalize_dietary(request.data.get("dietary"))
-        # Filter available ingredients
-        qs = get_ingredients_for_dietary(dietary)
-
-        # If not enough ingredients, abort early (GPT can't build valid menus)
-        if qs.count() < 6:
-            return Response(
-                {"error": f"Not enough ingredients for dietary '{dietary}'. Please add more."},
-                status=status.HTTP_400_BAD_REQUEST,
-            )
-            
-        # Build GPT prompt
-        ingredients_block = to_prompt_block(qs)
-        prompt = build_menu_prompt(ingredients_block, batch_size=batch_size, dietary=dietary)
+            options = parse_generation_options(request.data)
+        except GenerationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Async mode: queue a job and return its id right away
+        if request.data.get("async") in (True, "true", "1", 1):
+            job = submit_generation_job(options)
+            return Response(job_payload(job), status=status.HTTP_202_ACCEPTED)
+
+        # Streaming mode: save and push each meal as soon as the model finishes it
+        stream = request.data.get("stream")
+        if stream in (True, "true", "1", 1, "ndjson", "sse"):
+            try:
+                events = stream_generation(**options)
+            except GenerationError as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            return stream_events(events, sse=stream == "sse")
 
-        # ---- call GPT
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            response_format={"type": "json_object"},
-            temperature=0.4,
-            messages=[{"role": "user", "content": prompt}],
-        )
-
-        # ---- parse JSON
         try:
-            payload = json.loads(resp.choices[0].message.content)
-            menus = payload.get("menus", [])
-            if not isinstance(menus, list):
-                raise ValueError("`menus` must be a list.")
-        except Exception:
-            return Response({"error": "Model did not return valid JSON."}, status=status.HTTP_400_BAD_REQUEST)
-
-        saved_meals = []
-
-        # ---- validate + save to DB
-        for m in menus:
-            meal_name = m.get("meal_name", "Unknown Meal")
-            items = m.get("items") or []
-            ok, data = validate_menu(items, min_kj=2000, max_cost=3.5, min_g=200, max_g=500)
-
-            if not ok:
-                print(f"Menu failed: {meal_name}")
-                print(f"Reason: {data}")  
-                continue
+            result = run_generation(**options)
+        except GenerationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-            meal_name = (m.get("meal_name") or "Generated Meal").strip()[:160]
-            desc = (m.get("description") or "Generated by GPT").strip()
-
-            dietary_name = m.get("dietary") or dietary
-            dietary_name = normalize_dietary(dietary_name)
-            dietary_obj, _ = Dietary.objects.get_or_create(name=dietary_name)
-
-            meal = Meal.objects.create(
-                name=meal_name,
-                description=desc,
-                dietary=dietary_obj,
+        if not result.saved:
+            return Response(
+                {"message": "No valid menus generated this round.", "validation": result.validation},
+                status=status.HTTP_200_OK,
             )
 
-            # attach items
-            failed = False
-            for it in items:
-                ing = Ingredient.objects.filter(name__iexact=it.get("name", "")).first()
-                if not ing:
-                    failed = True
-                    break
-                try:
-                    qty = Decimal(str(it["quantity_g"]))
-                except Exception:
-                    failed = True
-                    break
-                RecipeIngredient.objects.create(recipe=meal, ingredient=ing, quantity_g=qty)
-
-            # Rollback if any item failed
-            if failed:
-                meal.delete()
-                continue
-
-            # augment totals for response (server-truth computation)
-            db_items = [
-                {"name": ri.ingredient.name, "quantity_g": ri.quantity_g}
-                for ri in meal.items.select_related("ingredient").all()
-            ]
-            total_kj, total_cost = compute_totals(db_items)
-
-            # Serialize meal + add computed totals
-            serialized = MealSerializer(meal).data
-            serialized["total_energy_kj"] = float(total_kj)
-            serialized["total_cost"] = float(total_cost)
-            saved_meals.append(serialized)
-
-        if not saved_meals:
-            return Response({"message": "No valid menus generated this round."}, status=status.HTTP_200_OK)
-
-        return Response({"saved": saved_meals}, status=status.HTTP_201_CREATED)
+        return Response(
+            {"saved": result.saved, "validation": result.validation}, status=status.HTTP_201_CREATED
+        )
 
-DIETARY_CANONICAL = {
-    "standard": "Standard",
-    "vegan": "Vegan",
-    "vegetarian": "Vegetarian",
-    "halal": "Halal",
-    "gluten-free": "Gluten-free",
-    "gluten_free": "Gluten-free",
-    "glutenfree": "Gluten-free",
-}
 
-def normalize_dietary(name: str | None) -> str:
+def stream_events(events, sse=False) -> StreamingHttpResponse:
     """
-    將各種寫法（vegan / Vegan / GLUTEN_FREE ...）正規化成資料庫用的名稱。
-    如果傳 None 或未知字串，回傳 'Standard'
+    Stream generation events as NDJSON lines or server-sent events.
     """
-    if not name:
-        return "Standard"
-    key = str(name).strip().lower()
-    return DIETARY_CANONICAL.get(key, "Standard")
+    if sse:
+        lines = (
+            f"event: {e['event']}\ndata: {json.dumps(e, cls=JSONEncoder)}\n\n" for e in events
+        )
+        content_type = "text/event-stream"
+    else:
+        lines = (json.dumps(e, cls=JSONEncoder) + "\n" for e in events)
+        content_type = "application/x-ndjson"
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # don't let nginx buffer the stream
+    return response
 
 
+class GenerationJobView(APIView):
+    """
+    GET /api/generate-menus/<id>/
+
+    Report an async generation job (see GenerateMenusView "async").
+    Response 200:
+      {
+        "id": 7,
+        "status": "running",      # pending | running | succeeded | failed
+        "stage": "saving",        # prompting | validating | saving
+        "progress": { "done": 3, "total": 5 },
+        "message": "",            # error text when failed
+        "validation": { "unchanged": 3, "repaired": 1, "rejected": 1, "duplicate": 0 },
+        "created_at": "...", "started_at": "...", "finished_at": null,
+        "saved": [ <MealSerializer...> ]   # meals saved so far
+      }
+    Polling an unfinished job wakes this process's workers, so jobs queued
+    before a restart, or left running by a dead worker, get picked up.
+    """
+    def get(self, request, pk):
+        job = GenerationJob.objects.filter(pk=pk).first()
+        if job is None:
+            return Response({"error": "Generation job not found."}, status=status.HTTP_404_NOT_FOUND)
+        if job.status in (GenerationJob.PENDING, GenerationJob.RUNNING):
+            wake_workers()
+        meals = job.meals.with_items().with_totals().order_by("id")
+        return Response(
+            {**job_payload(job), "saved": MealSerializer(meals, many=True).data},
+            status=status.HTTP_200_OK,
+        )
 
 class MonthlyMenuView(APIView):
     """
-    GET /api/monthly-menu/?dietary=Standard
+    GET /api/monthly-menu/?dietary=Standard&exclude_allergens=peanut,milk
 
     Generate a "monthly calendar menu" for the next month.
     - Only assigns meals to weekdays (Mon–Fri).
-    - Each weekday is randomly assigned an available meal.
+    - Meals are scheduled under MONTHLY_PLAN_CONSTRAINTS (scheduler.py):
+      no repeats within a window, a monthly budget, minimum average
+      protein / energy, protein and cuisine variety within each week.
+    - exclude_allergens (optional) leaves out meals containing any of the
+      listed allergens; the payload then lists them in "excludedAllergens".
+    - The plan is stored per (dietary, month, excluded allergens) and stays
+      the same until the dietary's meals change or an admin regenerates it
+      (planning.py);
+      responses carry ETag (content version + month + constraints) and
+      Last-Modified; repeat visits get 304, If-None-Match without a query.
 
     Response example:
     {
@@ -223,57 +165,52 @@ class MonthlyMenuView(APIView):
       "menuItems": [
         { "date": "2025-09-01", "mealId": "12", "menuName": "Karaage Crunch Bowl" },
         ...
-      ]
+      ],
+      "constraints": { "no_repeat_days": 10, "monthly_budget": 60, ... },
+      "summary": { "totalCost": 57.4, "avgProtein": 31.2, "avgEnergyKj": 2710.5,
+                   "satisfied": { "noRepeat": true, "budget": true, ... } }
     }
     """
+    @conditional_on_content(extra=lambda view, request: (target_month(), plan_constraints()))
     def get(self, request):
         # 1) Target month = next calendar month
-        today = timezone.localdate()
-        if today.month == 12:
-            year, month = today.year + 1, 1
-        else:
-            year, month = today.year, today.month + 1
-
-        first_day = date(year, month, 1)
-        days_in_month = calendar.monthrange(year, month)[1]
-        # Python weekday(): Mon=0..Sun=6, but frontend expects Sun=0..Sat=6
-        start_day = (first_day.weekday() + 1) % 7
+        year, month = target_month()
 
-        # 2) Filter meals by dietary type (default Standard)
+        # 2) Stored plan for (dietary, month, allergens), built on first use (default Standard)
         dietary = normalize_dietary(request.GET.get("dietary") or "Standard")
-
-        qs = Meal.objects.all()
-        if dietary == "Standard":
-            # Standard includes meals explicitly tagged Standard OR with no dietary tag
-            qs = qs.filter(Q(dietary__name__iexact="Standard") | Q(dietary__isnull=True))
-        else:
-            qs = qs.filter(dietary__name__iexact=dietary)
-
-        meals = list(qs)
-        if not meals:
+        try:
+            excluded = parse_allergens(request.GET.get("exclude_allergens"))
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        plan = get_monthly_plan(dietary, year, month, excluded)
+        if plan is None:
             return Response(
                 {"error": f"No meals available for dietary '{dietary}'."},
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        # 3) Assign a random meal to each weekday (Mon–Fri), repeat allowed
-        menu_items = []
-        for day in range(1, days_in_month + 1):
-            d = date(year, month, day)
-            wd = d.weekday()  # Mon=0..Sun=6
-            if wd <= 4:       # 只排週一~週五
-                m = random.choice(meals)
-                menu_items.append({
-                    "date": d.isoformat(),
-                    "mealId": str(m.id),
-                    "menuName": m.name,
-                })
+        # 3) If-Modified-Since: 304 when the client already has this plan
+        #    (If-None-Match is answered by the decorator before any query)
+        last_modified = int(plan.updated_at.timestamp())
+        response = get_conditional_response(request, last_modified=last_modified)
+        if response is None:
+            response = Response(plan.payload, status=status.HTTP_200_OK)
+        response["Last-Modified"] = http_date(last_modified)
+        return response
+
 
-        payload = {
-            #"year": year,
-            #"month": month,
-            "startDay": start_day,
-            "daysInMonth": days_in_month,
-            "menuItems": menu_items,
-        }
-        return Response(payload, status=status.HTTP_200_OK)
+def metrics_view(request):
+    """
+    GET /metrics
+    Counters and histograms from kaiapp/metrics.py in Prometheus text format.
+    Requires "Authorization: Bearer <METRICS_TOKEN>" when that setting is set;
+    without a token it is only served with DEBUG on or to INTERNAL_IPS
+    clients, and is a 404 for everyone else.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}"):
+            return HttpResponse(status=401)
+    elif not (settings.DEBUG or request.META.get("REMOTE_ADDR") in settings.INTERNAL_IPS):
+        raise Http404
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -1,6 +1,18 @@
-from rest_framework import viewsets
-from .models import Meal
-from .serializers import MealSerializer
+from rest_framework import filters, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from .catalog import parse_dietaries
+from .conditional import conditional_on_content
+from .models import Meal, parse_allergens
+from .pagination import MealCursorPagination
+from .renderers import FastJSONRenderer
+from .serializers import MealSerializer, meal_rows
+from .similarity import meal_matrix
+
+# Largest ?k= accepted by /meals/{id}/similar/
+MAX_SIMILAR = 50
 
 class MealViewSet(viewsets.ModelViewSet):
     """
@@ -13,8 +25,140 @@ class MealViewSet(viewsets.ModelViewSet):
     - PUT /meals/{id}/   → update an existing meal (full update)
     - PATCH /meals/{id}/ → update an existing meal (partial update)
     - DELETE /meals/{id}/→ delete a meal
+    - GET /meals/{id}/similar/?k=10
+                         → nearest meals of the same dietary (swap suggestions)
+
+    Query params (list):
+    - ?dietary=Vegan           → only meals of that dietary
+    - ?exclude_allergens=peanut,milk
+                               → only meals with none of these allergens
+                                 (one bitwise check on the totals snapshot)
+    - ?compatible=Halal,Gluten-free
+                               → only meals whose every ingredient carries
+                                 all these dietaries (same kind of check)
+    - ?ordering=total_cost     → sort by name or any total, "-" for descending
+    - ?page_size=50 / ?cursor= → cursor pages {"next", "previous", "results"}
+                                 (without them the list is not paginated)
+    - ?fields=id,name,dietary  → sparse fieldset (list and detail); fields
+                                 left out are neither queried nor computed
+
+    List and detail send an ETag from the content version and the query
+    (conditional.py); a matching If-None-Match gets 304 without any query.
 
     Uses MealSerializer to control how Meal objects are represented.
+    Items and ingredients are prefetched and totals come from the MealTotals
+    snapshot, so a page of meals costs a fixed number of queries and
+    "cheapest vegan meals" is an indexed sort. The list endpoint skips the
+    serializer: rows come from values() queries (serializers.meal_rows)
+    and are encoded by FastJSONRenderer, with the same output.
     """
-    queryset = Meal.objects.all()
-    serializer_class = MealSerializer
\ No newline at end of file
+    queryset = Meal.objects.with_items().with_totals()
+    serializer_class = MealSerializer
+    pagination_class = MealCursorPagination
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    filter_backends = [filters.OrderingFilter]
+    ordering_fields = [
+        "id", "name", "total_energy_kj", "total_protein", "total_fat",
+        "total_carbs", "total_fiber", "total_cost",
+    ]
+
+    def get_queryset(self):
+        fields = self.requested_fields()
+        # Sorting by a total needs the snapshot even if it is not returned
+        sort_keys = self.request.query_params.get("ordering", "").replace("-", "").split(",")
+        if self.action == "list":
+            # Rows are read by meal_rows(); only filtering and ordering happen here
+            qs = Meal.objects.for_fields(sort_keys)
+        elif fields is None:
+            qs = super().get_queryset()
+        else:
+            qs = Meal.objects.for_fields([*fields, *sort_keys])
+        dietary = self.request.query_params.get("dietary")
+        if dietary:
+            qs = qs.filter(dietary__name__iexact=dietary)
+        try:
+            excluded = parse_allergens(self.request.query_params.get("exclude_allergens"))
+        except ValueError as e:
+            raise ValidationError({"exclude_allergens": str(e)})
+        try:
+            compatible = parse_dietaries(self.request.query_params.get("compatible"))
+        except ValueError as e:
+            raise ValidationError({"compatible": str(e)})
+        return qs.exclude_allergens(excluded).compatible_with(compatible)
+
+    @conditional_on_content()
+    def list(self, request, *args, **kwargs):
+        fields = self.requested_fields()
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(meal_rows(page, fields))
+        return Response(meal_rows(queryset, fields))
+
+    @conditional_on_content()
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+    @action(detail=True, methods=["get"])
+    @conditional_on_content()
+    def similar(self, request, pk=None):
+        """
+        Up to k (default 10, max 50) meals of the same dietary, closest
+        first by normalized nutrition/cost profile and ingredient overlap
+        (similarity.py), as list rows plus "similarity" and
+        "ingredient_overlap". Honours ?exclude_allergens= and ?fields=.
+        """
+        if not str(pk).isdigit():
+            raise NotFound()
+        meal_id = int(pk)
+        try:
+            k = int(request.query_params.get("k", 10))
+        except ValueError:
+            raise ValidationError({"k": "k must be an integer."})
+        if not 1 <= k <= MAX_SIMILAR:
+            raise ValidationError({"k": f"k must be between 1 and {MAX_SIMILAR}."})
+        try:
+            excluded = parse_allergens(request.query_params.get("exclude_allergens"))
+        except ValueError as e:
+            raise ValidationError({"exclude_allergens": str(e)})
+
+        neighbours = meal_matrix.similar(meal_id, k, excluded)
+        if neighbours is None:
+            if not Meal.objects.filter(pk=meal_id).exists():
+                raise NotFound()
+            neighbours = []  # no totals snapshot yet
+        fields = self.requested_fields()
+        rows = meal_rows(
+            Meal.objects.filter(pk__in=[n.meal_id for n in neighbours]),
+            None if fields is None else [*fields, "id"],  # rows are matched back by id
+        )
+        by_id = {row["id"]: row for row in rows}
+        results = []
+        for n in neighbours:
+            row = by_id.get(n.meal_id)
+            if row is None:
+                continue
+            if fields is not None and "id" not in fields:
+                row = {key: value for key, value in row.items() if key != "id"}
+            results.append({**row, "similarity": round(n.similarity, 4), "ingredient_overlap": round(n.overlap, 4)})
+        return Response(results)
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.requested_fields()
+        if fields is not None:
+            kwargs["fields"] = fields
+        return super().get_serializer(*args, **kwargs)
+
+    def requested_fields(self):
+        """
+        Field names from ?fields= on list/retrieve, or None for all fields.
+        Raises ValidationError on unknown names.
+        """
+        raw = self.request.query_params.get("fields") if self.action in ("list", "retrieve", "similar") else None
+        if not raw:
+            return None
+        fields = [name.strip() for name in raw.split(",") if name.strip()]
+        unknown = [name for name in fields if name not in MealSerializer.Meta.fields]
+        if unknown:
+            raise ValidationError({"fields": f"Unknown fields: {', '.join(unknown)}."})
+        return fields